@@ -0,0 +1,11 @@
+"""
+Benchmarks of the ingestion, scoring, history, scheduling and api paths
+
+Notes:
+    python -m benchmarks --save-baseline records baseline.json on the current machine,
+    python -m benchmarks then fails with exit code 1 when a median is slower than the baseline by more than --threshold
+    or when there is no baseline to compare with, --no-baseline only reports the timings
+    The database is seeded from a fixed seed and Open-Meteo is served by a local stub, no network is used
+    python -m benchmarks.load simulates boards and ui sessions against routes.app served by uvicorn (or --url)
+    and reports throughput and latency percentiles per route
+"""
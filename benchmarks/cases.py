@@ -0,0 +1,54 @@
+import datetime as dt
+import itertools
+from typing import Any, Callable
+from fastapi.testclient import TestClient
+
+import scarlet.core.config as config
+import scarlet.core.scheduler as scheduler
+import scarlet.db.models as models
+import scarlet.api.routes as routes
+from scarlet.services.arduino_weather import service as arduino_service
+
+
+class Case:
+    """A timed call, run `number` times per repeat, setup runs untimed before every repeat"""
+
+    def __init__(self, name: str, run: Callable[[], Any], number: int, setup: Callable[[], Any] | None = None):
+        self.name = name
+        self.run = run
+        self.number = number
+        self.setup = setup
+
+
+def weather_samples(count: int = 1000) -> Callable[[], models.ArduinoWeatherData]:
+    samples = [models.ArduinoWeatherData(wind=300 + index % 200, light_1=index % 1000, light_2=(index * 7) % 1000, rain=int(index % 20 == 0))
+               for index in range(count)]
+    return itertools.cycle(samples).__next__
+
+
+def build_cases(client: TestClient) -> list[Case]:
+    irrigation = config.Controller.controllers_by_class_name['IrrigationController']
+    next_sample = weather_samples()
+    day_ago = (dt.datetime.now() - dt.timedelta(days=1)).isoformat()
+    week_ago = (dt.datetime.now() - dt.timedelta(days=7)).isoformat()
+    sample_body = {'wind': 512, 'light_1': 300, 'light_2': 400, 'rain': 0}
+    return [
+        Case('append_weather_data', lambda: arduino_service.append_weather_data(next_sample()), number=2000),
+        Case('get_current_weather', arduino_service.get_current_weather, number=2000),
+        Case('calculate_score', irrigation.calculate_score, number=2000),
+        Case('get_history_day', lambda: arduino_service.get_history(dt.datetime.fromisoformat(day_ago)), number=20),
+        Case('scheduling_programs', irrigation.scheduling_programs, number=5, setup=scheduler.service.clear),
+        Case('route_get_weather', lambda: client.get('/weather'), number=200),
+        Case('route_post_weather', lambda: client.post('/weather', json=sample_body), number=200),
+        Case('route_get_blinds', lambda: client.get('/blinds'), number=200),
+        Case('route_get_irrigation', lambda: client.get('/irrigation'), number=200),
+        Case('route_get_programs', lambda: client.get('/irrigation/program/all'), number=20),
+        Case('route_get_score', lambda: client.get('/open_weather/score'), number=200),
+        Case('route_get_open_weather', lambda: client.get('/open_weather'), number=200),
+        Case('route_get_history_raw_day', lambda: client.get('/weather/history', params={'since': day_ago}), number=20),
+        Case('route_get_history_hour_week', lambda: client.get('/weather/history', params={'since': week_ago, 'resolution': 'hour'}), number=50),
+    ]
+
+
+def make_client() -> TestClient:
+    return TestClient(routes.app)
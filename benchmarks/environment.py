@@ -0,0 +1,141 @@
+import asyncio
+import datetime as dt
+import os
+import shutil
+import tempfile
+import numpy as np
+import yaml
+
+import scarlet.core.log as log_
+import scarlet.core.config as config
+import scarlet.core.scheduler as scheduler
+import scarlet.db.models as models
+from scarlet.db.db import service as db_service
+from scarlet.services.arduino_weather import service as arduino_service
+from scarlet.services.open_weather import service as open_weather_service
+from scarlet.services.blinds import BlindsController
+from scarlet.services.irrigation import IrrigationController
+from benchmarks.stub import StubOpenMeteo, synthetic_hour
+
+save_frequency = 5
+
+services_config = {
+    'ArduinoWeatherService': {
+        'anemometer_milli_volt_out_min': 400,
+        'anemometer_milli_volt_out_max': 2000,
+        'anemometer_max_meter_per_sec': 32.4,
+        'arduino_max_milli_input_voltage': 5000,
+        'arduino_input_resolution': 1023,
+        'save_frequency': save_frequency,
+        'local_cache_size': 60,
+    },
+    'IrrigationScoreService': {},
+}
+
+controllers_config = {
+    IrrigationController.__name__: {'automation': False},
+    BlindsController.__name__: {'temperature_limit': 25, 'light_limit': 1000, 'cloud_cover_limit': 50, 'automation': False},
+}
+
+
+def seed_arduino_weather(rng: np.random.Generator, days: int, now: dt.datetime):
+    """A sample every save_frequency minutes, written with one executemany and rolled up once"""
+    start = now - dt.timedelta(days=days)
+    count = days * 24 * 60 // save_frequency
+    timestamps = [(start + dt.timedelta(minutes=save_frequency * index)).isoformat(sep=' ') for index in range(count)]
+    wind = np.round(np.abs(rng.normal(8, 4, count)), 1)
+    light_1 = rng.integers(0, 1000, count)
+    light_2 = rng.integers(0, 1000, count)
+    rain = (rng.random(count) < 0.05).astype(np.int64)
+    with db_service.session_scope() as session:
+        cursor = session.connection().connection.cursor()
+        cursor.executemany(f"INSERT INTO {models.ArduinoWeatherData.__tablename__} (timestamp, wind, light_1, light_2, rain) VALUES (?, ?, ?, ?, ?)",
+                           zip(timestamps, wind.tolist(), light_1.tolist(), light_2.tolist(), rain.tolist()))
+        session.commit()
+    arduino_service.rebuild_rollups()
+
+
+def seed_historical_weather(days: int, now: dt.datetime):
+    start = now.replace(minute=0, second=0, microsecond=0) - dt.timedelta(days=days)
+    hours = [start + dt.timedelta(hours=index) for index in range(days * 24)]
+    db_service.add_all([models.HistoricalWeather(timestamp=hour, **synthetic_hour(hour)) for hour in hours])
+
+
+def seed_programs(rng: np.random.Generator, programs: int):
+    with db_service.session_scope() as session:
+        for index in range(programs):
+            lower = float(rng.uniform(0, 3))
+            program = models.IrrigationProgram(name=f"program {index}", frequency=int(rng.integers(1, 4)), lower_score=lower,
+                                               upper_score=lower + float(rng.uniform(0.2, 1.5)), is_active=bool(rng.random() < 0.8))
+            program.sessions = [models.IrrigationProgramSession(start_time=dt.time(int(rng.integers(4, 22)), int(rng.integers(0, 60))),
+                                                                zone1=int(rng.integers(0, 30)), zone2=int(rng.integers(0, 30)),
+                                                                zone3=int(rng.integers(0, 30)), zone_connected=True)
+                                for _ in range(int(rng.integers(1, 5)))]
+            session.add(program)
+        session.commit()
+
+
+def seed_ran_sessions(rng: np.random.Generator, days: int, now: dt.datetime):
+    """A ran session every one to three days, the last one before today"""
+    sessions, day = list(), days
+    while day > 0:
+        timestamp = dt.datetime.combine((now - dt.timedelta(days=day)).date(), dt.time(int(rng.integers(4, 22))))
+        sessions.append(models.RanIrrigationSessionHistory(timestamp=timestamp, zone1=int(rng.integers(0, 30)), zone2=int(rng.integers(0, 30)),
+                                                           zone3=int(rng.integers(0, 30)), zone_connected=1))
+        day -= int(rng.integers(1, 4))
+    db_service.add_all(sessions)
+
+
+class Environment:
+    """
+    Configured services over a seeded temporary database, with Open-Meteo served by a local stub
+
+    Notes:
+        The same seed gives the same data, samples and weather hours end at the time of seeding
+        Services are the process wide singletons, one environment is open at a time
+    """
+
+    def __init__(self, days: int = 365, programs: int = 300, seed: int = 0, storage_mode: str = 'wal'):
+        self.days = days
+        self.programs = programs
+        self.seed = seed
+        self.storage_mode = storage_mode
+        self.directory: str | None = None
+        self.stub: StubOpenMeteo | None = None
+
+    def __enter__(self) -> 'Environment':
+        self.directory = tempfile.mkdtemp(prefix='scarlet-bench-')
+        self.stub = StubOpenMeteo().__enter__()
+        database = {'database': os.path.join(self.directory, 'bench.db'), 'storage_mode': self.storage_mode}
+        config.Process.configure_all(self.config_path, {'logging': {'filename': os.path.join(self.directory, 'bench.log')},
+                                                        'services': {'Database': database}})
+        log_.service.set_log_level(log_.LogLevels.warning)
+
+        rng = np.random.default_rng(self.seed)
+        now = dt.datetime.now()
+        seed_arduino_weather(rng, self.days, now)
+        seed_historical_weather(self.days, now)
+        seed_programs(rng, self.programs)
+        seed_ran_sessions(rng, self.days, now)
+
+        process_config = {
+            'services': {'OpenWeatherService': {'url': self.stub.url}, **services_config},
+            'controllers': controllers_config,
+        }
+        with open(self.config_path, 'w') as file:
+            yaml.safe_dump({**process_config, 'services': {'Database': database, **process_config['services']}}, file)
+        config.Process.configure_all(self.config_path, process_config)
+        log_.service.set_log_level(log_.LogLevels.warning)
+        open_weather_service.refresh()
+        return self
+
+    @property
+    def config_path(self) -> str:
+        return os.path.join(self.directory, 'config.yaml')
+
+    def __exit__(self, *exc):
+        scheduler.service.clear()
+        open_weather_service.close()
+        asyncio.run(db_service.dispose())
+        self.stub.__exit__(*exc)
+        shutil.rmtree(self.directory, ignore_errors=True)
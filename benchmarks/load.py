@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import json
+import random
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+import httpx
+import numpy as np
+import uvicorn
+
+from benchmarks.environment import Environment
+
+
+class LoadReport:
+    """
+    Latencies and status codes by route
+
+    Notes:
+        Latency is counted from the time the request was due, not from when it was sent, so a server that falls
+        behind shows up in the percentiles instead of silently lowering the request rate
+    """
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.not_modified: dict[str, int] = defaultdict(int)
+
+    def record(self, route: str, latency: float, status: int | None):
+        self.latencies[route].append(latency)
+        if status is None or status >= 400:
+            self.errors[route] += 1
+        elif status == 304:
+            self.not_modified[route] += 1
+
+    def summary(self, duration: float) -> dict[str, dict[str, float]]:
+        summary = dict()
+        for route, latencies in sorted(self.latencies.items()):
+            milliseconds = np.array(latencies) * 1000
+            p50, p90, p99 = np.percentile(milliseconds, (50, 90, 99))
+            summary[route] = {'requests': len(latencies), 'errors': self.errors[route], 'not_modified': self.not_modified[route],
+                              'rps': len(latencies) / duration, 'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99, 'max_ms': milliseconds.max()}
+        return summary
+
+    @staticmethod
+    def format(summary: dict[str, dict[str, float]]) -> str:
+        lines = [f"{'route':34} {'requests':>9} {'errors':>7} {'304':>7} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}"]
+        for route, row in summary.items():
+            lines.append(f"{route:34} {row['requests']:9d} {row['errors']:7d} {row['not_modified']:7d} {row['rps']:8.1f} "
+                         f"{row['p50_ms']:8.2f} {row['p90_ms']:8.2f} {row['p99_ms']:8.2f} {row['max_ms']:8.2f}")
+        return '\n'.join(lines)
+
+
+async def timed(client: httpx.AsyncClient, report: LoadReport, due: float, method: str, path: str, **kwargs) -> httpx.Response | None:
+    try:
+        response = await client.request(method, path, **kwargs)
+        status = response.status_code
+    except httpx.HTTPError:
+        response, status = None, None
+    report.record(f"{method} {path}", time.perf_counter() - due, status)
+    return response
+
+
+async def every(interval: float, offset: float, stop_at: float, action):
+    """Calls action(due) on a fixed schedule, late calls are not skipped so the backlog is measured"""
+    due = time.perf_counter() + offset
+    while due < stop_at:
+        await asyncio.sleep(max(due - time.perf_counter(), 0))
+        await action(due)
+        due += interval
+
+
+async def board(client: httpx.AsyncClient, report: LoadReport, rng: random.Random, stop_at: float, post_interval: float, poll_interval: float):
+    """A weather and actuator board, posts samples and polls the blinds and irrigation state with their etags"""
+    etags: dict[str, str] = dict()
+
+    async def post(due: float):
+        sample = {'wind': rng.randint(300, 700), 'light_1': rng.randint(0, 1000), 'light_2': rng.randint(0, 1000), 'rain': int(rng.random() < 0.05)}
+        await timed(client, report, due, 'POST', '/weather', json=sample)
+
+    async def poll(due: float):
+        for path in ('/blinds', '/irrigation'):
+            headers = {'If-None-Match': etags[path]} if path in etags else {}
+            response = await timed(client, report, due, 'GET', path, headers=headers)
+            if response is not None and 'etag' in response.headers:
+                etags[path] = response.headers['etag']
+
+    await asyncio.gather(every(post_interval, rng.uniform(0, post_interval), stop_at, post),
+                         every(poll_interval, rng.uniform(0, poll_interval), stop_at, poll))
+
+
+async def ui_session(client: httpx.AsyncClient, report: LoadReport, rng: random.Random, stop_at: float, interval: float):
+    """A browser tab reloading the irrigation page, which loads the programs and the score in parallel"""
+    async def load(due: float):
+        await asyncio.gather(timed(client, report, due, 'GET', '/irrigation/program/all'),
+                             timed(client, report, due, 'GET', '/open_weather/score'))
+
+    await every(interval, rng.uniform(0, interval), stop_at, load)
+
+
+async def run_load(base_url: str, boards: int, ui_sessions: int, duration: float, post_interval: float, poll_interval: float,
+                   ui_interval: float, seed: int = 0) -> dict[str, dict[str, float]]:
+    report = LoadReport()
+    rng = random.Random(seed)
+    limits = httpx.Limits(max_connections=2 * boards + 2 * ui_sessions, max_keepalive_connections=2 * boards + 2 * ui_sessions)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        stop_at = time.perf_counter() + duration
+        await asyncio.gather(*(board(client, report, random.Random(rng.random()), stop_at, post_interval, poll_interval) for _ in range(boards)),
+                             *(ui_session(client, report, random.Random(rng.random()), stop_at, ui_interval) for _ in range(ui_sessions)))
+    return report.summary(duration)
+
+
+class LocalServer:
+    """routes.app served by uvicorn on a free local port, in a background thread with its own event loop"""
+
+    def __init__(self):
+        from scarlet.api.routes import app
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('127.0.0.1', 0))
+        self._server = uvicorn.Server(uvicorn.Config(app, lifespan='off', log_level='warning', access_log=False))
+        self._thread = threading.Thread(target=self._server.run, kwargs={'sockets': [self._socket]}, name='load-server', daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._socket.getsockname()[1]}'
+
+    def __enter__(self) -> 'LocalServer':
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join()
+        self._socket.close()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load', description="Simulated boards and ui sessions against one instance")
+    parser.add_argument('--url', help="Instance to load, by default routes.app is served locally over a seeded database")
+    parser.add_argument('--boards', type=int, default=10)
+    parser.add_argument('--ui', type=int, default=2, help="UI sessions")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds")
+    parser.add_argument('--post-interval', type=float, default=1, help="Seconds between samples of a board")
+    parser.add_argument('--poll-interval', type=float, default=2, help="Seconds between state polls of a board")
+    parser.add_argument('--ui-interval', type=float, default=5, help="Seconds between page loads of a ui session")
+    parser.add_argument('--days', type=int, default=30, help="Days of seeded history for the local instance")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the summary to this json file")
+    args = parser.parse_args(argv)
+
+    load = dict(boards=args.boards, ui_sessions=args.ui, duration=args.duration, post_interval=args.post_interval,
+                poll_interval=args.poll_interval, ui_interval=args.ui_interval, seed=args.seed)
+    if args.url:
+        summary = asyncio.run(run_load(args.url, **load))
+    else:
+        with Environment(days=args.days, seed=args.seed), LocalServer() as server:
+            summary = asyncio.run(run_load(server.url, **load))
+
+    print(LoadReport.format(summary))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'load': load, 'routes': summary}, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
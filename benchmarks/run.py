@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from benchmarks.environment import Environment
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def time_case(case, repeats: int) -> dict[str, float]:
+    """Seconds per call, median and best of the repeats after one warmup call"""
+    if case.setup:
+        case.setup()
+    case.run()
+    per_call = list()
+    for _ in range(repeats):
+        if case.setup:
+            case.setup()
+        start = time.perf_counter()
+        for _ in range(case.number):
+            case.run()
+        per_call.append((time.perf_counter() - start) / case.number)
+    return {'median': statistics.median(per_call), 'min': min(per_call), 'number': case.number, 'repeats': repeats}
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], threshold: float) -> list[str]:
+    """Names of the cases whose median is slower than the baseline by more than threshold (0.25 = 25%)"""
+    return [name for name, result in results.items()
+            if name in baseline and result['median'] > baseline[name]['median'] * (1 + threshold)]
+
+
+def run(days: int, programs: int, seed: int, repeats: int, only: list[str] | None = None) -> dict:
+    from benchmarks.cases import build_cases, make_client
+    with Environment(days=days, programs=programs, seed=seed):
+        with make_client() as client:
+            results = dict()
+            for case in build_cases(client):
+                if only and case.name not in only:
+                    continue
+                results[case.name] = time_case(case, repeats)
+                print(f"{case.name:32} {results[case.name]['median'] * 1e6:12.1f} us  (min {results[case.name]['min'] * 1e6:.1f} us)")
+    return {
+        'meta': {'python': platform.python_version(), 'machine': platform.machine(), 'days': days, 'programs': programs, 'seed': seed},
+        'results': results,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Times the hot paths over a seeded database")
+    parser.add_argument('--days', type=int, default=365, help="Days of seeded samples and weather history")
+    parser.add_argument('--programs', type=int, default=300, help="Seeded irrigation programs")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--only', nargs='*', help="Case names to run")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="Baseline json to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="Write the results as the new baseline")
+    parser.add_argument('--no-baseline', action='store_true', help="Only report the results, do not compare with a baseline")
+    parser.add_argument('--output', help="Also write the results to this json file")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed slowdown of the median before failing")
+    args = parser.parse_args(argv)
+
+    report = run(args.days, args.programs, args.seed, args.repeats, args.only)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"baseline written to {args.baseline}")
+        return 0
+    if args.no_baseline:
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, run with --save-baseline first or pass --no-baseline")
+        return 1
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline['meta'] != report['meta']:
+        print(f"warning: baseline was recorded with {baseline['meta']}, this run is {report['meta']}")
+    regressions = compare(report['results'], baseline['results'], args.threshold)
+    for name in regressions:
+        print(f"REGRESSION {name}: {report['results'][name]['median'] * 1e6:.1f} us, "
+              f"baseline {baseline['results'][name]['median'] * 1e6:.1f} us")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
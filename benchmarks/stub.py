@@ -0,0 +1,95 @@
+import datetime as dt
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from scarlet.services.open_weather import hourly_variables
+
+
+def synthetic_hour(time: dt.datetime) -> dict:
+    """Smooth daily cycle, the same hour always gives the same values"""
+    phase = math.sin((time.hour - 9) / 24 * 2 * math.pi)
+    return {
+        'temperature_2m': round(15 + 8 * phase, 1),
+        'relative_humidity_2m': round(65 - 20 * phase, 1),
+        'cloud_cover': round(50 + 40 * math.sin(time.timetuple().tm_yday / 7), 1),
+        'precipitation': 0.0 if time.day % 5 else 0.4,
+        'precipitation_probability': 0.0 if time.day % 5 else 60.0,
+        'wind_speed_10m': round(8 + 5 * abs(phase), 1),
+        'wind_gusts_10m': round(14 + 8 * abs(phase), 1),
+    }
+
+
+def forecast_response(query: dict[str, str]) -> dict:
+    now = dt.datetime.now()
+    today = dt.datetime.combine(now.date(), dt.time())
+    start = today - dt.timedelta(days=int(query.get('past_days', 0)))
+    hours = [start + dt.timedelta(hours=hour) for hour in range(24 * (int(query.get('past_days', 0)) + int(query.get('forecast_days', 1))))]
+    variables = hourly_variables.split(',')
+    response = dict()
+    if 'hourly' in query:
+        rows = [synthetic_hour(hour) for hour in hours]
+        response['hourly'] = {'time': [hour.isoformat(timespec='minutes') for hour in hours],
+                              **{variable: [row[variable] for row in rows] for variable in variables}}
+    if 'current' in query:
+        current = now.replace(minute=now.minute // 15 * 15, second=0, microsecond=0)
+        response['current'] = {'time': current.isoformat(timespec='minutes'), 'interval': 900, **synthetic_hour(current)}
+    if 'daily' in query:
+        days = sorted({hour.date() for hour in hours})
+        response['daily'] = {'time': [day.isoformat() for day in days],
+                             'sunrise': [f"{day.isoformat()}T06:00" for day in days],
+                             'sunset': [f"{day.isoformat()}T19:30" for day in days]}
+    return response
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers with response when it is set, the synthetic forecast otherwise, and records every request"""
+    protocol_version = 'HTTP/1.1'
+    response: dict | None = None
+    delay: float = 0
+    requests: list[dict] = list()
+    connections: set = set()
+
+    def do_GET(self):
+        query = {key: value[0] for key, value in parse_qs(urlparse(self.path).query).items()}
+        type(self).requests.append(query)
+        type(self).connections.add(self.client_address)
+        time.sleep(self.delay)
+        body = json.dumps(forecast_response(query) if self.response is None else self.response).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubOpenMeteo:
+    """
+    Local stand-in for the Open-Meteo forecast api, so tests, benchmarks and load tests never reach the network
+
+    Notes:
+        Every stub has its own handler class, its response, delay and recorded requests are not shared
+    """
+
+    def __init__(self):
+        self.handler: type[StubHandler] = type('StubHandler', (StubHandler,), {'requests': list(), 'connections': set()})
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-open-meteo', daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}/v1/forecast'
+
+    def __enter__(self) -> 'StubOpenMeteo':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
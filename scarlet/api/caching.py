@@ -0,0 +1,62 @@
+import inspect
+import secrets
+from typing import Awaitable, Callable
+from fastapi import Request, Response
+
+from scarlet.core import config
+
+
+class VersionedCache:
+    """
+    ETags from state version counters, for endpoints polled by the boards and the ui
+
+    Notes:
+        A matching If-None-Match is answered with 304 before the state is read or serialized,
+        the body of the latest version is kept so unchanged state is serialized once,
+        the etag includes a per process id as the counters restart from zero, and a generation of the entry,
+        increased when a config reload replaces the service or controller that owns it
+    """
+
+    def __init__(self):
+        self.boot_id = secrets.token_hex(4)
+        self._bodies: dict[str, tuple[str, bytes]] = dict()
+        self._owners: dict[str, str | None] = dict()
+        self._generations: dict[str, int] = dict()
+
+    def reset(self, reloaded: list[str] | None = None):
+        """New etags for the entries owned by the reloaded services and controllers, for every entry without names"""
+        for key, owner in list(self._owners.items()):
+            if reloaded is None or owner in reloaded:
+                self._generations[key] = self._generations.get(key, 0) + 1
+                self._bodies.pop(key, None)
+
+    def etag(self, key: str, version: int) -> str:
+        return f'"{self.boot_id}-{key}-{self._generations.get(key, 0)}-{version}"'
+
+    @staticmethod
+    def _matches(request: Request, etag: str) -> bool:
+        if_none_match = request.headers.get('if-none-match')
+        if not if_none_match:
+            return False
+        return if_none_match.strip() == '*' or etag in (tag.strip().removeprefix('W/') for tag in if_none_match.split(','))
+
+    async def respond(self, request: Request, key: str, version: int, render: Callable[[], bytes | Awaitable[bytes]],
+                      owner: str | None = None) -> Response:
+        self._owners[key] = owner
+        etag = self.etag(key, version)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if self._matches(request, etag):
+            return Response(status_code=304, headers=headers)
+        cached = self._bodies.get(key)
+        if cached is not None and cached[0] == etag:
+            body = cached[1]
+        else:
+            body = render()
+            if inspect.isawaitable(body):
+                body = await body
+            self._bodies[key] = (etag, body)
+        return Response(content=body, media_type='application/json', headers=headers)
+
+
+cache = VersionedCache()
+config.store.after_reconfigure.append(cache.reset)
@@ -0,0 +1,40 @@
+import time
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from scarlet.core import metrics
+
+request_seconds = metrics.registry.histogram('scarlet_http_request_seconds', "Request handling time by route template",
+                                             ('method', 'route', 'status'))
+
+
+class RequestMetricsMiddleware:
+    """
+    Times every http request by method, route template and status code
+
+    Notes:
+        Plain asgi middleware, responses are passed through untouched, the matched route is read from the scope
+        after the router filled it in, requests that matched no route share the "unmatched" label to bound cardinality
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            path = getattr(route, 'path', None) or 'unmatched'
+            request_seconds.labels(scope['method'], path, str(status)).observe(time.perf_counter() - start)
@@ -0,0 +1,149 @@
+import datetime as dt
+import itertools
+import os
+import re
+import secrets
+import threading
+import time
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from scarlet.core import log as log_, config
+from scarlet.core.profiler import SamplingProfiler
+
+log = log_.service.logger('profiling')
+
+profile_header = b'x-profile'
+token_header = b'x-admin-token'
+
+
+class ProfilingService(config.Service):
+    """
+    On demand profiles of single requests, written as collapsed stacks under directory
+
+    Notes:
+        A request is profiled when it sends the X-Profile: 1 header or the profile=1 query flag together with
+        the configured admin token in X-Admin-Token, or when it is the sample_rate-th request
+        Without an admin token and with sample_rate 0 profiling is disabled, one profile runs at a time,
+        the oldest files are deleted above max_files
+    """
+    class Config(config.Service.Config):
+        admin_token: str | None = None
+        sample_rate: int = 0
+        interval: float = 0.005
+        directory: str = 'profiles'
+        max_files: int = 50
+
+    config: 'ProfilingService.Config' = Config()
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._counter = itertools.count(1)
+        self._busy = threading.Lock()
+
+    def initialize(self):
+        self._counter = itertools.count(1)
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.admin_token is not None or self.config.sample_rate > 0
+
+    def authorized(self, token: str | None) -> bool:
+        # compared as bytes, compare_digest rejects str holding anything but ascii
+        return self.config.admin_token is not None and token is not None and secrets.compare_digest(token.encode(), self.config.admin_token.encode())
+
+    def _requested(self, scope: Scope) -> bool:
+        if self.config.admin_token is None:
+            return False
+        headers = dict(scope['headers'])
+        flagged = headers.get(profile_header) == b'1' or b'profile=1' in scope.get('query_string', b'').split(b'&')
+        return flagged and self.authorized(headers.get(token_header, b'').decode('latin-1') or None)
+
+    def _sampled(self) -> bool:
+        return self.config.sample_rate > 0 and next(self._counter) % self.config.sample_rate == 0
+
+    def should_profile(self, scope: Scope) -> bool:
+        return self._requested(scope) or self._sampled()
+
+    def start(self) -> SamplingProfiler | None:
+        if not self._busy.acquire(blocking=False):
+            log.debug("a profile is already running, skipping")
+            return None
+        profiler = SamplingProfiler(self.config.interval)
+        profiler.start()
+        return profiler
+
+    def finish(self, profiler: SamplingProfiler, name: str):
+        """Stops the sampler and writes the file on a separate thread, the request does not wait for it"""
+        def write():
+            try:
+                profiler.stop()
+                os.makedirs(self.config.directory, exist_ok=True)
+                with open(os.path.join(self.config.directory, name), 'w') as file:
+                    file.write(profiler.collapsed())
+                log.info(f"profile {name} written with {profiler.samples} samples")
+                self._prune()
+            except Exception as e:
+                log.error(f"cannot write profile {name}: {e}")
+            finally:
+                self._busy.release()
+
+        threading.Thread(target=write, name='profile-writer', daemon=True).start()
+
+    def _prune(self):
+        files = self.list_profiles()
+        for name in files[self.config.max_files:]:
+            os.remove(os.path.join(self.config.directory, name))
+
+    def list_profiles(self) -> list[str]:
+        """Newest first"""
+        if not os.path.isdir(self.config.directory):
+            return list()
+        return sorted((name for name in os.listdir(self.config.directory) if name.endswith('.collapsed')), reverse=True)
+
+    def read_profile(self, name: str) -> str | None:
+        if name not in self.list_profiles():
+            return None
+        with open(os.path.join(self.config.directory, name)) as file:
+            return file.read()
+
+    @staticmethod
+    def profile_name(scope: Scope) -> str:
+        path = re.sub(r'[^A-Za-z0-9]+', '_', scope['path']).strip('_') or 'root'
+        return f"{dt.datetime.now():%Y%m%dT%H%M%S%f}-{scope['method']}-{path}.collapsed"
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests selected by the profiling service, the profile name is returned in the X-Profile header
+
+    Notes:
+        When profiling is disabled a request costs a single attribute check
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or not service.enabled or not service.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        profiler = service.start()
+        if profiler is None:
+            await self.app(scope, receive, send)
+            return
+        name = service.profile_name(scope)
+        start = time.perf_counter()
+
+        async def send_with_name(message: Message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = [*message.get('headers', []), (profile_header, name.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_name)
+        finally:
+            service.finish(profiler, name)
+            log.debug(f"profiled {scope['method']} {scope['path']} in {time.perf_counter() - start:.3f}s")
+
+
+service = ProfilingService('ProfilingService')
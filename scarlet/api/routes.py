@@ -1,23 +1,40 @@
 import os
+import json
 import datetime as dt
+import polars as pl
 
-from fastapi import FastAPI, HTTPException, Request, Form
+from fastapi import FastAPI, HTTPException, Request, Depends, Header, Query
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, Response, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
-import asyncio
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel.ext.asyncio.session import AsyncSession
+from pydantic import TypeAdapter, ValidationError
 
 import scarlet.core.log as log_
+import scarlet.core.metrics as metrics
 import scarlet.api.schemas as schemas
 import scarlet.db.models as models
 from scarlet.core.config import Controller
+from scarlet.api.caching import cache
+from scarlet.api.streaming import history_response
+from scarlet.api.instrumentation import RequestMetricsMiddleware
+from scarlet.api.profiling import ProfilingMiddleware, service as profiling_service
 from scarlet.services.arduino_weather import service as arduino_service
 from scarlet.services.open_weather import service as open_weather_service
+from scarlet.services.irrigation_score import service as irrigation_score_service
+from scarlet.db.db import service as db_service
+from scarlet.db.archive import service as archive_service
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 log = log_.service.logger('routes')
 app = FastAPI()
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)
+weather_batch_adapter = TypeAdapter(list[schemas.ArduinoWeatherSampleSchema])
+programs_adapter = TypeAdapter(list[schemas.IrrigationGetProgramSchema])
+max_long_poll = 60
 
 
 
@@ -36,52 +53,120 @@ def blinds_page(request: Request):
     return templates.TemplateResponse("blinds.html", {"request": request})
 
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(content=metrics.registry.render(), media_type=metrics.registry.content_type)
+
+
+@app.get("/admin/profiles", include_in_schema=False)
+async def get_profiles(x_admin_token: str | None = Header(None)):
+    """Names of the written profiles, newest first"""
+    if not profiling_service.authorized(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    return await run_in_threadpool(profiling_service.list_profiles)
+
+
+@app.get("/admin/profiles/{name}", include_in_schema=False)
+async def get_profile(name: str, x_admin_token: str | None = Header(None)):
+    """Collapsed stacks of a profile, readable by flamegraph.pl, speedscope and similar tools"""
+    if not profiling_service.authorized(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    profile = await run_in_threadpool(profiling_service.read_profile, name)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile)
+
+
 @app.get("/weather")
-async def get_weather():
-    return arduino_service.get_current_weather()
+async def get_weather(device: str = models.default_device):
+    return arduino_service.get_current_weather(device)
+
+
+@app.get("/weather/devices")
+async def get_weather_devices():
+    """Devices that sent samples since the start"""
+    return arduino_service.devices
 
 
 @app.get("/weather/history")
-async def get_historic_weather():
-    return arduino_service.get_history(dt.datetime.now())
+async def get_historic_weather(since: dt.datetime | None = None, until: dt.datetime | None = None,
+                               resolution: schemas.WeatherResolution = schemas.WeatherResolution.raw, device: str | None = None,
+                               cursor: str | None = None, limit: int | None = Query(None, gt=0), format: schemas.HistoryFormat = schemas.HistoryFormat.json):
+    """Raw samples or minute, hour and day rollups between the given times, of every device unless one is given"""
+    since = since or dt.datetime.now()
+    query = arduino_service.history_query(since, resolution, device, until)
+    archived = None
+    if resolution is schemas.WeatherResolution.raw:
+        archived = archive_service.scan(models.ArduinoWeatherData, since, until, pl.col('device') == device if device is not None else None)
+    return await history_response(query, arduino_service.history_model(resolution), format, cursor, limit, archived=archived)
 
 
 @app.post("/weather")
 async def post_weather(item: models.ArduinoWeatherData):
+    if not arduino_service.accepts(item.device):
+        raise HTTPException(status_code=403, detail="Unknown device")
     arduino_service.append_weather_data(item)
 
 
-@app.get("/blinds")
-async def get_blinds():
-    return Controller.controllers_by_class_name['BlindsController'].blind_status()
+@app.post("/weather/batch")
+async def post_weather_batch(request: Request, device: str = models.default_device):
+    """Buffered readings of a board as a JSON array or as NDJSON (application/x-ndjson)"""
+    if not arduino_service.accepts(device):
+        raise HTTPException(status_code=403, detail="Unknown device")
+    body = await request.body()
+    if request.headers.get('content-type', '').startswith('application/x-ndjson'):
+        body = b'[' + b','.join(line for line in body.splitlines() if line.strip()) + b']'
+    try:
+        samples = weather_batch_adapter.validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    arduino_service.append_weather_batch(samples, device)
+    return {"accepted": len(samples)}
+
+
+@app.get("/blinds", response_model=schemas.BlindsPydanticSchema)
+async def get_blinds(request: Request):
+    controller = Controller.controllers_by_class_name['BlindsController']
+    return await cache.respond(request, 'blinds', controller.blind_status_version, lambda: controller.blind_status.model_dump_json().encode(),
+                               owner='BlindsController')
+
+
+@app.get("/blinds/command")
+async def wait_blinds_command(version: int = -1, timeout: float = 25):
+    """Long poll for the boards, answers as soon as the status version differs from the given one"""
+    version, status = await Controller.controllers_by_class_name['BlindsController'].wait_for_command(version, min(timeout, max_long_poll))
+    return {"version": version, "state": status}
 
 
 @app.post("/blinds")
-async def post_blinds(item: schemas.BlindsPydanticSchema):
-    Controller.controllers_by_class_name['BlindsController'].set_blinds(item)
-    await asyncio.sleep(2)
-    status: schemas.BlindsPydanticSchema = Controller.controllers_by_class_name['BlindsController'].blind_status
-    if item.left_blind is not schemas.BlindState.nostate and status.left_blind == schemas.BlindState.nostate:
-        log.info('arduino accepted the request')
-        return {"detail": "Accepted"}
-    if item.right_blind is not schemas.BlindState.nostate and status.right_blind == schemas.BlindState.nostate:
+async def post_blinds(item: schemas.BlindsPydanticSchema, session: AsyncSession = Depends(db_service.get_session)):
+    await Controller.controllers_by_class_name['BlindsController'].set_blinds(session, item)
+    if await Controller.controllers_by_class_name['BlindsController'].wait_for_ack(item):
         log.info('arduino accepted the request')
         return {"detail": "Accepted"}
 
-    log.warning('arduino (irrigation) not responded the request')
+    log.warning('arduino (blinds) not responded the request')
     return {"detail": "No response"}
 
 
-@app.get("/irrigation")
-async def get_irrigation():
-    return Controller.controllers_by_class_name['IrrigationController'].get_irrigation_status()
+@app.get("/irrigation", response_model=schemas.IrrigationRunSessionSchema)
+async def get_irrigation(request: Request):
+    controller = Controller.controllers_by_class_name['IrrigationController']
+    return await cache.respond(request, 'irrigation', controller.get_irrigation_status_version(),
+                               lambda: controller.get_irrigation_status().model_dump_json().encode(), owner='IrrigationController')
+
+
+@app.get("/irrigation/command")
+async def wait_irrigation_command(version: int = -1, timeout: float = 25):
+    """Long poll for the boards, answers as soon as the status version differs from the given one"""
+    version, status = await Controller.controllers_by_class_name['IrrigationController'].wait_for_command(version, min(timeout, max_long_poll))
+    return {"version": version, "state": status}
 
 
 @app.post("/irrigation")
-async def post_irrigation(item: schemas.IrrigationRunSessionSchema):
-    Controller.controllers_by_class_name['IrrigationController'].set_irrigation_status(item)
-    await asyncio.sleep(2)
-    if Controller.controllers_by_class_name['IrrigationController'].get_irrigation_status().active == schemas.IrrigationState.nostate:
+async def post_irrigation(item: schemas.IrrigationRunSessionSchema, session: AsyncSession = Depends(db_service.get_session)):
+    await Controller.controllers_by_class_name['IrrigationController'].set_irrigation_status(session, item)
+    if await Controller.controllers_by_class_name['IrrigationController'].wait_for_ack(item):
         log.info('arduino accepted the request')
         return {"detail": "Accepted"}
 
@@ -90,32 +175,51 @@ async def post_irrigation(item: schemas.IrrigationRunSessionSchema):
 
 @app.get("/open_weather")
 async def get_open_weather():
-    return open_weather_service.get_current_data()
+    return await open_weather_service.get_current_data_async()
+
+
+@app.get("/open_weather/history")
+async def get_open_weather_history(since: dt.datetime | None = None, until: dt.datetime | None = None, cursor: str | None = None,
+                                   limit: int | None = Query(None, gt=0), format: schemas.HistoryFormat = schemas.HistoryFormat.json):
+    """Stored Open-Meteo hours between the given times, the last day by default"""
+    since = since or dt.datetime.now() - dt.timedelta(days=1)
+    query = open_weather_service.history_query(since, until)
+    return await history_response(query, models.HistoricalWeather, format, cursor, limit,
+                                  archived=archive_service.scan(models.HistoricalWeather, since, until))
 
 
 @app.get("/open_weather/score")
 async def get_irrigation_score():
-    return Controller.controllers_by_class_name['IrrigationController'].calculate_score()
+    return await run_in_threadpool(Controller.controllers_by_class_name['IrrigationController'].calculate_score)
+
+
+@app.get("/irrigation/score", response_model=schemas.IrrigationScoreSchema)
+async def get_irrigation_score_breakdown():
+    return await run_in_threadpool(irrigation_score_service.get_breakdown)
 
 
 @app.post("/irrigation/automation")
 async def post_irrigation_automation(item: schemas.AutomationState):
-    Controller.controllers_by_class_name['IrrigationController'].set_automation(item.automation)
+    await run_in_threadpool(Controller.controllers_by_class_name['IrrigationController'].set_automation, item.automation)
 
 
 @app.get("/irrigation/automation")
-async def get_irrigation_automation():
-    return {"automation": Controller.controllers_by_class_name['IrrigationController'].automation}
+async def get_irrigation_automation(request: Request):
+    controller = Controller.controllers_by_class_name['IrrigationController']
+    return await cache.respond(request, 'irrigation_automation', controller.automation_version,
+                               lambda: json.dumps({"automation": controller.automation}, separators=(",", ":")).encode(), owner='IrrigationController')
 
 
 @app.post("/blinds/automation")
 async def post_blinds_automation(item: schemas.AutomationState):
-    Controller.controllers_by_class_name['BlindsController'].set_automation(item.automation)
+    await run_in_threadpool(Controller.controllers_by_class_name['BlindsController'].set_automation, item.automation)
 
 
 @app.get("/blinds/automation")
-async def get_blinds_automation():
-    return {"automation": Controller.controllers_by_class_name['BlindsController'].automation}
+async def get_blinds_automation(request: Request):
+    controller = Controller.controllers_by_class_name['BlindsController']
+    return await cache.respond(request, 'blinds_automation', controller.automation_version,
+                               lambda: json.dumps({"automation": controller.automation}, separators=(",", ":")).encode(), owner='BlindsController')
 
 
 @app.post("/blinds/light_limit")
@@ -129,54 +233,60 @@ async def get_blinds_light_limit():
 
 
 @app.post("/irrigation/program")
-async def post_irrigation_program(item: schemas.IrrigationCreateProgramSchema):
+async def post_irrigation_program(item: schemas.IrrigationCreateProgramSchema, session: AsyncSession = Depends(db_service.get_session)):
     """Adds a program with defined session to the database"""
     dict_ = item.model_dump()
     program = models.IrrigationProgram.model_validate(dict_)
     program.sessions = [models.IrrigationProgramSession(**d) for d in dict_['sessions']]
-    Controller.controllers_by_class_name['IrrigationController'].set_irrigation_program(program)
+    await Controller.controllers_by_class_name['IrrigationController'].set_irrigation_program(session, program)
 
 
 @app.post("/irrigation/program/{program_id}/session/create")
-async def post_irrigation_session(program_id: int, item: schemas.IrrigationCreateProgramSessionSchema):
+async def post_irrigation_session(program_id: int, item: schemas.IrrigationCreateProgramSessionSchema, session: AsyncSession = Depends(db_service.get_session)):
     """Adds a program with defined session to the database"""
-    program = Controller.controllers_by_class_name['IrrigationController'].get_irrigation_program_by_id(program_id)
+    program = await Controller.controllers_by_class_name['IrrigationController'].get_irrigation_program_by_id(session, program_id)
     program.sessions = program.sessions + [models.IrrigationProgramSession(**item.model_dump())]
-    Controller.controllers_by_class_name['IrrigationController'].update_irrigation_program(program)
+    await Controller.controllers_by_class_name['IrrigationController'].update_irrigation_program(session, program)
 
 
 @app.get("/irrigation/sessions/history", response_model=list[schemas.HistoricalIrrigationRunSessionSchema])
-async def get_historical_sessions():
-    sessions = list()
-    for session in Controller.controllers_by_class_name['IrrigationController'].get_historical_sessions():
-        session_dict =  session.model_dump()
-        session_dict.update({'is_active': "on"})
-        sessions.append(session_dict)
-    return sessions
+async def get_historical_sessions(since: dt.datetime | None = None, until: dt.datetime | None = None, cursor: str | None = None,
+                                  limit: int | None = Query(None, gt=0), format: schemas.HistoryFormat = schemas.HistoryFormat.json):
+    """Ran sessions between the given times, the last two days by default"""
+    def page(history: list[models.RanIrrigationSessionHistory]) -> list[dict]:
+        return [{**session.model_dump(), 'is_active': "on"} for session in history]
+
+    query = Controller.controller_class_by_class_name['IrrigationController'].historical_sessions_query(since, until)
+    return await history_response(query, models.RanIrrigationSessionHistory, format, cursor, limit, page)
 
 
 @app.get("/irrigation/program/all", response_model=list[schemas.IrrigationGetProgramSchema])
-async def get_irrigation_programs():
-    """Retreives all programs with it's sessions"""
-    return Controller.controllers_by_class_name['IrrigationController'].get_irrigation_programs()
+async def get_irrigation_programs(request: Request, session: AsyncSession = Depends(db_service.get_read_session)):
+    """Retreives all programs with it's sessions, the database is only read when the programs changed"""
+    controller = Controller.controllers_by_class_name['IrrigationController']
+
+    async def render() -> bytes:
+        return programs_adapter.dump_json(programs_adapter.validate_python(await controller.get_irrigation_programs(session), from_attributes=True))
+
+    return await cache.respond(request, 'programs', controller.programs_version, render, owner='IrrigationController')
 
 
 @app.get("/irrigation/program/{program_id}", response_model=schemas.IrrigationGetProgramSchema)
-async def get_irrigation_program(program_id: int):
-    program = Controller.controllers_by_class_name['IrrigationController'].get_irrigation_program_by_id(program_id)
+async def get_irrigation_program(program_id: int, session: AsyncSession = Depends(db_service.get_read_session)):
+    program = await Controller.controllers_by_class_name['IrrigationController'].get_irrigation_program_by_id(session, program_id)
     if not program:
         raise HTTPException(status_code=404, detail="Program not found")
     return program
 
 
 @app.patch("/irrigation/program/{program_id}", response_model=schemas.IrrigationUpdateProgramSchema)
-async def update_irrigation_program(program_id: int, update: schemas.IrrigationUpdateProgramSchema):
+async def update_irrigation_program(program_id: int, update: schemas.IrrigationUpdateProgramSchema, session: AsyncSession = Depends(db_service.get_session)):
     """
     Updates a program based on filled out parts of the schema
     Notes:
         Sessions are updated separately
     """
-    program = Controller.controllers_by_class_name['IrrigationController'].get_irrigation_program_by_id(program_id)
+    program = await Controller.controllers_by_class_name['IrrigationController'].get_irrigation_program_by_id(session, program_id)
     if not program:
         raise HTTPException(status_code=404, detail="Program not found")
 
@@ -184,26 +294,26 @@ async def update_irrigation_program(program_id: int, update: schemas.IrrigationU
         if key != 'sessions':
             setattr(program, key, value)
 
-    Controller.controllers_by_class_name['IrrigationController'].update_irrigation_program(program)
+    await Controller.controllers_by_class_name['IrrigationController'].update_irrigation_program(session, program)
     return program
 
 
 @app.post("/irrigation/program/{program_id}/delete")
-async def delete_irrigation_program(program_id: int):
+async def delete_irrigation_program(program_id: int, db_session: AsyncSession = Depends(db_service.get_session)):
     """
     Deletes program
     """
-    program = Controller.controllers_by_class_name['IrrigationController'].get_irrigation_program_by_id(program_id)
-    [Controller.controllers_by_class_name['IrrigationController'].delete_irrigation_session_by_id(session.id) for session in program.sessions]
-    Controller.controllers_by_class_name['IrrigationController'].delete_irrigation_program_by_id(program_id)
+    program = await Controller.controllers_by_class_name['IrrigationController'].get_irrigation_program_by_id(db_session, program_id)
+    [await Controller.controllers_by_class_name['IrrigationController'].delete_irrigation_session_by_id(db_session, session.id) for session in program.sessions]
+    await Controller.controllers_by_class_name['IrrigationController'].delete_irrigation_program_by_id(db_session, program_id)
 
 
 @app.post("/irrigation/program/{program_id}/session/{session_id}/delete")
-async def delete_session(program_id: int, session_id: int):
+async def delete_session(program_id: int, session_id: int, db_session: AsyncSession = Depends(db_service.get_session)):
     """
     Deletes a session from a program
     """
-    program = Controller.controllers_by_class_name['IrrigationController'].get_irrigation_program_by_id(program_id)
+    program = await Controller.controllers_by_class_name['IrrigationController'].get_irrigation_program_by_id(db_session, program_id)
     if not program:
         raise HTTPException(status_code=404, detail="Program not found")
 
@@ -214,20 +324,20 @@ async def delete_session(program_id: int, session_id: int):
 
     # Remove it
     program.sessions = [s for s in program.sessions if s.id != session_id]
-    Controller.controllers_by_class_name['IrrigationController'].update_irrigation_program(program)
-    Controller.controllers_by_class_name['IrrigationController'].delete_irrigation_session_by_id(session_id)
+    await Controller.controllers_by_class_name['IrrigationController'].update_irrigation_program(db_session, program)
+    await Controller.controllers_by_class_name['IrrigationController'].delete_irrigation_session_by_id(db_session, session_id)
     return {"detail": "Session deleted"}
 
 
 @app.patch("/irrigation/program/session/{session_id}")
-async def update_session(session_id: int, update: schemas.IrrigationUpdateProgramSessionSchema):
+async def update_session(session_id: int, update: schemas.IrrigationUpdateProgramSessionSchema, db_session: AsyncSession = Depends(db_service.get_session)):
     """Updates a session based on filled out parts of the schema"""
-    session = Controller.controllers_by_class_name['IrrigationController'].get_session_by_id(session_id)
+    session = await Controller.controllers_by_class_name['IrrigationController'].get_session_by_id(db_session, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
 
     for key, value in update.model_dump(exclude_none=True).items():
         setattr(session, key, value)
 
-    Controller.controllers_by_class_name['IrrigationController'].update_irrigation_session(session)
+    await Controller.controllers_by_class_name['IrrigationController'].update_irrigation_session(db_session, session)
     return session
@@ -27,6 +27,28 @@ class IrrigationState(Enum):
         return None
 
 
+class WeatherResolution(Enum):
+    raw = 'raw'
+    minute = 'minute'
+    hour = 'hour'
+    day = 'day'
+
+
+class HistoryFormat(Enum):
+    json = 'json'
+    ndjson = 'ndjson'
+    arrow = 'arrow'
+
+
+class ArduinoWeatherSampleSchema(BaseModel):
+    """Raw reading of a board, timestamp is the device clock when it buffers readings"""
+    timestamp: dt.datetime | None = None
+    wind: float
+    light_1: float
+    light_2: float
+    rain: int
+
+
 class BlindsSettingLightLimitSchema(BaseModel):
     limit: int
 
@@ -97,3 +119,17 @@ class IrrigationCreateProgramSchema(BaseModel):
     frequency: int
     lower_score: float
     upper_score: float
+
+
+class IrrigationScoreHourSchema(BaseModel):
+    timestamp: dt.datetime
+    temperature_2m: float
+    relative_humidity_2m: float
+    wind_speed_10m: float
+    vpd: float | None
+    score: float | None
+
+
+class IrrigationScoreSchema(BaseModel):
+    score: float
+    hours: list[IrrigationScoreHourSchema]
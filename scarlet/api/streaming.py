@@ -0,0 +1,138 @@
+import asyncio
+import datetime as dt
+import io
+from typing import Any, AsyncIterator, Callable
+import polars as pl
+import pyarrow as pa
+from pyarrow import ipc
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import tuple_
+from sqlmodel import SQLModel
+
+from scarlet.api.schemas import HistoryFormat
+from scarlet.db.db import service as db_service
+from scarlet.db.archive import polars_schema
+
+chunk_size = 2000
+media_types = {HistoryFormat.ndjson: 'application/x-ndjson', HistoryFormat.arrow: 'application/vnd.apache.arrow.stream'}
+
+
+def encode_cursor(row) -> str:
+    """The (timestamp, id) of the last row received, rows after it are returned"""
+    return f"{row.timestamp.isoformat()},{row.id}"
+
+
+def decode_cursor(cursor: str) -> tuple[dt.datetime, int]:
+    try:
+        timestamp, id_ = cursor.rsplit(',', 1)
+        return dt.datetime.fromisoformat(timestamp), int(id_)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="cursor must be the timestamp and id of the last row, like 2025-01-01T10:00:00,42")
+
+
+def keyset(query, model: type[SQLModel], after: tuple[dt.datetime, int] | None):
+    query = query.order_by(model.timestamp, model.id)
+    return query.where(tuple_(model.timestamp, model.id) > tuple_(*after)) if after is not None else query
+
+
+def archived_chunk(archived: pl.LazyFrame, model: type[SQLModel], after: tuple[dt.datetime, int] | None, size: int) -> list[SQLModel]:
+    if after is not None:
+        archived = archived.filter((pl.col('timestamp') > after[0]) | ((pl.col('timestamp') == after[0]) & (pl.col('id') > after[1])))
+    return [model.model_validate(row) for row in archived.sort('timestamp', 'id').head(size).collect().iter_rows(named=True)]
+
+
+async def iter_chunks(query, model: type[SQLModel], after: tuple[dt.datetime, int] | None, limit: int | None,
+                      archived: pl.LazyFrame | None = None) -> AsyncIterator[list[SQLModel]]:
+    """
+    Rows in (timestamp, id) order, at most chunk_size read at a time
+
+    Notes:
+        Every chunk is read in its own short session, so a long export neither holds a reader connection
+        nor keeps a read transaction open, the keyset continues right after the last row of the previous chunk
+        Rows of the archive scan are merged in with the same keyset, a row found in both is kept once
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        async with db_service.async_read_session_factory() as session:
+            rows = (await session.exec(keyset(query, model, after).limit(size))).all()
+        if archived is not None:
+            cold = await asyncio.to_thread(archived_chunk, archived, model, after, size)
+            if cold:
+                hot = {(row.id, row.timestamp) for row in rows}
+                rows = sorted([row for row in cold if (row.id, row.timestamp) not in hot] + list(rows), key=lambda row: (row.timestamp, row.id))[:size]
+            else:
+                archived = None
+        if rows:
+            yield rows
+        if len(rows) < size:
+            return
+        after = (rows[-1].timestamp, rows[-1].id)
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+class ArrowStreamWriter:
+    """
+    Chunks of rows as a single Arrow IPC stream, the schema message once, then a record batch per chunk
+
+    Notes:
+        pyarrow's stream writer writes into a buffer that is emptied after every chunk, so only the bytes
+        of the current chunk are held
+    """
+
+    def __init__(self, schema: dict[str, pl.DataType]):
+        self.schema = schema
+        self._sink = io.BytesIO()
+        self._writer = ipc.new_stream(self._sink, self._table(list()).schema)
+
+    def _table(self, rows: list[dict[str, Any]]) -> pa.Table:
+        return pl.DataFrame(rows, schema=self.schema).to_arrow(compat_level=pl.CompatLevel.oldest())
+
+    def _flush(self) -> bytes:
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
+
+    def write(self, rows: list[dict[str, Any]]) -> bytes:
+        self._writer.write_table(self._table(rows))
+        return self._flush()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._flush()
+
+
+async def ndjson_stream(chunks: AsyncIterator[list[SQLModel]]) -> AsyncIterator[bytes]:
+    async for rows in chunks:
+        yield b''.join(row.model_dump_json().encode() + b'\n' for row in rows)
+
+
+async def arrow_stream(chunks: AsyncIterator[list[SQLModel]], model: type[SQLModel]) -> AsyncIterator[bytes]:
+    writer = ArrowStreamWriter(polars_schema(model))
+    async for rows in chunks:
+        yield writer.write([row.model_dump() for row in rows])
+    yield writer.close()
+
+
+async def history_response(query, model: type[SQLModel], history_format: HistoryFormat, cursor: str | None, limit: int | None,
+                           page: Callable[[list[SQLModel]], Any] | None = None, archived: pl.LazyFrame | None = None):
+    """
+    Range of a history table as json, ndjson or an arrow stream, together with the archived rows of the range
+
+    Notes:
+        json answers with a list, X-Next-Cursor is set when limit rows were returned,
+        ndjson and arrow are written chunk by chunk as they are read, memory use does not depend on the range
+    """
+    after = decode_cursor(cursor) if cursor else None
+    chunks = iter_chunks(query, model, after, limit, archived)
+    if history_format is HistoryFormat.json:
+        rows = [row async for rows in chunks for row in rows]
+        headers = {'X-Next-Cursor': encode_cursor(rows[-1])} if limit and len(rows) == limit else None
+        return JSONResponse(content=jsonable_encoder(page(rows) if page else rows), headers=headers)
+    if history_format is HistoryFormat.ndjson:
+        return StreamingResponse(ndjson_stream(chunks), media_type=media_types[history_format])
+    return StreamingResponse(arrow_stream(chunks, model), media_type=media_types[history_format])
@@ -0,0 +1,106 @@
+import os
+from typing import Literal
+import numpy as np
+from pydantic import BaseModel, model_validator
+
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'resources')
+
+
+class CalibrationConfig(BaseModel):
+    """
+    Curve converting a raw sensor reading to its physical value
+
+    Notes:
+        linear uses scale and offset, piecewise interpolates between points,
+        lookup interpolates a two column (raw, value) csv from the resources directory
+    """
+    kind: Literal['identity', 'linear', 'piecewise', 'lookup'] = 'identity'
+    scale: float = 1.0
+    offset: float = 0.0
+    points: list[tuple[float, float]] = list()
+    table: str | None = None
+    minimum: float | None = None
+    maximum: float | None = None
+    decimals: int | None = None
+
+    @model_validator(mode='after')
+    def curve_is_defined(self):
+        if self.kind == 'piecewise' and len(self.points) < 2:
+            raise ValueError("piecewise calibration needs at least two points")
+        if self.kind == 'lookup' and not self.table:
+            raise ValueError("lookup calibration needs a table")
+        return self
+
+
+class Calibration:
+    """Compiled curve, call it with a numpy array or use scalar() for a single reading"""
+
+    def __init__(self, config: CalibrationConfig, xs: np.ndarray | None = None, ys: np.ndarray | None = None):
+        self.config = config
+        self._xs = xs
+        self._ys = ys
+        self._factor = 10.0 ** config.decimals if config.decimals is not None else None
+        self._is_identity = config.kind == 'identity' and config.minimum is None and config.maximum is None and config.decimals is None
+
+    @property
+    def is_identity(self) -> bool:
+        return self._is_identity
+
+    def __call__(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        if self._xs is not None:
+            values = np.interp(values, self._xs, self._ys)
+        elif self.config.kind == 'linear':
+            values = values * self.config.scale + self.config.offset
+        if self.config.minimum is not None or self.config.maximum is not None:
+            values = np.clip(values, self.config.minimum, self.config.maximum)
+        if self._factor is not None:
+            values = np.rint(values * self._factor) / self._factor
+        return values
+
+    def scalar(self, value: float) -> float:
+        """Same result as __call__ without the array overhead, rounding mirrors numpy rint"""
+        if self._xs is not None:
+            value = float(np.interp(value, self._xs, self._ys))
+        elif self.config.kind == 'linear':
+            value = value * self.config.scale + self.config.offset
+        if self.config.minimum is not None and value < self.config.minimum:
+            value = self.config.minimum
+        if self.config.maximum is not None and value > self.config.maximum:
+            value = self.config.maximum
+        if self._factor is not None:
+            value = round(value * self._factor) / self._factor
+        return float(value)
+
+    def inverse(self, values: np.ndarray) -> np.ndarray:
+        """
+        Raw readings producing the given values, used to re-calibrate stored data
+        Notes:
+            Values clipped or rounded by the curve map back to the edge of their range
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if self._xs is not None:
+            steps = np.diff(self._ys)
+            if np.any(steps > 0) and np.any(steps < 0):
+                raise ValueError(f"calibration curve {self.config.table or self.config.points} is not monotonic, cannot invert it")
+            if self._ys[0] > self._ys[-1]:
+                return np.interp(values, self._ys[::-1], self._xs[::-1])
+            return np.interp(values, self._ys, self._xs)
+        if self.config.kind == 'linear':
+            return (values - self.config.offset) / self.config.scale
+        return values
+
+
+def _load_table(name: str) -> tuple[np.ndarray, np.ndarray]:
+    table = np.loadtxt(os.path.join(RESOURCES_DIR, name), delimiter=',', skiprows=1, ndmin=2)
+    return table[:, 0], table[:, 1]
+
+
+def compile_calibration(config: CalibrationConfig) -> Calibration:
+    """Resolves the curve once, the returned callable does no config lookups or file reads"""
+    if config.kind in ('piecewise', 'lookup'):
+        xs, ys = _load_table(config.table) if config.kind == 'lookup' else map(np.array, zip(*config.points))
+        xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+        order = np.argsort(xs, kind='stable')
+        return Calibration(config, xs[order], ys[order])
+    return Calibration(config)
@@ -1,4 +1,9 @@
-from typing import Any, ClassVar
+from typing import Any, Callable, ClassVar
+import copy
+import os
+import stat
+import tempfile
+import threading
 import yaml
 from pydantic import BaseModel
 from scarlet.core import log as log_
@@ -52,26 +57,31 @@ class Controller(BaseModel):
         for key, value in config.items():
             log.debug(f"configuring {key} controller")
             if cls.controller_class_by_class_name.get(key):
-                cls.controllers_by_class_name[key] = cls.controller_class_by_class_name[key].model_validate(value if value is not None else {})
-                cls.controllers_by_class_name[key].schedule_jobs()
+                controller = cls.controller_class_by_class_name[key].model_validate(value if value is not None else {})
+                if key in cls.controllers_by_class_name:
+                    controller.take_over(cls.controllers_by_class_name[key])
+                cls.controllers_by_class_name[key] = controller
+                controller.schedule_jobs()
             else:
                 raise KeyError(f"controller {key} does not exists, available: {cls.controller_class_by_class_name.keys()}")
 
     def schedule_jobs(self):
         pass
 
+    def take_over(self, previous: 'Controller'):
+        """Called on a config reload with the instance being replaced, before the jobs are scheduled"""
+        pass
+
     def _self_edit_config(self, attribute: str, new_value: Any):
-        with open(self.config_path, 'r+') as file:
-            data = yaml.safe_load(file)
-            data['controllers'][self.__class__.__name__][attribute] = new_value
-            file.seek(0)
-            yaml.safe_dump(data, file)
-            file.truncate()
+        store.edit('controllers', self.__class__.__name__, attribute, new_value)
 
 
 class Process:
     @staticmethod
     def configure_all(config_path: str, config: dict[str, Any]):
+        if config.get('logging'):
+            log_.service.configure(log_.LogConfig.model_validate(config['logging']))
+
         if config.get('services'):
             Service.config_path = config_path
             Service.config_services(config=config['services'])
@@ -88,6 +98,219 @@ class Process:
     
     @classmethod
     def run_process(cls, config_path):
-        config = cls.load_yaml(config_path=config_path)
+        config = store.load(config_path=config_path)
         cls.configure_all(config_path=config_path, config=config)
 
+
+class ConfigStore(Service):
+    """
+    Parsed config kept in memory, edits written behind and the file watched for changes
+
+    Notes:
+        edit() changes the in memory config and wakes the writer thread, which waits write_delay seconds so a burst
+        of edits is written once, the yaml is dumped to a temporary file next to the config and renamed over it,
+        a crash leaves either the old or the new file, never a partial one
+        The watcher checks the file every watch_interval seconds, a changed file is parsed, pending edits are
+        applied on top and only the logging, services and controllers sections that differ from the running config
+        are passed to Process.configure_all, the before_reconfigure hooks run first with every service and
+        controller about to be replaced (the scheduler cancels their jobs), the after_reconfigure hooks run with
+        the reloaded names once the new instances are in place (the http cache renews the etags of their entries,
+        as the versions of new controllers restart from zero), a new controller takes over the device state and its
+        waiters from the replaced one
+        A file that does not parse or a section that does not validate is logged and the running config is kept
+        Without start() edits are written right away
+    """
+    class Config(Service.Config):
+        write_delay: float = 0.5
+        watch_interval: float = 2
+
+    config: 'ConfigStore.Config' = Config()
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.path: str | None = None
+        self.data: dict[str, Any] = dict()
+        self.before_reconfigure: list[Callable[[Any], None]] = list()
+        self.after_reconfigure: list[Callable[[list[str]], None]] = list()
+        self._edits: dict[tuple[str, str, str], Any] = dict()
+        self._signature: tuple[int, int, int] | None = None
+        self._lock = threading.Lock()
+        self._file_lock = threading.RLock()
+        self._dirty = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: list[threading.Thread] = list()
+
+    def load(self, config_path: str) -> dict[str, Any]:
+        with self._file_lock:
+            data = Process.load_yaml(config_path=config_path)
+            with self._lock:
+                self.path, self.data, self._edits = config_path, copy.deepcopy(data), dict()
+            self._signature = self._stat()
+        return data
+
+    def _stat(self) -> tuple[int, int, int] | None:
+        try:
+            result = os.stat(self.path)
+        except OSError:
+            return None
+        return result.st_mtime_ns, result.st_size, result.st_ino
+
+    @staticmethod
+    def _set(data: dict[str, Any], section: str, name: str, attribute: str, value: Any):
+        entries = data[section] = data.get(section) or dict()
+        if entries.get(name) is None:
+            entries[name] = dict()
+        entries[name][attribute] = value
+
+    def edit(self, section: str, name: str, attribute: str, value: Any):
+        with self._lock:
+            if self.path is None:
+                log.warning(f"config is not loaded, {section}.{name}.{attribute} is not persisted")
+                return
+            self._set(self.data, section, name, attribute, value)
+            self._edits[(section, name, attribute)] = value
+        if self._threads:
+            self._dirty.set()
+        else:
+            self.flush()
+
+    def flush(self):
+        """Writes the pending edits, external changes to the file are reloaded first so they are not overwritten"""
+        with self._file_lock:
+            self.reload_if_changed()
+            with self._lock:
+                if not self._edits:
+                    return
+                edits, self._edits = self._edits, dict()
+                self._dirty.clear()
+                data = copy.deepcopy(self.data)
+            try:
+                self._write(data)
+            except OSError as e:
+                log.error(f"writing config to {self.path} failed: {e}")
+                with self._lock:
+                    self._edits = {**edits, **self._edits}
+                return
+            self._signature = self._stat()
+            log.debug(f"wrote {len(edits)} config edits to {self.path}")
+
+    def _write(self, data: dict[str, Any]):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.config-', suffix='.yaml.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                yaml.safe_dump(data, file)
+                file.flush()
+                os.fsync(file.fileno())
+            if os.path.exists(self.path):
+                os.chmod(temporary, stat.S_IMODE(os.stat(self.path).st_mode))
+            os.replace(temporary, self.path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+
+    def reload_if_changed(self) -> list[str]:
+        """Names of the reconfigured sections, empty when the file did not change since it was last read or written"""
+        with self._file_lock:
+            signature = self._stat()
+            if self.path is None or signature == self._signature:
+                return list()
+            self._signature = signature
+            try:
+                data = Process.load_yaml(config_path=self.path) or dict()
+            except (OSError, yaml.YAMLError) as e:
+                log.error(f"config {self.path} could not be read, keeping the running config: {e}")
+                return list()
+            return self.apply(self._with_edits(data))
+
+    def apply(self, data: dict[str, Any]) -> list[str]:
+        changed: dict[str, Any] = dict()
+        if data.get('logging') and data.get('logging') != self.data.get('logging'):
+            changed['logging'] = data['logging']
+        for section in ('services', 'controllers'):
+            running = self.data.get(section) or dict()
+            entries = {name: value for name, value in (data.get(section) or dict()).items() if running.get(name) != value}
+            if entries:
+                changed[section] = entries
+        if not changed:
+            self._with_edits(data, running=True)
+            return list()
+
+        names = (['logging'] if 'logging' in changed else list()) + list(changed.get('services', dict())) + list(changed.get('controllers', dict()))
+        try:
+            self._validate(changed)
+        except (KeyError, ValueError) as e:
+            log.error(f"config {self.path} changed {names} but is not valid, keeping the running config: {e}")
+            return list()
+        log.info(f"reloading {names} from {self.path}")
+        replaced = [Service.services_by_name[name] for name in changed.get('services', dict())]
+        replaced += [Controller.controllers_by_class_name[name] for name in changed.get('controllers', dict())
+                     if name in Controller.controllers_by_class_name]
+        for owner in replaced:
+            for hook in self.before_reconfigure:
+                hook(owner)
+        Process.configure_all(config_path=self.path, config=changed)
+        self._with_edits(data, running=True)
+        for hook in self.after_reconfigure:
+            hook(names)
+        return names
+
+    def _with_edits(self, data: dict[str, Any], running: bool = False) -> dict[str, Any]:
+        """Pending edits applied on top of data read from the file, which becomes the running config when running is set"""
+        with self._lock:
+            for (section, name, attribute), value in self._edits.items():
+                self._set(data, section, name, attribute, value)
+            if running:
+                self.data = data
+        return data
+
+    @staticmethod
+    def _validate(changed: dict[str, Any]):
+        """Raises before anything is reconfigured, pydantic ValidationError is a ValueError"""
+        for name, value in changed.get('services', dict()).items():
+            if name not in Service.services_by_name:
+                raise KeyError(f"service {name} does not exists, available: {Service.services_by_name.keys()}")
+            Service.services_by_name[name].Config.model_validate(value if value is not None else {})
+        for name, value in changed.get('controllers', dict()).items():
+            if name not in Controller.controller_class_by_class_name:
+                raise KeyError(f"controller {name} does not exists, available: {Controller.controller_class_by_class_name.keys()}")
+            Controller.controller_class_by_class_name[name].model_validate(value if value is not None else {})
+        if changed.get('logging'):
+            log_.LogConfig.model_validate(changed['logging'])
+
+    def _write_behind(self):
+        while True:
+            self._dirty.wait()
+            if self._stopping.wait(self.config.write_delay):
+                return
+            self.flush()
+
+    def _watch(self):
+        while not self._stopping.wait(self.config.watch_interval):
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                log.error(f"config reload failed: {e}")
+
+    def start(self):
+        if self.path is None or self._threads:
+            return
+        self._stopping.clear()
+        self._threads = [threading.Thread(target=self._write_behind, name='config-writer', daemon=True),
+                         threading.Thread(target=self._watch, name='config-watcher', daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stops the threads and writes the edits still pending"""
+        self._stopping.set()
+        self._dirty.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = list()
+        self._dirty.clear()
+        self.flush()
+
+
+store = ConfigStore('ConfigStore')
@@ -1,10 +1,17 @@
+import atexit
+import gzip
 import logging
+import logging.handlers
 import os.path
+import queue
+import shutil
+import time
 
 import coloredlogs
 import sys
 from typing import Dict
 from enum import Enum
+from pydantic import BaseModel
 
 
 class LogLevels(Enum):
@@ -15,14 +22,212 @@ class LogLevels(Enum):
     critical = 'CRITICAL'
 
 
+class LogConfig(BaseModel):
+    filename: str = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../..', 'logs.log')
+    max_bytes: int = 5 * 1024 * 1024
+    rotate_hours: float | None = 24 * 7
+    backup_count: int = 4
+    compress: bool = True
+    queue_size: int = 10000
+
+
+class RotatingLogFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotates when the file reaches max_bytes or gets older than rotate_hours, rotated files are gzipped"""
+
+    def __init__(self, config: LogConfig):
+        super().__init__(config.filename, maxBytes=config.max_bytes, backupCount=config.backup_count, delay=True)
+        self.rotate_seconds = config.rotate_hours * 3600 if config.rotate_hours else None
+        self.rollover_at = self._next_rollover()
+        if config.compress:
+            self.namer = lambda name: f"{name}.gz"
+            self.rotator = self._compress
+
+    def _next_rollover(self) -> float | None:
+        if self.rotate_seconds is None:
+            return None
+        started = os.path.getmtime(self.baseFilename) if os.path.exists(self.baseFilename) else time.time()
+        return started + self.rotate_seconds
+
+    @staticmethod
+    def _compress(source: str, dest: str):
+        with open(source, 'rb') as source_file, gzip.open(dest, 'wb') as dest_file:
+            shutil.copyfileobj(source_file, dest_file)
+        os.remove(source)
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return os.path.exists(self.baseFilename)
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.rotate_seconds if self.rotate_seconds else None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the logging thread, records that do not fit in the queue are counted and dropped"""
+
+    def __init__(self, queue_: queue.Queue):
+        super().__init__(queue_)
+        self.dropped = 0
+        self._reported = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # formatting is left to the listener thread, the records never leave the process
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            if self.dropped > self._reported:
+                dropped = self.dropped - self._reported
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': 'log', 'levelno': logging.WARNING, 'levelname': 'WARNING', 'msg': f"dropped {dropped} log records, queue was full"}))
+                self._reported += dropped
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def summarize(value) -> str:
+    """Short description of a value, collections are shown by their size and range instead of their items"""
+    if isinstance(value, (list, tuple, set, frozenset)):
+        if not value:
+            return "0 items"
+        items = list(value)
+        first = items[0]
+        if hasattr(first, 'timestamp'):
+            timestamps = [item.timestamp for item in items]
+            return f"{len(items)} {type(first).__name__} {min(timestamps)}..{max(timestamps)}"
+        if all(isinstance(item, (int, float)) for item in items):
+            return f"{len(items)} values {min(items)}..{max(items)}"
+        return f"{len(items)} {type(first).__name__}"
+    if isinstance(value, dict):
+        return f"{len(value)} keys"
+    if hasattr(value, 'shape') and hasattr(value, 'columns'):
+        return f"frame {value.shape[0]}x{value.shape[1]}"
+    if hasattr(value, 'shape') and hasattr(value, 'dtype'):
+        return f"array {value.shape} {value.min()}..{value.max()}" if value.size else f"array {value.shape}"
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return str(value)
+
+
+class StructuredMessage:
+    """Event with fields, formatted only when a handler renders the record"""
+    __slots__ = ('event', 'fields', 'suppressed')
+
+    def __init__(self, event: str, fields: dict, suppressed: int = 0):
+        self.event = event
+        self.fields = fields
+        self.suppressed = suppressed
+
+    def __str__(self):
+        parts = [self.event] + [f"{key}={summarize(value)}" for key, value in self.fields.items()]
+        if self.suppressed:
+            parts.append(f"(+{self.suppressed} suppressed)")
+        return " ".join(parts)
+
+
+class StructuredLogger:
+    """
+    log.info("stored hours", hours=datapoints) instead of an f-string of the whole list
+
+    Notes:
+        Nothing is formatted when the level is disabled or the call is rate limited, emitted messages are
+        formatted by the log listener thread, so the fields should not be mutated after the call
+        every limits the call site to one record per given seconds, sample keeps one call out of sample,
+        suppressed calls are counted in the next emitted message
+    """
+
+    def __init__(self, logger: logging.Logger, every: float | None = None, sample: int | None = None):
+        self.logger = logger
+        self.every = every
+        self.sample = sample
+        self._calls = 0
+        self._next_allowed = 0.0
+        self._suppressed = 0
+
+    def limited(self, every: float | None = None, sample: int | None = None) -> 'StructuredLogger':
+        """Separate limiter for one call site, sharing the underlying logger"""
+        return StructuredLogger(self.logger, every=every, sample=sample)
+
+    def _allowed(self) -> bool:
+        if self.sample is not None:
+            self._calls += 1
+            if (self._calls - 1) % self.sample:
+                return False
+        if self.every is not None:
+            now = time.monotonic()
+            if now < self._next_allowed:
+                return False
+            self._next_allowed = now + self.every
+        return True
+
+    def _emit(self, level: int, event: str, fields: dict):
+        if not self.logger.isEnabledFor(level):
+            return
+        if not self._allowed():
+            self._suppressed += 1
+            return
+        suppressed, self._suppressed = self._suppressed, 0
+        self.logger.log(level, StructuredMessage(event, fields, suppressed), stacklevel=3)
+
+    def debug(self, event: str, **fields):
+        self._emit(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields):
+        self._emit(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields):
+        self._emit(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields):
+        self._emit(logging.ERROR, event, fields)
+
+
 class Log:
+    """
+    Loggers only put records on a bounded queue, a listener thread formats and writes them
+
+    Notes:
+        The console and the rotating log file are written by the listener, a full queue drops records
+        instead of blocking the caller, the count is logged once the queue has room again
+    """
 
-    def __init__(self):
-        self.filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../..', 'logs.log')
+    def __init__(self, config: LogConfig | None = None):
+        self.config = config or LogConfig()
+        self.filename = self.config.filename
         self.console_output_handler = logging.StreamHandler(stream=sys.stdout)
-        self.file_output_handler = logging.FileHandler(filename=self.filename)
+        self.file_output_handler = RotatingLogFileHandler(self.config)
+        self.queue: queue.Queue = queue.Queue(maxsize=self.config.queue_size)
+        self.queue_handler = DroppingQueueHandler(self.queue)
+        self.listener = logging.handlers.QueueListener(self.queue, self.console_output_handler, self.file_output_handler)
         self.set_console_format()
         self.set_logfile_format()
+        self.listener.start()
+        atexit.register(self.stop)
+
+    @property
+    def dropped(self) -> int:
+        return self.queue_handler.dropped
+
+    def configure(self, config: LogConfig):
+        """Replaces the log file and queue settings, records already queued are written first"""
+        self.stop()
+        self.config = config
+        self.filename = config.filename
+        self.file_output_handler = RotatingLogFileHandler(config)
+        self.set_logfile_format()
+        self.queue = queue.Queue(maxsize=config.queue_size)
+        self.queue_handler.queue = self.queue
+        self.listener = logging.handlers.QueueListener(self.queue, self.console_output_handler, self.file_output_handler)
+        self.listener.start()
+
+    def stop(self):
+        """Flushes the queue and stops the listener thread"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.file_output_handler.close()
 
     def set_console_format(self):
         colored_formatter = coloredlogs.ColoredFormatter(
@@ -47,18 +252,27 @@ class Log:
         file_formatter = logging.Formatter(fmt='[ %(asctime)s ] |%(levelname)-5s| %(filename)-18s line: %(lineno)-3d %(message)s')
         self.file_output_handler.setFormatter(file_formatter)
 
-    def logger(self, name) -> logging.Logger:
-        logging.basicConfig()
+    def _attach(self, name: str) -> logging.Logger:
         logger = logging.getLogger(name)
-        coloredlogs.install(logger=logger)
         logger.propagate = False
-        logger.addHandler(hdlr=self.console_output_handler)
-        logger.addHandler(hdlr=self.file_output_handler)
+        if self.queue_handler not in logger.handlers:
+            logger.handlers = [handler for handler in logger.handlers if not isinstance(handler, logging.StreamHandler)]
+            logger.addHandler(hdlr=self.queue_handler)
         return logger
 
+    def logger(self, name) -> logging.Logger:
+        """Logger of a scarlet module, info unless a level was set for it, third party loggers go through change_logger"""
+        logger = self._attach(name)
+        if logger.level == logging.NOTSET:
+            logger.setLevel(logging.INFO)
+        return logger
+
+    def structured(self, name: str, every: float | None = None, sample: int | None = None) -> StructuredLogger:
+        return StructuredLogger(self.logger(name), every=every, sample=sample)
+
     def change_logger(self, name: str, level: LogLevels):
         if name in logging.root.manager.loggerDict.keys():
-            logging.root.manager.loggerDict[name] = self.logger(name)
+            logging.root.manager.loggerDict[name] = self._attach(name)
             self.set_log_levels_for_modules({name: level})
 
     @staticmethod
@@ -74,8 +288,5 @@ class Log:
             if modules_by_name.get(module_name):
                 self.list_loggers()[module_name].setLevel(modules_by_name[module_name].value)
 
-    def clear_log_file(self):
-        self.file_output_handler.stream.truncate(0)
-
 
 service = Log()
@@ -0,0 +1,70 @@
+import os
+import sys
+import threading
+from collections import Counter
+from types import FrameType
+
+# leaf frames of threads waiting for work, sampled stacks ending in them are left out of the profile
+idle_frames = {
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('selectors.py', 'select'),
+    ('queue.py', 'get'),
+    ('base_events.py', 'run_forever'),
+    ('base_events.py', '_run_once'),
+    ('runners.py', 'run'),
+}
+
+
+def frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler sampling the stacks of every thread from a background thread
+
+    Notes:
+        The process is sampled, not a single coroutine, stacks are rooted at their thread name so work handed to
+        the threadpool stays apart from the event loop, concurrent requests show up in the same profile
+        Stacks are kept as collapsed lines ("root;caller;callee count") that flamegraph tools read directly
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter[str]:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self._sample(names.get(thread_id, str(thread_id)), frame)
+            self.samples += 1
+
+    def _sample(self, thread_name: str, frame: FrameType):
+        if (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in idle_frames:
+            return
+        stack = list()
+        while frame is not None:
+            stack.append(frame_name(frame))
+            frame = frame.f_back
+        stack.append(thread_name)
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
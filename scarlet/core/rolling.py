@@ -0,0 +1,223 @@
+import datetime as dt
+import heapq
+from array import array
+from collections import defaultdict, deque
+from typing import Any, Iterable, Sequence
+
+
+class RingBuffer:
+    """Preallocated float buffer keeping the last `capacity` values"""
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError(f"capacity must be positive, got {capacity}")
+        self.capacity = capacity
+        self._values = array('d', bytes(8 * capacity))
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, value: float) -> float | None:
+        """Stores the value and returns the one it evicted, if the buffer was full"""
+        end = (self._start + self._size) % self.capacity
+        if self._size < self.capacity:
+            self._values[end] = value
+            self._size += 1
+            return None
+        evicted = self._values[self._start]
+        self._values[self._start] = value
+        self._start = (self._start + 1) % self.capacity
+        return evicted
+
+    def extend(self, values: Iterable[float]):
+        for value in values:
+            self.append(value)
+
+    def last(self) -> float | None:
+        if not self._size:
+            return None
+        return self._values[(self._start + self._size - 1) % self.capacity]
+
+    def values(self) -> list[float]:
+        return [self._values[(self._start + i) % self.capacity] for i in range(self._size)]
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
+
+
+class RollingMedian:
+    """
+    Median of the last `capacity` values, O(log n) per append and O(1) per read
+
+    Notes:
+        Values are split between a max-heap of the lower half and a min-heap of the upper half,
+        values leaving the window are deleted lazily once they reach the top of their heap
+    """
+
+    def __init__(self, capacity: int):
+        self.window = RingBuffer(capacity)
+        self._low: list[float] = list()  # negated, max-heap
+        self._high: list[float] = list()
+        self._low_size = 0
+        self._high_size = 0
+        self._delayed: dict[float, int] = defaultdict(int)
+
+    def __len__(self) -> int:
+        return len(self.window)
+
+    def append(self, value: float):
+        evicted = self.window.append(value)
+        self._insert(value)
+        if evicted is not None:
+            self._remove(evicted)
+        if len(self._low) + len(self._high) > 4 * self.window.capacity:
+            self._rebuild()
+
+    def extend(self, values: Sequence[float]):
+        """Appends a batch, a batch that fills the whole window replaces it and rebuilds the heaps once"""
+        if len(values) >= self.window.capacity:
+            self.window.clear()
+            self.window.extend(values[-self.window.capacity:])
+            self._rebuild()
+            return
+        for value in values:
+            self.append(value)
+
+    def median(self) -> float | None:
+        if not len(self.window):
+            return None
+        if self._low_size > self._high_size:
+            return -self._low[0]
+        return (-self._low[0] + self._high[0]) / 2
+
+    def clear(self):
+        self.window.clear()
+        self._rebuild()
+
+    def _insert(self, value: float):
+        if not self._low or value <= -self._low[0]:
+            heapq.heappush(self._low, -value)
+            self._low_size += 1
+        else:
+            heapq.heappush(self._high, value)
+            self._high_size += 1
+        self._balance()
+
+    def _remove(self, value: float):
+        self._delayed[value] += 1
+        if value <= -self._low[0]:
+            self._low_size -= 1
+            if value == -self._low[0]:
+                self._prune(self._low, sign=-1)
+        else:
+            self._high_size -= 1
+            if self._high and value == self._high[0]:
+                self._prune(self._high, sign=1)
+        self._balance()
+
+    def _balance(self):
+        if self._low_size > self._high_size + 1:
+            heapq.heappush(self._high, -heapq.heappop(self._low))
+            self._low_size -= 1
+            self._high_size += 1
+            self._prune(self._low, sign=-1)
+        elif self._low_size < self._high_size:
+            heapq.heappush(self._low, -heapq.heappop(self._high))
+            self._high_size -= 1
+            self._low_size += 1
+            self._prune(self._high, sign=1)
+
+    def _prune(self, heap: list[float], sign: int):
+        while heap and self._delayed.get(sign * heap[0]):
+            value = sign * heapq.heappop(heap)
+            self._delayed[value] -= 1
+            if not self._delayed[value]:
+                del self._delayed[value]
+
+    def _rebuild(self):
+        """Drops the lazily deleted values that piled up below the heap tops"""
+        values = sorted(self.window.values())
+        half = (len(values) + 1) // 2
+        self._low = [-v for v in reversed(values[:half])]
+        self._high = values[half:]
+        self._low_size = len(self._low)
+        self._high_size = len(self._high)
+        self._delayed = defaultdict(int)
+
+
+class TimeWindowMean:
+    """
+    Mean of timestamped values newer than `window`, O(1) amortized per append and eviction
+
+    Notes:
+        Values are expected in timestamp order, a repeated timestamp replaces the stored value (a revised hour),
+        an older one still inside the window is inserted in place, linear in the entries after it,
+        entries without a value (None) are kept for inspection but do not count in the mean
+    """
+
+    def __init__(self, window: dt.timedelta):
+        self.window = window
+        self._entries: deque[tuple[dt.datetime, float | None, Any]] = deque()
+        self._sum = 0.0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def append(self, timestamp: dt.datetime, value: float | None, item: Any = None) -> bool:
+        """False for a timestamp that is already out of the window"""
+        if self._entries and timestamp <= self._entries[-1][0]:
+            return self._revise(timestamp, value, item)
+        self._entries.append((timestamp, value, item))
+        self._count_in(value)
+        self.evict(timestamp - self.window)
+        return True
+
+    def _revise(self, timestamp: dt.datetime, value: float | None, item: Any) -> bool:
+        if timestamp <= self._entries[-1][0] - self.window:
+            return False
+        index = len(self._entries)
+        while index and self._entries[index - 1][0] > timestamp:
+            index -= 1
+        if index and self._entries[index - 1][0] == timestamp:
+            self._count_out(self._entries[index - 1][1])
+            self._entries[index - 1] = (timestamp, value, item)
+        else:
+            self._entries.insert(index, (timestamp, value, item))
+        self._count_in(value)
+        return True
+
+    def _count_in(self, value: float | None):
+        if value is not None:
+            self._sum += value
+            self._count += 1
+
+    def _count_out(self, value: float | None):
+        if value is not None:
+            self._sum -= value
+            self._count -= 1
+        if not self._count:
+            self._sum = 0.0
+
+    def evict(self, before: dt.datetime):
+        """Drops the entries at or before the given time"""
+        while self._entries and self._entries[0][0] <= before:
+            _, value, _ = self._entries.popleft()
+            self._count_out(value)
+
+    def last(self) -> dt.datetime | None:
+        return self._entries[-1][0] if self._entries else None
+
+    def mean(self) -> float | None:
+        return self._sum / self._count if self._count else None
+
+    def items(self) -> list[Any]:
+        return [item for _, _, item in self._entries]
+
+    def clear(self):
+        self._entries.clear()
+        self._sum = 0.0
+        self._count = 0
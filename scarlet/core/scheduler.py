@@ -0,0 +1,283 @@
+import asyncio
+import datetime as dt
+import heapq
+import inspect
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from scarlet.core import log as log_, config, metrics
+
+log = log_.service.logger('scheduler')
+lag_seconds = metrics.registry.histogram('scarlet_scheduler_lag_seconds', "Delay between the planned and the actual start of a job")
+job_seconds = metrics.registry.histogram('scarlet_scheduler_job_seconds', "Job run time, timed out jobs are observed when they finish",
+                                         ('job',), buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900))
+job_outcomes = metrics.registry.counter('scarlet_scheduler_jobs', "Finished, failed, timed out and skipped job runs", ('job', 'outcome'))
+
+weekdays = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+class CancelJob:
+    """Returned by a job to remove itself from the scheduler"""
+
+
+class Job:
+    """
+    Recurring job, built with Scheduler.every() the same way as with the schedule library
+
+    Notes:
+        scheduler.every(10).minutes.do(func), scheduler.every().day.at("03:30").do(func, arg),
+        scheduler.every().monday.at("02:00").timeout(60).do(func)
+    """
+
+    def __init__(self, interval: int, scheduler: 'Scheduler'):
+        self.interval = interval
+        self.scheduler = scheduler
+        self.unit: str | None = None
+        self.weekday: int | None = None
+        self.at_time: dt.time | None = None
+        self.timeout_seconds: float | None = None
+        self.func: Callable | None = None
+        self.args: tuple = tuple()
+        self.kwargs: dict[str, Any] = dict()
+        self.next_run: dt.datetime | None = None
+        self.running = False
+        self.cancelled = False
+        self.started: float | None = None
+
+    @property
+    def name(self) -> str:
+        return getattr(self.func, '__qualname__', repr(self.func))
+
+    def __repr__(self):
+        name = self.name
+        at = f" at {self.at_time}" if self.at_time else ""
+        return f"<Job every {self.interval} {self.unit}{at} do {name}, next run {self.next_run}>"
+
+    def _set_unit(self, unit: str, single: bool = False) -> 'Job':
+        if single and self.interval != 1:
+            raise ValueError(f"use {unit}s instead of {unit} for intervals other than 1")
+        self.unit = unit
+        return self
+
+    @property
+    def second(self): return self._set_unit('second', single=True)
+    @property
+    def seconds(self): return self._set_unit('second')
+    @property
+    def minute(self): return self._set_unit('minute', single=True)
+    @property
+    def minutes(self): return self._set_unit('minute')
+    @property
+    def hour(self): return self._set_unit('hour', single=True)
+    @property
+    def hours(self): return self._set_unit('hour')
+    @property
+    def day(self): return self._set_unit('day', single=True)
+    @property
+    def days(self): return self._set_unit('day')
+    @property
+    def week(self): return self._set_unit('week', single=True)
+    @property
+    def weeks(self): return self._set_unit('week')
+
+    def __getattr__(self, name: str):
+        if name in weekdays:
+            self._set_unit('week', single=True)
+            self.weekday = weekdays.index(name)
+            return self
+        raise AttributeError(name)
+
+    def at(self, time_str: str) -> 'Job':
+        """HH:MM[:SS] for daily and weekly jobs, :MM for hourly jobs"""
+        if self.unit not in ('day', 'week', 'hour'):
+            raise ValueError(f"at() is not supported for jobs running every {self.unit}")
+        if self.unit == 'hour':
+            self.at_time = dt.time(minute=int(time_str.lstrip(':')))
+        else:
+            self.at_time = dt.time.fromisoformat(time_str)
+        return self
+
+    def timeout(self, seconds: float) -> 'Job':
+        self.timeout_seconds = seconds
+        return self
+
+    def do(self, func: Callable, *args, **kwargs) -> 'Job':
+        if self.unit is None:
+            raise ValueError("job has no unit, use every(...).minutes or similar")
+        self.func, self.args, self.kwargs = func, args, kwargs
+        self.next_run = self._following_run(dt.datetime.now())
+        self.scheduler._add(self)
+        return self
+
+    def _following_run(self, now: dt.datetime) -> dt.datetime:
+        period = dt.timedelta(**{f'{self.unit}s': self.interval})
+        if self.at_time is None and self.weekday is None:
+            return now + period
+        if self.unit == 'hour':
+            candidate = now.replace(minute=self.at_time.minute, second=0, microsecond=0)
+            return candidate if candidate > now else candidate + period
+        candidate = dt.datetime.combine(now.date(), self.at_time or dt.time())
+        if self.weekday is not None:
+            candidate += dt.timedelta(days=(self.weekday - now.weekday()) % 7)
+        return candidate if candidate > now else candidate + period
+
+
+class Scheduler(config.Service):
+    """
+    Runs recurring jobs on the event loop without polling
+
+    Notes:
+        Jobs are kept in a heap by their next run, the loop sleeps until the earliest one is due
+        (at most max_sleep seconds, to follow wall clock changes) or a new job is added
+        Sync jobs run on a bounded thread pool, coroutine functions on the loop, a job still running is not
+        started again, a coroutine job running longer than its timeout is cancelled, a sync job is logged and its
+        next occurrence is skipped until it finishes, since threads cannot be interrupted
+    """
+    class Config(config.Service.Config):
+        max_workers: int = 4
+        default_timeout: float = 300
+        max_sleep: float = 60
+
+    config: 'Scheduler.Config' = Config()
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._heap: list[tuple[dt.datetime, int, Job]] = list()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def jobs(self) -> list[Job]:
+        with self._lock:
+            return sorted((job for _, _, job in self._heap if not job.cancelled), key=lambda job: job.next_run)
+
+    def every(self, interval: int = 1) -> Job:
+        return Job(interval, self)
+
+    def cancel_job(self, job: Job):
+        job.cancelled = True
+        self._wake()
+
+    def cancel_jobs_of(self, owner: Any):
+        """Cancels the jobs calling methods of owner, a service or controller about to be reconfigured"""
+        with self._lock:
+            jobs = [job for _, _, job in self._heap if getattr(job.func, '__self__', None) is owner]
+        for job in jobs:
+            job.cancelled = True
+        if jobs:
+            log.debug(f"cancelled {len(jobs)} jobs of {type(owner).__name__}")
+            self._wake()
+
+    def clear(self):
+        with self._lock:
+            for _, _, job in self._heap:
+                job.cancelled = True
+            self._heap = list()
+
+    def _add(self, job: Job):
+        with self._lock:
+            heapq.heappush(self._heap, (job.next_run, next(self._counter), job))
+        self._wake()
+
+    def _wake(self):
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _pop_due(self, now: dt.datetime) -> list[Job]:
+        due = list()
+        with self._lock:
+            while self._heap and (self._heap[0][2].cancelled or self._heap[0][0] <= now):
+                _, _, job = heapq.heappop(self._heap)
+                if not job.cancelled:
+                    due.append(job)
+        return due
+
+    def _seconds_to_next(self, now: dt.datetime) -> float:
+        with self._lock:
+            if not self._heap:
+                return self.config.max_sleep
+            return min(max((self._heap[0][0] - now).total_seconds(), 0), self.config.max_sleep)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.config.max_workers, thread_name_prefix='scheduler')
+        log.debug(f"scheduler started with {len(self.jobs)} jobs")
+        while True:
+            now = dt.datetime.now()
+            for job in self._pop_due(now):
+                self._dispatch(job, now)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._seconds_to_next(dt.datetime.now()))
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, job: Job, now: dt.datetime):
+        if job.running:
+            log.warning(f"{job} is still running, skipping this run")
+            job_outcomes.labels(job.name, 'skipped').inc()
+        else:
+            lag_seconds.observe(max((now - job.next_run).total_seconds(), 0))
+            task = self._loop.create_task(self._run_job(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        job.next_run = job._following_run(now)
+        self._add(job)
+
+    async def _run_job(self, job: Job):
+        job.running = True
+        job.started = time.perf_counter()
+        timeout = job.timeout_seconds if job.timeout_seconds is not None else self.config.default_timeout
+        if inspect.iscoroutinefunction(job.func):
+            future = asyncio.ensure_future(job.func(*job.args, **job.kwargs))
+        else:
+            future = self._loop.run_in_executor(self._executor, lambda: job.func(*job.args, **job.kwargs))
+        future.add_done_callback(lambda _: self._finished(job, future))
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            log.error(f"{job} did not finish in {timeout}s")
+            job_outcomes.labels(job.name, 'timeout').inc()
+            if inspect.iscoroutinefunction(job.func):
+                future.cancel()
+            return
+        except Exception as e:
+            log.error(f"{job} failed: {e}")
+            job_outcomes.labels(job.name, 'failed').inc()
+            return
+        job_outcomes.labels(job.name, 'finished').inc()
+        if result is CancelJob:
+            self.cancel_job(job)
+
+    @staticmethod
+    def _finished(job: Job, future: asyncio.Future):
+        job.running = False
+        job_seconds.labels(job.name).observe(time.perf_counter() - job.started)
+        if not future.cancelled() and future.exception() is not None:
+            log.debug(f"{job} finished with {future.exception()!r}")
+
+    def run_all(self):
+        """Runs every job once in the calling thread, for tests and manual triggers"""
+        for job in self.jobs:
+            if job.func(*job.args, **job.kwargs) is CancelJob:
+                self.cancel_job(job)
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._loop = self._wakeup = self._executor = None
+
+
+service = Scheduler('Scheduler')
+config.store.before_reconfigure.append(service.cancel_jobs_of)
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar('T')
+
+
+class StateChannel(Generic[T]):
+    """
+    Versioned device state that handlers can wait on
+
+    Notes:
+        Every set() increments the version and wakes the waiters, it can be called from any thread
+        (scheduled jobs run on the scheduler's pool), waiters are resolved on their own event loop
+    """
+
+    def __init__(self, state: T):
+        self._state = state
+        self._version = 0
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = list()
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> T:
+        return self._state
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def set(self, state: T):
+        with self._lock:
+            self._state = state
+            self._version += 1
+            waiters, self._waiters = self._waiters, list()
+        for loop, future in waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._resolve, future)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future):
+        if not future.done():
+            future.set_result(None)
+
+    async def _next_change(self, version: int, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self._version != version:
+                return True
+            self._waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            with self._lock:
+                if (loop, future) in self._waiters:
+                    self._waiters.remove((loop, future))
+            return False
+
+    async def wait_for(self, predicate: Callable[[T], bool], timeout: float) -> bool:
+        """Returns as soon as the state satisfies the predicate, False if it did not within the timeout"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            version = self._version
+            if predicate(self._state):
+                return True
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0 or not await self._next_change(version, remaining):
+                return False
+
+    async def wait_newer(self, version: int, timeout: float) -> tuple[int, T]:
+        """Long poll, returns once the version differs from the given one (newer, or reset by a restart) or the timeout passed"""
+        if self._version == version:
+            await self._next_change(self._version, timeout)
+        return self._version, self._state
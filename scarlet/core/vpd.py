@@ -0,0 +1,38 @@
+import os
+import numpy as np
+
+from scarlet.core.calibration import RESOURCES_DIR
+
+
+class VpdTable:
+    """
+    Vapour pressure deficit by whole degree celsius and 5% relative humidity bucket
+
+    Notes:
+        The csv is read once into a dense grid, lookups are plain array indexing,
+        temperatures are clipped to the table's range, readings outside the humidity buckets give nan
+    """
+    humidity_step = 5
+
+    def __init__(self, path: str):
+        with open(path) as file:
+            humidities = np.array(file.readline().strip().split(',')[1:], dtype=np.int64)
+        table = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+        temperatures = table[:, 0].astype(np.int64)
+        self.min_temperature, self.max_temperature = int(temperatures.min()), int(temperatures.max())
+        self.min_humidity = int(humidities.min())
+        self.grid = np.full((self.max_temperature - self.min_temperature + 1, humidities.max() // self.humidity_step - self.min_humidity // self.humidity_step + 1), np.nan)
+        self.grid[np.ix_(temperatures - self.min_temperature, humidities // self.humidity_step - self.min_humidity // self.humidity_step)] = table[:, 1:]
+
+    def lookup(self, temperature: np.ndarray, humidity: np.ndarray) -> np.ndarray:
+        temperature = np.clip(np.trunc(np.asarray(temperature, dtype=np.float64)), self.min_temperature, self.max_temperature)
+        humidity = np.maximum(np.trunc(np.asarray(humidity, dtype=np.float64) / self.humidity_step) * self.humidity_step, self.min_humidity)
+        rows = temperature - self.min_temperature
+        columns = humidity // self.humidity_step - self.min_humidity // self.humidity_step
+        valid = ~np.isnan(rows) & ~np.isnan(columns) & (columns < self.grid.shape[1])
+        vpd = np.full(rows.shape, np.nan)
+        vpd[valid] = self.grid[rows[valid].astype(np.int64), columns[valid].astype(np.int64)]
+        return vpd
+
+
+table = VpdTable(os.path.join(RESOURCES_DIR, 'vapour.csv'))
@@ -0,0 +1,162 @@
+import datetime as dt
+import os
+import types
+import typing
+import polars as pl
+from pydantic import BaseModel, field_validator
+from sqlmodel import SQLModel, select, delete, func
+
+import scarlet.core.log as log_
+import scarlet.core.config as config
+import scarlet.core.scheduler as scheduler
+import scarlet.db.models as models
+from scarlet.db.db import service as db_service
+
+log = log_.service.logger("archive")
+
+archive_models = {model.__name__: model for model in (
+    models.ArduinoWeatherData,
+    models.HistoricalWeather,
+    models.BlindAction,
+)}
+polars_types = {int: pl.Int64, float: pl.Float64, str: pl.String, bool: pl.Boolean, dt.datetime: pl.Datetime('us'), dt.time: pl.Time}
+month_format = '%Y-%m'
+
+
+def polars_schema(model: type[SQLModel]) -> dict[str, pl.DataType]:
+    schema = dict()
+    for name, field in model.model_fields.items():
+        annotation = field.annotation
+        if isinstance(annotation, types.UnionType) or typing.get_origin(annotation) is typing.Union:
+            annotation = next(arg for arg in typing.get_args(annotation) if arg is not type(None))
+        schema[name] = polars_types[annotation]
+    return schema
+
+
+def month_start(time: dt.datetime) -> dt.datetime:
+    return dt.datetime(time.year, time.month, 1)
+
+
+def next_month(time: dt.datetime) -> dt.datetime:
+    return dt.datetime(time.year + time.month // 12, time.month % 12 + 1, 1)
+
+
+class ArchivePolicy(BaseModel):
+    keep_days: int
+    chunk_size: int = 5000
+
+
+class Archive(config.Service):
+    """
+    Rows older than keep_days moved from sqlite into month partitioned parquet files
+
+    Notes:
+        Every month of a table is a single file, directory/<table>/<YYYY-MM>.parquet, a month that is archived
+        over several runs is merged with its existing file and replaced atomically, the rows are deleted from sqlite
+        only after their file is in place, rows left over by an interrupted run are merged again without duplicates
+        History reads scan only the files of the months overlapping the requested range
+    """
+    class Config(config.Service.Config):
+        directory: str = 'archive'
+        models: dict[str, ArchivePolicy] = dict()
+        archive_time: str = "02:30"
+
+        @field_validator('models')
+        @classmethod
+        def known_models(cls, value: dict[str, ArchivePolicy]):
+            for name in value:
+                if name not in archive_models:
+                    raise ValueError(f"archiving {name} is not supported, available: {list(archive_models)}")
+            return value
+
+    config: 'Archive.Config' = Config()
+
+    def schedule_jobs(self):
+        if self.config.models:
+            log.debug("scheduling archive job")
+            scheduler.service.every().day.at(self.config.archive_time).do(self.archive)
+
+    def partition_path(self, model: type[SQLModel], month: dt.datetime) -> str:
+        return os.path.join(self.config.directory, model.__tablename__, f"{month.strftime(month_format)}.parquet")
+
+    def partitions(self, model: type[SQLModel], since: dt.datetime, until: dt.datetime | None = None) -> list[str]:
+        """Files of the months overlapping (since, until), the others are never opened"""
+        directory = os.path.join(self.config.directory, model.__tablename__)
+        if not os.path.isdir(directory):
+            return list()
+        paths = list()
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.parquet'):
+                continue
+            month = dt.datetime.strptime(name.removesuffix('.parquet'), month_format)
+            if next_month(month) > since and (until is None or month < until):
+                paths.append(os.path.join(directory, name))
+        return paths
+
+    def scan(self, model: type[SQLModel], since: dt.datetime, until: dt.datetime | None = None,
+             predicate: pl.Expr | None = None) -> pl.LazyFrame | None:
+        """Archived rows in (since, until) matching predicate, None when no month of the range was archived"""
+        paths = self.partitions(model, since, until)
+        if not paths:
+            return None
+        frame = pl.scan_parquet(paths, schema=polars_schema(model), missing_columns='insert', extra_columns='ignore')
+        frame = frame.filter(pl.col('timestamp') > since)
+        if until is not None:
+            frame = frame.filter(pl.col('timestamp') < until)
+        return frame.filter(predicate) if predicate is not None else frame
+
+    def union(self, model: type[SQLModel], rows: typing.Sequence[SQLModel], since: dt.datetime, until: dt.datetime | None = None,
+              predicate: pl.Expr | None = None) -> list[SQLModel]:
+        """Archived rows in (since, until) matching predicate followed by rows read from sqlite"""
+        frame = self.scan(model, since, until, predicate)
+        if frame is None:
+            return list(rows)
+        hot = {(row.id, row.timestamp) for row in rows}
+        archived = [model.model_validate(row) for row in frame.sort('timestamp', 'id').collect().iter_rows(named=True)
+                    if (row['id'], row['timestamp']) not in hot]
+        return archived + list(rows)
+
+    def archive(self) -> dict[str, int]:
+        archived_by_model = dict()
+        for name, policy in self.config.models.items():
+            archived_by_model[name] = self.archive_model(
+                archive_models[name], dt.datetime.now() - dt.timedelta(days=policy.keep_days), policy.chunk_size)
+        log.info(f"archived {archived_by_model}")
+        if any(archived_by_model.values()):
+            db_service.incremental_vacuum()
+        return archived_by_model
+
+    def archive_model(self, model: type[SQLModel], before: dt.datetime, chunk_size: int = 5000) -> int:
+        with db_service.session_scope(read_only=True) as session:
+            oldest = session.exec(select(func.min(model.timestamp)).where(model.timestamp < before)).first()
+        archived = 0
+        month = month_start(oldest) if oldest is not None else before
+        while month < before:
+            archived += self._archive_month(model, month, min(next_month(month), before), chunk_size)
+            month = next_month(month)
+        return archived
+
+    def _archive_month(self, model: type[SQLModel], start: dt.datetime, end: dt.datetime, chunk_size: int) -> int:
+        with db_service.session_scope(read_only=True) as session:
+            rows = session.exec(select(model).where(model.timestamp >= start, model.timestamp < end)).all()
+        if not rows:
+            return 0
+        frame = pl.DataFrame([row.model_dump() for row in rows], schema=polars_schema(model))
+        path = self.partition_path(model, start)
+        if os.path.exists(path):
+            frame = pl.concat([pl.read_parquet(path), frame], how='diagonal_relaxed').unique(subset=['id', 'timestamp'], keep='last')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        frame.sort('timestamp', 'id').write_parquet(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        log.debug(f"wrote {frame.height} rows to {path}")
+
+        # separate transactions so the writer lock is released between chunks
+        ids = [row.id for row in rows]
+        for offset in range(0, len(ids), chunk_size):
+            with db_service.session_scope() as session:
+                session.exec(delete(model).where(model.id.in_(ids[offset:offset + chunk_size])))
+                session.commit()
+        return len(rows)
+
+
+service = Archive('Archive')
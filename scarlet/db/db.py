@@ -1,52 +1,382 @@
-from sqlmodel import Session, SQLModel, create_engine, select
-from sqlalchemy import Engine
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator, Literal
+from pydantic import BaseModel, field_validator
+from sqlmodel import Session, SQLModel, create_engine, select, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import Engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.util import await_only
+import asyncio
 import datetime as dt
+import threading
+import time
 
 import scarlet.core.log as log_
 import scarlet.core.config as config
+import scarlet.core.metrics as metrics
+import scarlet.core.scheduler as scheduler
+import scarlet.db.models as models
 
 log = log_.service.logger("db")
+statement_seconds = metrics.registry.histogram('scarlet_db_statement_seconds', "SQL statement execution time",
+                                               ('pool', 'statement'))
+statement_kinds = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'PRAGMA')
+
+retention_models = {model.__name__: model for model in (
+    models.ArduinoWeatherData,
+    models.HistoricalWeather,
+    models.ForecastedWeather,
+    models.BlindAction,
+    models.RanIrrigationSessionHistory,
+)}
+
+
+class RetentionPolicy(BaseModel):
+    keep_days: int
+    chunk_size: int = 5000
 
 
 class Database(config.Service):
+    """
+    Sync and async access to the same sqlite file
+
+    Notes:
+        Scheduled jobs use the sync api (add, add_all, get_last, clear_*) which opens a short-lived session per call,
+        request handlers get their own AsyncSession through the get_session dependency and use the *_async methods
+        In wal storage mode the sync and the async writer engine share a single writer slot, a connection of either
+        is only checked out while the other one has none, so there is one writer at a time and writers queue in
+        the pool for at most writer_timeout seconds instead of running into SQLITE_BUSY, the async side waits for
+        the slot without blocking the loop, reads are served from a pool of query_only connections, so history reads are not blocked by the writer
+        Rows older than the retention policy of their model are deleted daily in chunks, the freed pages are given
+        back to the filesystem with incremental vacuum
+    """
     class Config(config.Service.Config):
         database: str
+        storage_mode: Literal['default', 'wal'] = 'default'
+        synchronous: Literal['OFF', 'NORMAL', 'FULL', 'EXTRA'] = 'NORMAL'
+        cache_size: int = -2000
+        mmap_size: int = 0
+        busy_timeout: int = 5000
+        writer_timeout: float = 30
+        reader_pool_size: int = 4
+        retention: dict[str, RetentionPolicy] = dict()
+        retention_time: str = "03:00"
+        vacuum_pages: int = 1000
+
+        @field_validator('retention')
+        @classmethod
+        def known_models(cls, value: dict[str, RetentionPolicy]):
+            for name in value:
+                if name not in retention_models:
+                    raise ValueError(f"retention for {name} is not supported, available: {list(retention_models)}")
+            return value
 
+    config: 'Database.Config'
     engine: Engine | None = None
-    session: Session | None = None
+    read_engine: Engine | None = None
+    async_engine: AsyncEngine | None = None
+    async_read_engine: AsyncEngine | None = None
+    session_factory: sessionmaker | None = None
+    read_session_factory: sessionmaker | None = None
+    async_session_factory: async_sessionmaker | None = None
+    async_read_session_factory: async_sessionmaker | None = None
 
     def initialize(self):
-        self.engine = create_engine(f'sqlite:///{self.config.database}', echo=False)
+        replaced = {self.engine, self.read_engine, self.async_engine, self.async_read_engine} - {None}
+        if self.config.storage_mode == 'wal':
+            self._create_wal_engines()
+        else:
+            self.engine = self.read_engine = create_engine(f'sqlite:///{self.config.database}', echo=False)
+            self.async_engine = self.async_read_engine = create_async_engine(f'sqlite+aiosqlite:///{self.config.database}', echo=False)
+        self._instrument()
         log_.service.change_logger('sqlalchemy.engine.Engine', log_.LogLevels.info)
         log_.service.change_logger('sqlalchemy.orm.mapper.Mapper', log_.LogLevels.info)
+        if self.config.retention:
+            self._enable_incremental_vacuum()
         SQLModel.metadata.create_all(bind=self.engine)
-        self.session = Session(self.engine)
-        log.debug(f"database initialized")
-
-    def clear_old_data(self, model, time: dt.datetime):
-        data = self.session.exec(select(model).where(model.timestamp < time)).all()
-        log.info(f"deleting {len(data)} items")
-        if data:
-            [self.session.delete(d) for d in data]
-            self.session.commit()
-
-    def clear_data_after(self, model, time: dt.datetime):
-        data = self.session.exec(select(model).where(model.timestamp > time)).all()
-        log.info(f"deleting {len(data)} items")
-        if data:
-            [self.session.delete(d) for d in data]
-            self.session.commit()
+        self._add_missing_columns()
+        self._create_missing_indexes()
+        self.session_factory = sessionmaker(bind=self.engine, class_=Session, expire_on_commit=False)
+        self.read_session_factory = sessionmaker(bind=self.read_engine, class_=Session, expire_on_commit=False)
+        self.async_session_factory = async_sessionmaker(bind=self.async_engine, class_=AsyncSession, expire_on_commit=False)
+        self.async_read_session_factory = async_sessionmaker(bind=self.async_read_engine, class_=AsyncSession, expire_on_commit=False)
+        if replaced:
+            self._dispose_replaced(replaced)
+        log.debug(f"database initialized in {self.config.storage_mode} mode")
+
+    @staticmethod
+    def _dispose_replaced(engines: set[Engine | AsyncEngine]):
+        """Engines of a previous initialize (a config reload), async ones are disposed on a loop of their own thread"""
+        async def dispose_async():
+            for engine in engines:
+                if isinstance(engine, AsyncEngine):
+                    await engine.dispose()
+
+        for engine in engines:
+            if isinstance(engine, Engine):
+                engine.dispose()
+        thread = threading.Thread(target=asyncio.run, args=(dispose_async(),), name='dispose-engines')
+        thread.start()
+        thread.join()
+
+    def _create_wal_engines(self):
+        url = f'sqlite:///{self.config.database}'
+        async_url = f'sqlite+aiosqlite:///{self.config.database}'
+        writer_pool = dict(pool_size=1, max_overflow=0, pool_timeout=self.config.writer_timeout)
+        reader_pool = dict(pool_size=self.config.reader_pool_size, max_overflow=0)
+        self.engine = self._with_pragmas(create_engine(url, echo=False, **writer_pool), read_only=False)
+        self.read_engine = self._with_pragmas(create_engine(url, echo=False, **reader_pool), read_only=True)
+        self.async_engine = create_async_engine(async_url, echo=False, **writer_pool)
+        self.async_read_engine = create_async_engine(async_url, echo=False, **reader_pool)
+        self._with_pragmas(self.async_engine.sync_engine, read_only=False)
+        self._with_pragmas(self.async_read_engine.sync_engine, read_only=True)
+        self._share_writer_slot()
+
+    def _share_writer_slot(self):
+        """
+        The writer lock is taken on checkout and given back on checkin by both writer engines
+
+        Notes:
+            A failed checkout is checked in as well, so only a record flagged on a successful acquire gives the lock back,
+            the flag lives in record_info, which unlike info survives an invalidation of the connection
+        """
+        writer_lock = threading.Lock()
+        timeout = self.config.writer_timeout
+
+        async def acquire_async():
+            future = asyncio.get_running_loop().run_in_executor(None, writer_lock.acquire, True, timeout)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # the executor thread may still get the lock, it is given back as soon as it does
+                future.add_done_callback(lambda done: done.result() and writer_lock.release())
+                raise
+
+        @event.listens_for(self.engine, 'checkout')
+        def acquire(dbapi_connection, connection_record, connection_proxy):
+            if not writer_lock.acquire(timeout=timeout):
+                raise TimeoutError(f"no writer connection within {timeout}s")
+            connection_record.record_info['writer_lock'] = True
+
+        @event.listens_for(self.async_engine.sync_engine, 'checkout')
+        def acquire_from_loop(dbapi_connection, connection_record, connection_proxy):
+            # runs in the greenlet of the async engine, await_only suspends the calling task instead of the loop
+            if not await_only(acquire_async()):
+                raise TimeoutError(f"no writer connection within {timeout}s")
+            connection_record.record_info['writer_lock'] = True
+
+        def release(dbapi_connection, connection_record):
+            if connection_record.record_info.pop('writer_lock', False):
+                writer_lock.release()
+
+        for engine in (self.engine, self.async_engine.sync_engine):
+            event.listen(engine, 'checkin', release)
+
+    def _with_pragmas(self, engine: Engine, read_only: bool) -> Engine:
+        pragmas = {
+            'busy_timeout': self.config.busy_timeout,
+            'synchronous': self.config.synchronous,
+            'cache_size': self.config.cache_size,
+            'mmap_size': self.config.mmap_size,
+        }
+        if read_only:
+            pragmas['query_only'] = 'ON'
+        else:
+            pragmas = {'journal_mode': 'WAL', **pragmas}
+
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for key, value in pragmas.items():
+                cursor.execute(f'PRAGMA {key}={value}')
+            cursor.close()
+
+        return engine
+
+    def _instrument(self):
+        """Times every statement through engine events, a single engine serves both pools outside of wal mode"""
+        pools = {self.engine: 'writer', self.async_engine.sync_engine: 'writer'}
+        pools.setdefault(self.read_engine, 'reader')
+        pools.setdefault(self.async_read_engine.sync_engine, 'reader')
+        for engine, pool in pools.items():
+            children = {kind: statement_seconds.labels(pool, kind) for kind in statement_kinds + ('other',)}
+
+            @event.listens_for(engine, 'before_cursor_execute')
+            def start_timer(connection, cursor, statement, parameters, context, executemany):
+                connection.info['statement_start'] = time.perf_counter()
+
+            @event.listens_for(engine, 'after_cursor_execute')
+            def observe(connection, cursor, statement, parameters, context, executemany, children=children):
+                start = connection.info.pop('statement_start', None)
+                if start is not None:
+                    children[self._statement_kind(statement)].observe(time.perf_counter() - start)
+
+    @staticmethod
+    def _statement_kind(statement: str) -> str:
+        for kind in statement_kinds:
+            if statement.startswith(kind):
+                return kind
+        return 'other'
+
+    def _enable_incremental_vacuum(self):
+        """auto_vacuum only changes on an empty file or after a full VACUUM, existing databases are converted once"""
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            if connection.exec_driver_sql('PRAGMA auto_vacuum').scalar() == 2:
+                return
+            connection.exec_driver_sql('PRAGMA auto_vacuum=INCREMENTAL')
+            if connection.exec_driver_sql('PRAGMA page_count').scalar() > 0:
+                log.info("converting database to incremental auto vacuum")
+                connection.exec_driver_sql('VACUUM')
+
+    def _add_missing_columns(self):
+        """create_all skips tables that already exist, columns added to the models later need a server default"""
+        with self.engine.begin() as connection:
+            for table in SQLModel.metadata.sorted_tables:
+                existing = {row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    definition = f"{column.name} {column.type.compile(dialect=connection.dialect)}"
+                    if column.server_default is not None:
+                        definition += f" DEFAULT '{column.server_default.arg}'"
+                    if not column.nullable:
+                        definition += " NOT NULL"
+                    log.info(f"adding missing column {column.name} to {table.name}")
+                    connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {definition}")
+
+    def _create_missing_indexes(self):
+        """create_all skips tables that already exist, indexes added or changed in the models later are (re)created here"""
+        with self.engine.begin() as connection:
+            existing = {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            for table in SQLModel.metadata.sorted_tables:
+                unique_by_name = {row[1]: bool(row[2]) for row in connection.exec_driver_sql(f"PRAGMA index_list({table.name})")}
+                for index in table.indexes:
+                    if index.name in existing:
+                        columns = [row[2] for row in connection.exec_driver_sql(f"PRAGMA index_info({index.name})")]
+                        if unique_by_name.get(index.name) == bool(index.unique) and columns == [column.name for column in index.columns]:
+                            continue
+                        log.info(f"recreating changed index {index.name} on {table.name}")
+                        connection.exec_driver_sql(f"DROP INDEX {index.name}")
+                    else:
+                        log.info(f"creating missing index {index.name} on {table.name}")
+                    index.create(bind=connection)
+
+    def schedule_jobs(self):
+        if self.config.retention:
+            log.debug("scheduling retention job")
+            scheduler.service.every().day.at(self.config.retention_time).do(self.apply_retention)
+
+    def apply_retention(self) -> dict[str, int]:
+        deleted_by_model = dict()
+        for name, policy in self.config.retention.items():
+            deleted_by_model[name] = self.clear_old_data_in_chunks(
+                retention_models[name], dt.datetime.now() - dt.timedelta(days=policy.keep_days), policy.chunk_size)
+        log.info(f"retention deleted {deleted_by_model}")
+        self.incremental_vacuum()
+        return deleted_by_model
+
+    def clear_old_data_in_chunks(self, model, time: dt.datetime, chunk_size: int) -> int:
+        """Deletes in separate transactions so the writer lock is released between chunks"""
+        deleted = 0
+        chunk = select(model.id).where(model.timestamp < time).limit(chunk_size)
+        while True:
+            with self.session_scope() as session:
+                count = session.exec(delete(model).where(model.id.in_(chunk))).rowcount
+                session.commit()
+            deleted += count
+            if count < chunk_size:
+                return deleted
+
+    def incremental_vacuum(self):
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            if connection.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:
+                log.warning("incremental auto vacuum is not enabled, skipping")
+                return
+            while (free_pages := connection.exec_driver_sql('PRAGMA freelist_count').scalar()) > 0:
+                log.debug(f"freeing {min(free_pages, self.config.vacuum_pages)} of {free_pages} pages")
+                # the sqlite3 module steps a statement only once through execute, which frees a single page
+                connection.connection.dbapi_connection.executescript(f'PRAGMA incremental_vacuum({self.config.vacuum_pages})')
+
+    @contextmanager
+    def session_scope(self, read_only: bool = False) -> Iterator[Session]:
+        """Opens a session for a single unit of work, used by scheduled jobs and other code outside of requests"""
+        with (self.read_session_factory if read_only else self.session_factory)() as session:
+            yield session
+
+    async def get_session(self) -> AsyncIterator[AsyncSession]:
+        """FastAPI dependency, every request gets its own session bound to the writer"""
+        async with self.async_session_factory() as session:
+            yield session
+
+    async def get_read_session(self) -> AsyncIterator[AsyncSession]:
+        """FastAPI dependency for handlers that only read"""
+        async with self.async_read_session_factory() as session:
+            yield session
+
+    async def dispose(self):
+        for engine in {self.async_engine, self.async_read_engine} - {None}:
+            await engine.dispose()
+        for engine in {self.engine, self.read_engine} - {None}:
+            engine.dispose()
+
+    def clear_old_data(self, model, time: dt.datetime) -> int:
+        with self.session_scope() as session:
+            count = session.exec(delete(model).where(model.timestamp < time)).rowcount
+            session.commit()
+        log.info(f"deleted {count} items")
+        return count
+
+    def clear_data_after(self, model, time: dt.datetime) -> int:
+        with self.session_scope() as session:
+            count = session.exec(delete(model).where(model.timestamp > time)).rowcount
+            session.commit()
+        log.info(f"deleted {count} items")
+        return count
 
     def add(self, item: SQLModel):
-        self.session.add(item)
-        self.session.commit()
+        with self.session_scope() as session:
+            session.add(item)
+            session.commit()
 
     def add_all(self, items: list[SQLModel]):
-        self.session.add_all(items)
-        self.session.commit()
+        with self.session_scope() as session:
+            session.add_all(items)
+            session.commit()
+
+    @staticmethod
+    def _last_query(model):
+        return select(model).order_by(model.timestamp.desc())
 
     def get_last(self, model):
-        last = self.session.exec(select(model).order_by(model.timestamp.desc())).first()
+        with self.session_scope(read_only=True) as session:
+            last = session.exec(self._last_query(model)).first()
+        if not last:
+            log.warning("No data available, cannot get last")
+        return last
+
+    async def clear_old_data_async(self, session: AsyncSession, model, time: dt.datetime) -> int:
+        count = (await session.exec(delete(model).where(model.timestamp < time))).rowcount
+        await session.commit()
+        log.info(f"deleted {count} items")
+        return count
+
+    async def clear_data_after_async(self, session: AsyncSession, model, time: dt.datetime) -> int:
+        count = (await session.exec(delete(model).where(model.timestamp > time))).rowcount
+        await session.commit()
+        log.info(f"deleted {count} items")
+        return count
+
+    async def add_async(self, session: AsyncSession, item: SQLModel):
+        session.add(item)
+        await session.commit()
+
+    async def add_all_async(self, session: AsyncSession, items: list[SQLModel]):
+        session.add_all(items)
+        await session.commit()
+
+    async def get_last_async(self, session: AsyncSession, model):
+        last = (await session.exec(self._last_query(model))).first()
         if not last:
             log.warning("No data available, cannot get last")
         return last
@@ -1,23 +1,61 @@
 import datetime as dt
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 from scarlet.core import log as log_
 
 log = log_.service.logger("models")
 
+default_device = 'default'
+
 
 class ArduinoWeatherData(SQLModel, table=True):
+    __table_args__ = (Index('ix_arduinoweatherdata_device_timestamp', 'device', 'timestamp'),)
     id: Optional[int] = Field(default=None, primary_key=True)
-    timestamp: dt.datetime = Field(default_factory=dt.datetime.now)
+    timestamp: dt.datetime = Field(default_factory=dt.datetime.now, index=True)
+    device: str = Field(default=default_device, sa_column_kwargs={'server_default': default_device})
     wind: float
     light_1: float
     light_2: float
     rain: int
 
 
+class ArduinoWeatherRollup(SQLModel):
+    """Aggregate of the saved ArduinoWeatherData samples of a device, timestamp is the start of the bucket"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    timestamp: dt.datetime = Field(index=True)
+    device: str = Field(default=default_device, sa_column_kwargs={'server_default': default_device})
+    samples: int = 0
+    wind_min: float
+    wind_max: float
+    wind_mean: float
+    wind_median: float
+    light_1_min: float
+    light_1_max: float
+    light_1_mean: float
+    light_1_median: float
+    light_2_min: float
+    light_2_max: float
+    light_2_mean: float
+    light_2_median: float
+    rain_fraction: float
+
+
+class ArduinoWeatherMinute(ArduinoWeatherRollup, table=True):
+    __table_args__ = (Index('ix_arduinoweatherminute_device_timestamp', 'device', 'timestamp', unique=True),)
+
+
+class ArduinoWeatherHour(ArduinoWeatherRollup, table=True):
+    __table_args__ = (Index('ix_arduinoweatherhour_device_timestamp', 'device', 'timestamp', unique=True),)
+
+
+class ArduinoWeatherDay(ArduinoWeatherRollup, table=True):
+    __table_args__ = (Index('ix_arduinoweatherday_device_timestamp', 'device', 'timestamp', unique=True),)
+
+
 class Weather(SQLModel):
     id: Optional[int] = Field(default=None, primary_key=True)
-    timestamp: dt.datetime
+    timestamp: dt.datetime = Field(index=True)
     temperature_2m: float
     relative_humidity_2m: float
     cloud_cover: float
@@ -42,11 +80,11 @@ class IrrigationSessionBase(SQLModel, table=False):
 
 
 class RanIrrigationSessionHistory(IrrigationSessionBase, table=True):
-    timestamp: dt.datetime = Field(default_factory=dt.datetime.now)
+    timestamp: dt.datetime = Field(default_factory=dt.datetime.now, index=True)
 
 
 class IrrigationProgramSession(IrrigationSessionBase, table=True):
-    program_id: Optional[int] = Field(default=None, foreign_key="irrigationprogram.id")
+    program_id: Optional[int] = Field(default=None, foreign_key="irrigationprogram.id", index=True)
     program: Optional["IrrigationProgram"] = Relationship(back_populates="sessions")
     start_time: dt.time
 
@@ -63,7 +101,7 @@ class IrrigationProgram(SQLModel, table=True):
 
 class BlindAction(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    timestamp: dt.datetime = Field(default_factory=dt.datetime.now)
+    timestamp: dt.datetime = Field(default_factory=dt.datetime.now, index=True)
     is_user: bool
     is_left_up: bool
     is_right_up: bool
@@ -1,19 +1,17 @@
 from contextlib import asynccontextmanager
 import argparse
-import sys
-import os
 import asyncio
-import schedule
 import uvicorn
 
-# sys.path.append(f"/{os.path.join(*__file__.split('/')[:-2])}")
-
 import scarlet.core.log as log_
 import scarlet.core.config as config
+import scarlet.core.scheduler as scheduler
 import scarlet.db.db
+import scarlet.db.archive
 import scarlet.api.routes as routes
 import scarlet.services.arduino_weather
 import scarlet.services.open_weather
+import scarlet.services.irrigation_score
 import scarlet.services.blinds
 import scarlet.services.irrigation
 
@@ -41,22 +39,19 @@ def parse_arguments():
 async def lifespan(app):
     log_.service.change_logger('uvicorn', log_.LogLevels.info)
     log_.service.change_logger('uvicorn.error', log_.LogLevels.info)
-    event_loop = asyncio.get_event_loop()
-    event_loop.create_task(run_schedule())
+    scheduler_task = asyncio.get_running_loop().create_task(scheduler.service.run())
+    config.store.start()
     yield
+    config.store.stop()
+    scheduler_task.cancel()
+    await scheduler.service.stop()
+    scarlet.services.open_weather.service.close()
+    await scarlet.db.db.service.dispose()
 
 
 routes.app.router.lifespan_context = lifespan
 
 
-async def run_schedule():
-    schedule.every().monday.at("02:00").do(log_.service.clear_log_file)
-    schedule.every().thursday.at("02:00").do(log_.service.clear_log_file)
-    while True:
-        schedule.run_pending()
-        await asyncio.sleep(1)
-
-
 if __name__ == '__main__':
     log = log_.service.logger('main')
     parser = parse_arguments()
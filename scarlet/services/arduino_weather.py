@@ -1,17 +1,68 @@
-import statistics
 import datetime as dt
-import schedule
-from sqlmodel import select
+from typing import Literal
+import numpy as np
+import polars as pl
+from sqlmodel import select, func
 
-from scarlet.core import log as log_, config
-from scarlet.db.models import ArduinoWeatherData
+from scarlet.core import log as log_, config, metrics, scheduler
+from scarlet.core.rolling import RollingMedian
+from scarlet.core.calibration import Calibration, CalibrationConfig, compile_calibration
+from scarlet.api.schemas import WeatherResolution, ArduinoWeatherSampleSchema
+from scarlet.db.models import ArduinoWeatherData, ArduinoWeatherRollup, ArduinoWeatherMinute, ArduinoWeatherHour, ArduinoWeatherDay, default_device
 from scarlet.db.db import service as db_service
+from scarlet.db import archive
 
 log = log_.service.logger('ardu_weather')
+sample_log = log_.service.structured('ardu_weather', every=60)
+batch_log = sample_log.limited(every=60)
+samples_received = metrics.registry.counter('scarlet_weather_samples', "Samples received from the weather board", ('source',))
+single_samples, batch_samples = samples_received.labels('single'), samples_received.labels('batch')
+cache_fill = metrics.registry.gauge('scarlet_weather_cache_fill_ratio', "Filled fraction of the rolling median window", ('device',))
 
+rollup_models: dict[WeatherResolution, type[ArduinoWeatherRollup]] = {
+    WeatherResolution.minute: ArduinoWeatherMinute,
+    WeatherResolution.hour: ArduinoWeatherHour,
+    WeatherResolution.day: ArduinoWeatherDay,
+}
+channels = ('wind', 'light_1', 'light_2')
+calibrated_channels = channels + ('rain',)
+rollup_intervals = {WeatherResolution.minute: '1m', WeatherResolution.hour: '1h', WeatherResolution.day: '1d'}
+
+
+def bucket_bounds(time: dt.datetime, resolution: WeatherResolution) -> tuple[dt.datetime, dt.datetime]:
+    if resolution is WeatherResolution.minute:
+        start = time.replace(second=0, microsecond=0)
+        return start, start + dt.timedelta(minutes=1)
+    if resolution is WeatherResolution.hour:
+        start = time.replace(minute=0, second=0, microsecond=0)
+        return start, start + dt.timedelta(hours=1)
+    start = time.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + dt.timedelta(days=1)
+
+
+class DeviceWeather:
+    """Rolling medians and the last rain reading of one board"""
+
+    def __init__(self, capacity: int):
+        self.medians = {channel: RollingMedian(capacity) for channel in channels}
+        self.rain: int | None = None
+
+    def fill(self) -> float:
+        median = self.medians['wind']
+        return len(median) / median.window.capacity
 
 
 class ArduinoWeather(config.Service):
+    """
+    Readings of the weather boards, kept as rolling medians per device and saved with their rollups
+
+    Notes:
+        Every device has its own buffers, created on its first sample, so a busy board cannot evict the readings
+        of another, lookups by device are a dict access, samples without a device belong to the default device
+        that the blinds and irrigation logic reads
+        Buffers and their metrics are never evicted, so only the devices listed in devices are accepted, or the first
+        max_devices ones when no list is configured, samples of any other device are rejected
+    """
     class Config(config.Service.Config):
         anemometer_milli_volt_out_min: int
         anemometer_milli_volt_out_max: int
@@ -21,59 +72,236 @@ class ArduinoWeather(config.Service):
 
         save_frequency: int
         local_cache_size: int
+        calibration: dict[Literal['wind', 'light_1', 'light_2', 'rain'], CalibrationConfig] = dict()
+        devices: list[str] | None = None
+        max_devices: int = 16
 
     config: 'ArduinoWeather.Config'
-    _weather: list[ArduinoWeatherData] = list()
+    _devices: dict[str, DeviceWeather] = dict()
+    _calibrations: dict[str, Calibration] = dict()
+
+    def initialize(self):
+        self._devices = dict()
+        self._calibrations = {channel: compile_calibration(self._calibration_config(channel)) for channel in calibrated_channels}
+
     def schedule_jobs(self):
-        schedule.every(self.config.save_frequency).minutes.do(self.save_weather_data)
+        scheduler.service.every(self.config.save_frequency).minutes.do(self.save_weather_data)
 
-    def _value_to_wind_speed(self, value) -> float:
-        """"Converts arduino analog read value to actual wind speed"""
+    def _calibration_config(self, channel: str) -> CalibrationConfig:
+        if channel in self.config.calibration:
+            return self.config.calibration[channel]
+        if channel == 'wind':
+            return self.anemometer_calibration()
+        return CalibrationConfig()
+
+    def anemometer_calibration(self) -> CalibrationConfig:
+        """Wind speed in km/h from the analog read of the anemometer, 0 under its minimal output voltage"""
         milli_volt_per_value = self.config.arduino_input_resolution / self.config.arduino_max_milli_input_voltage
         delta_voltage = self.config.anemometer_milli_volt_out_max - self.config.anemometer_milli_volt_out_min
-        meter_per_sec_per_voltage = delta_voltage / self.config.anemometer_max_meter_per_sec  # mps/mV
-        value_voltage = value * milli_volt_per_value
-        log.debug(f"wind sensor voltage: {value_voltage} mV")
-        if value_voltage < self.config.anemometer_milli_volt_out_min:
-            log.debug(f"voltage: {value_voltage} is under threshold: {self.config.anemometer_milli_volt_out_min} returning 0")
-            return 0.0
+        km_per_hour_per_milli_volt = 3.6 * self.config.anemometer_max_meter_per_sec / delta_voltage
+        return CalibrationConfig(
+            kind='linear',
+            scale=milli_volt_per_value * km_per_hour_per_milli_volt,
+            offset=-self.config.anemometer_milli_volt_out_min * km_per_hour_per_milli_volt,
+            minimum=0,
+            decimals=1,
+        )
+
+    def calibrate(self, channel: str, values: np.ndarray) -> np.ndarray:
+        return self._calibrations[channel](values)
 
-        meter_per_sec = (value_voltage - self.config.anemometer_milli_volt_out_min) / meter_per_sec_per_voltage
-        km_per_hour = round(meter_per_sec * 3.6, 1)
-        log.debug(f"calculated wind speed: {km_per_hour} km/h")
-        return km_per_hour
+    @property
+    def devices(self) -> list[str]:
+        return sorted(self._devices)
 
+    def accepts(self, device: str) -> bool:
+        if device in self._devices or device == default_device:
+            return True
+        if self.config.devices is not None:
+            return device in self.config.devices
+        return len(self._devices) < self.config.max_devices
+
+    def _device(self, device: str) -> DeviceWeather:
+        weather = self._devices.get(device)
+        if weather is None:
+            if not self.accepts(device):
+                raise ValueError(f"samples of device {device} are not accepted")
+            log.info(f"first sample from device {device}")
+            weather = self._devices.setdefault(device, DeviceWeather(self.config.local_cache_size))
+            cache_fill.labels(device).set_function(weather.fill)
+        return weather
 
     def append_weather_data(self, weather: ArduinoWeatherData) -> None:
-        log.debug(f"got weather data from arduino : {weather}")
-        weather.wind = self._value_to_wind_speed(weather.wind)
-        self._weather.append(weather)
-        self._weather = self._weather[-self.config.local_cache_size:]
+        sample_log.debug("got weather data from arduino", device=weather.device, wind=weather.wind, light_1=weather.light_1, light_2=weather.light_2, rain=weather.rain)
+        device = self._device(weather.device)
+        for channel in channels:
+            device.medians[channel].append(self._calibrations[channel].scalar(getattr(weather, channel)))
+        device.rain = int(self._calibrations['rain'].scalar(weather.rain))
+        single_samples.inc()
+
+    def append_weather_batch(self, samples: list[ArduinoWeatherSampleSchema], device: str = default_device) -> None:
+        """Converts a buffered batch at once and pushes it into the cache, in device time order when timestamps are sent"""
+        if not samples:
+            return
+        if all(sample.timestamp is not None for sample in samples):
+            samples = sorted(samples, key=lambda sample: sample.timestamp)
+        batch_log.debug("got batch of weather samples from arduino", device=device, samples=len(samples), first=samples[0].timestamp, last=samples[-1].timestamp)
+        raw = np.array([(sample.wind, sample.light_1, sample.light_2, sample.rain) for sample in samples], dtype=np.float64)
+        weather = self._device(device)
+        for index, channel in enumerate(channels):
+            weather.medians[channel].extend(self.calibrate(channel, raw[:, index]).tolist())
+        weather.rain = int(self._calibrations['rain'].scalar(raw[-1, 3]))
+        batch_samples.inc(len(samples))
 
     def save_weather_data(self) -> None:
-        if self._weather:
-            db_service.add(
-                ArduinoWeatherData(
-                    wind = statistics.median([w.wind for w in self._weather]),
-                    light_1 = statistics.median([w.light_1 for w in self._weather]),
-                    light_2 = statistics.median([w.light_2 for w in self._weather]),
-                    rain = self._weather[-1].rain
-                    )
-                )
-        else:
+        saved = 0
+        for device in self.devices:
+            current = self.get_current_weather(device)
+            if current:
+                self.store_sample(current)
+                saved += 1
+        if not saved:
             log.warning("no data available to save")
 
-    def get_history(self, time: dt.datetime) -> list[ArduinoWeatherData]:
-        return db_service.session.exec(select(ArduinoWeatherData).where(ArduinoWeatherData.timestamp > time)).all()
-
-    def get_current_weather(self) -> ArduinoWeatherData | None:
-        if self._weather:
-            return ArduinoWeatherData(
-                wind = statistics.median([w.wind for w in self._weather]),
-                light_1 = statistics.median([w.light_1 for w in self._weather]),
-                light_2 = statistics.median([w.light_2 for w in self._weather]),
-                rain = self._weather[-1].rain
-                )
+    def store_sample(self, sample: ArduinoWeatherData) -> None:
+        """Saves the sample and updates the buckets it falls into in the same transaction"""
+        with db_service.session_scope() as session:
+            session.add(sample)
+            session.flush()
+            for resolution, model in rollup_models.items():
+                self._update_rollup(session, model, sample, bucket_bounds(sample.timestamp, resolution)[0])
+            session.commit()
+
+    @staticmethod
+    def _update_rollup(session, model: type[ArduinoWeatherRollup], sample: ArduinoWeatherData, start: dt.datetime):
+        """
+        Every statistic is updated from the new sample only, the raw rows of the bucket are never read
+        Notes:
+            The median is a running estimate, it moves towards the sample by at most the bucket range divided by
+            its sample count, rebuild_rollups replaces it with the exact median of the raw samples
+        """
+        rollup = session.exec(select(model).where(model.device == sample.device, model.timestamp == start)).first()
+        if rollup is None:
+            rollup = model(timestamp=start, device=sample.device, samples=0, rain_fraction=0,
+                           **{f'{channel}_{stat}': getattr(sample, channel) for channel in channels for stat in ('min', 'max', 'mean', 'median')})
+        rollup.samples += 1
+        rollup.rain_fraction += ((1 if sample.rain else 0) - rollup.rain_fraction) / rollup.samples
+        for channel in channels:
+            value = getattr(sample, channel)
+            setattr(rollup, f'{channel}_min', min(getattr(rollup, f'{channel}_min'), value))
+            setattr(rollup, f'{channel}_max', max(getattr(rollup, f'{channel}_max'), value))
+            setattr(rollup, f'{channel}_mean', getattr(rollup, f'{channel}_mean') + (value - getattr(rollup, f'{channel}_mean')) / rollup.samples)
+            step = (getattr(rollup, f'{channel}_max') - getattr(rollup, f'{channel}_min')) / rollup.samples
+            median = getattr(rollup, f'{channel}_median')
+            setattr(rollup, f'{channel}_median', median + min(max(value - median, -step), step))
+        session.add(rollup)
+
+    def recalibrate(self, previous: dict[str, CalibrationConfig], since: dt.datetime = dt.datetime.min, chunk_size: int = 50000) -> int:
+        """
+        Applies the current calibration to stored samples that were saved with the `previous` one
+        Notes:
+            Stored values are medians of calibrated readings, the curves are monotonic so mapping the median back
+            to the raw reading and through the new curve gives the median of the re-calibrated readings
+            Channels missing from `previous` are taken as saved with the default calibration,
+            channels whose curve did not change are left untouched
+        """
+        previous_calibrations = {channel: compile_calibration(previous[channel]) if channel in previous else
+                                 compile_calibration(CalibrationConfig() if channel != 'wind' else self.anemometer_calibration())
+                                 for channel in calibrated_channels}
+        changed = [channel for channel in calibrated_channels if previous_calibrations[channel].config != self._calibrations[channel].config]
+        if not changed:
+            log.info("calibration did not change, nothing to re-calibrate")
+            return 0
+        table = ArduinoWeatherData.__tablename__
+        select_chunk = f"SELECT id, {', '.join(changed)} FROM {table} WHERE timestamp >= ? AND id > ? ORDER BY id LIMIT ?"
+        update_row = f"UPDATE {table} SET {', '.join(f'{channel} = ?' for channel in changed)} WHERE id = ?"
+        last_id, updated = 0, 0
+        while True:
+            with db_service.session_scope() as session:
+                # plain cursor, the per row parameter processing of the orm would dominate a year of samples
+                cursor = session.connection().connection.cursor()
+                rows = cursor.execute(select_chunk, (since.isoformat(sep=' '), last_id, chunk_size)).fetchall()
+                if not rows:
+                    break
+                data = np.array(rows, dtype=np.float64)
+                recalibrated = [self.calibrate(channel, previous_calibrations[channel].inverse(data[:, index]))
+                                for index, channel in enumerate(changed, start=1)]
+                recalibrated = [values.astype(np.int64) if channel == 'rain' else values for channel, values in zip(changed, recalibrated)]
+                ids = data[:, 0].astype(np.int64)
+                cursor.executemany(update_row, zip(*(values.tolist() for values in recalibrated), ids.tolist()))
+                session.commit()
+            last_id = int(ids[-1])
+            updated += len(ids)
+            log.info(f"re-calibrated {updated} samples")
+
+        if updated:
+            with db_service.session_scope(read_only=True) as session:
+                oldest = session.exec(select(func.min(ArduinoWeatherData.timestamp)).where(ArduinoWeatherData.timestamp >= since)).one()
+            self.rebuild_rollups(oldest)
+        return updated
+
+    def rebuild_rollups(self, since: dt.datetime = dt.datetime.min):
+        """
+        Recomputes the buckets from the raw samples from since on, after stored samples change or to replace
+        the running median estimates by exact medians
+
+        Notes:
+            Buckets are only replaced where raw samples are left, a bucket without samples or with fewer samples
+            than its stored rollup (deleted by retention or moved to the archive) keeps its stored values
+        """
+        starts = {resolution: bucket_bounds(since, resolution)[0] if since > dt.datetime.min else since for resolution in rollup_models}
+        stats = [f'{channel}_{stat}' for channel in channels for stat in ('min', 'max', 'mean', 'median')]
+        columns = ['timestamp', 'device', 'samples', 'rain_fraction', *stats]
+        with db_service.session_scope() as session:
+            cursor = session.connection().connection.cursor()
+            rows = cursor.execute(f"SELECT timestamp, device, {', '.join(calibrated_channels)} FROM {ArduinoWeatherData.__tablename__} WHERE timestamp >= ?",
+                                  (min(starts.values()).isoformat(sep=' '),)).fetchall()
+            if not rows:
+                return
+            samples = (pl.DataFrame(rows, schema=['timestamp', 'device', *calibrated_channels], orient='row')
+                       .with_columns(pl.col('timestamp').str.to_datetime()))
+            for resolution, model in rollup_models.items():
+                stored = pl.DataFrame(cursor.execute(f"SELECT timestamp, device, samples FROM {model.__tablename__} WHERE timestamp >= ?",
+                                                     (starts[resolution].isoformat(sep=' '),)).fetchall(),
+                                      schema={'timestamp': pl.String, 'device': pl.String, 'stored_samples': pl.Int64}, orient='row')
+                rollups = (samples.filter(pl.col('timestamp') >= starts[resolution])
+                           .group_by(pl.col('timestamp').dt.truncate(rollup_intervals[resolution]), 'device')
+                           .agg([pl.len().alias('samples'), (pl.col('rain') > 0).mean().alias('rain_fraction')] +
+                                [getattr(pl.col(channel), stat)().alias(f'{channel}_{stat}')
+                                 for channel in channels for stat in ('min', 'max', 'mean', 'median')])
+                           .with_columns(pl.col('timestamp').dt.strftime('%Y-%m-%d %H:%M:%S%.6f'))
+                           .join(stored, on=['timestamp', 'device'], how='left')
+                           .filter(pl.col('stored_samples').is_null() | (pl.col('stored_samples') <= pl.col('samples'))))
+                cursor.executemany(f"DELETE FROM {model.__tablename__} WHERE timestamp = ? AND device = ?", rollups.select('timestamp', 'device').rows())
+                cursor.executemany(f"INSERT INTO {model.__tablename__} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                                   rollups.select(columns).rows())
+            session.commit()
+
+    @staticmethod
+    def history_query(time: dt.datetime, resolution: WeatherResolution = WeatherResolution.raw, device: str | None = None,
+                       until: dt.datetime | None = None):
+        """Every device when device is None, a single device is read through the (device, timestamp) index"""
+        model = ArduinoWeather.history_model(resolution)
+        query = select(model).where(model.timestamp > time if resolution is WeatherResolution.raw else model.timestamp >= bucket_bounds(time, resolution)[0])
+        if until is not None:
+            query = query.where(model.timestamp < until)
+        return query.where(model.device == device) if device is not None else query
+
+    @staticmethod
+    def history_model(resolution: WeatherResolution) -> type[ArduinoWeatherData | ArduinoWeatherRollup]:
+        return ArduinoWeatherData if resolution is WeatherResolution.raw else rollup_models[resolution]
+
+    def get_history(self, time: dt.datetime, device: str | None = None) -> list[ArduinoWeatherData]:
+        """Raw samples after time, archived months overlapping the range are read before the database rows"""
+        with db_service.session_scope(read_only=True) as session:
+            rows = session.exec(self.history_query(time, device=device)).all()
+        return archive.service.union(ArduinoWeatherData, rows, time, predicate=pl.col('device') == device if device is not None else None)
+
+    def get_current_weather(self, device: str = default_device) -> ArduinoWeatherData | None:
+        """Medians of the cached samples of the device, kept up to date on every append"""
+        weather = self._devices.get(device)
+        if weather is not None and weather.rain is not None:
+            return ArduinoWeatherData(device=device, rain=weather.rain, **{channel: median.median() for channel, median in weather.medians.items()})
 
 
 service = ArduinoWeather('ArduinoWeatherService')
@@ -1,38 +1,65 @@
 import datetime as dt
 from math import exp
-import schedule
+from pydantic import PrivateAttr
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from scarlet.core import log as log_, config
+from scarlet.core import log as log_, config, scheduler
+from scarlet.core.state import StateChannel
 import scarlet.services.open_weather as open_weather
 import scarlet.services.arduino_weather as arduino_weather
 from scarlet.api.schemas import BlindsPydanticSchema, BlindState
-from scarlet.db.models import BlindAction
+from scarlet.db.models import BlindAction, default_device
 from scarlet.db.db import service as db_service
 
 log = log_.service.logger('blinds')
 
 
 class BlindsController(config.Controller):
-    _blinds_status: BlindsPydanticSchema = BlindsPydanticSchema(left_blind=BlindState.nostate, right_blind=BlindState.nostate)
-    _scheduled_jobs: list[schedule.Job] = list()
+    _blinds_status: StateChannel[BlindsPydanticSchema] = PrivateAttr(
+        default_factory=lambda: StateChannel(BlindsPydanticSchema(left_blind=BlindState.nostate, right_blind=BlindState.nostate)))
+    _scheduled_jobs: list[scheduler.Job] = list()
+    _automation_version: int = 0
     temperature_limit: float
     light_limit: float
     cloud_cover_limit: float
     automation: bool
+    ack_timeout: float = 5
 
     @property
-    def blind_status(self):
-        return self._blinds_status
+    def blind_status(self) -> BlindsPydanticSchema:
+        return self._blinds_status.state
 
     @blind_status.setter
     def blind_status(self, program: BlindsPydanticSchema):
-        self._blinds_status = program
+        self._blinds_status.set(program)
+
+    @property
+    def blind_status_version(self) -> int:
+        return self._blinds_status.version
+
+    @property
+    def automation_version(self) -> int:
+        return self._automation_version
+
+    async def wait_for_ack(self, item: BlindsPydanticSchema) -> bool:
+        """The board acknowledges a command by resetting the moved blinds to nostate"""
+        moved = [side for side in ('left_blind', 'right_blind') if getattr(item, side) is not BlindState.nostate]
+        if not moved:
+            return True
+        return await self._blinds_status.wait_for(
+            lambda status: any(getattr(status, side) == BlindState.nostate for side in moved), self.ack_timeout)
+
+    async def wait_for_command(self, version: int, timeout: float) -> tuple[int, BlindsPydanticSchema]:
+        return await self._blinds_status.wait_newer(version, timeout)
+
+    def take_over(self, previous: 'BlindsController'):
+        # the boards long polling the status keep waiting on the same channel
+        self._blinds_status = previous._blinds_status
 
     def schedule_jobs(self):
         log.debug("scheduling blinds related jobs")
         if self.automation:
-            schedule.every(10).minutes.do(self.decide_opening_and_closing)
-            self._scheduled_jobs.append(schedule.every(10).minutes.do(self.decide_opening_and_closing))
+            self._scheduled_jobs.append(scheduler.service.every(10).minutes.do(self.decide_opening_and_closing))
 
     def check_open_weather_conditions(self) -> bool | None:
         open_weather_data = open_weather.service.get_current_data()
@@ -86,21 +113,22 @@ class BlindsController(config.Controller):
             db_service.add(BlindAction(is_user=False, is_left_up=True, is_right_up=True))
 
 
-    def set_blinds(self, item: BlindsPydanticSchema):
+    async def set_blinds(self, session: AsyncSession, item: BlindsPydanticSchema):
         self.blind_status = item
-        db_service.add(BlindAction(is_user=True, is_left_up=True, is_right_up=True))
+        await db_service.add_async(session, BlindAction(is_user=True, is_left_up=True, is_right_up=True))
 
 
     def set_automation(self, state: bool):
         self.automation = state
+        self._automation_version += 1
         if state is False:
             log.debug(f'cancelling {len(self._scheduled_jobs)} scheduled jobs')
-            [schedule.cancel_job(j) for j in self._scheduled_jobs]
+            [scheduler.service.cancel_job(j) for j in self._scheduled_jobs]
             self._scheduled_jobs = list()
         else:
             self.schedule_jobs()
         self._self_edit_config(attribute='automation', new_value=state)
 
     def get_adjustment_curves(self):
-        history = arduino_weather.service.get_history(dt.datetime.now() - dt.timedelta(days=1))
+        history = arduino_weather.service.get_history(dt.datetime.now() - dt.timedelta(days=1), device=default_device)
         history = [h for h in history if h.timestamp > dt.datetime(dt.date.today().year(), dt.date.today().year(), dt.date.today().year(), 0)]
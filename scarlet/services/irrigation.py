@@ -1,55 +1,55 @@
-import os
+import asyncio
 import datetime as dt
-import schedule
 from sqlmodel import select, delete
-import polars as pl
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.orm import selectinload
+from pydantic import PrivateAttr
 
-from scarlet.core import log as log_, config
-from scarlet.services import open_weather, arduino_weather
+from scarlet.core import log as log_, config, scheduler
+from scarlet.core.state import StateChannel
+from scarlet.services import open_weather, arduino_weather, irrigation_score
 from scarlet.db.models import RanIrrigationSessionHistory, IrrigationProgram, IrrigationProgramSession
 from scarlet.db.db import service as db_service
-from scarlet.api.schemas import IrrigationSessionSchema, IrrigationRunSessionSchema, IrrigationState
+from scarlet.api.schemas import IrrigationRunSessionSchema, IrrigationState
 
 log = log_.service.logger('irrigation')
+slog = log_.service.structured('irrigation')
 
 
 class IrrigationController(config.Controller):
-    _irrigation_status: IrrigationRunSessionSchema = IrrigationRunSessionSchema(active=IrrigationState.nostate)
+    _irrigation_status: StateChannel[IrrigationRunSessionSchema] = PrivateAttr(
+        default_factory=lambda: StateChannel(IrrigationRunSessionSchema(active=IrrigationState.nostate)))
     _scheduled_sessions: list[IrrigationProgramSession] = list()
-    _scheduled_jobs: list[schedule.Job] = list()
+    _scheduled_jobs: list[scheduler.Job] = list()
+    _automation_version: int = 0
+    _programs_version: int = 0
     automation: bool
+    ack_timeout: float = 5
+
+    def take_over(self, previous: 'IrrigationController'):
+        # the boards long polling the status keep waiting on the same channel
+        self._irrigation_status = previous._irrigation_status
 
     def schedule_jobs(self):
         log.debug("Scheduling Irrigation jobs")
         if self.automation:
             self.scheduling_programs()
-            self._scheduled_jobs.append(schedule.every().day.at("03:30").do(self.scheduling_programs))
+            self._scheduled_jobs.append(scheduler.service.every().day.at("03:30").do(self.scheduling_programs))
 
     @staticmethod
     def calculate_score() -> float:
-        log.info("Calculating score for irrigation run")
-        vapour_df = pl.read_csv(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../resources", "vapour.csv")).unpivot(index="C", variable_name="humidity", value_name="VPD").with_columns([pl.col("humidity").cast(pl.Int32)])
-        weather = [data.model_dump() for data in open_weather.service.get_history(dt.datetime.now() - dt.timedelta(days=2))]
-        if not weather:
-            log.warning('no historic data to calculate score')
-            return 0
-        weather_df = pl.from_dicts(weather)
-        weather_df = weather_df.with_columns(pl.col('temperature_2m').cast(pl.Int16).clip(lower_bound=6, upper_bound=35), ((pl.col('relative_humidity_2m') / 5).cast(pl.Int16) * 5).clip(lower_bound=5))
-        weather_df = vapour_df.join(weather_df, left_on=['C', 'humidity'], right_on=['temperature_2m', 'relative_humidity_2m'])[['timestamp', 'VPD', 'wind_speed_10m', 'C', 'humidity']]
-        weather_df = weather_df.with_columns((pl.col('VPD') + (pl.col('wind_speed_10m') * 0.03)).alias('score'))
-        log.debug(f"Calculating average score based on {weather_df}")
-        score = weather_df['score'].mean()
-        log.debug(f"Calculated score: {score}")
-        return score
+        return irrigation_score.service.get_score()
 
     def scheduling_programs(self):
         log.info("making decision of irrigation run")
         score = self.calculate_score()
         last_session: RanIrrigationSessionHistory = db_service.get_last(RanIrrigationSessionHistory)
         log.debug(f"last_session: {last_session}")
-        programs = db_service.session.exec(select(IrrigationProgram).where(IrrigationProgram.is_active == True)).all()
-        log.debug(f"retreived programs: {programs}")
+        with db_service.session_scope(read_only=True) as db_session:
+            programs = db_session.exec(select(IrrigationProgram).where(IrrigationProgram.is_active == True).options(selectinload(IrrigationProgram.sessions))).all()
+        slog.debug("retreived programs", programs=programs)
 
+        [scheduler.service.cancel_job(j) for j in self._scheduled_sessions]
         self._scheduled_sessions = list()
         scheduled_programs: list[IrrigationProgram] = list()
         for program in programs:
@@ -58,7 +58,7 @@ class IrrigationController(config.Controller):
                 if last_session is None or program.frequency == 1 or (((dt.datetime(dt.datetime.now().year, dt.datetime.now().month, dt.datetime.now().day, 23, 59) - last_session.timestamp).days >= program.frequency)):
                     scheduled_programs.append(program)
                     for session in program.sessions:
-                        scheduled = schedule.every().day.at(session.start_time.strftime("%H:%M")).do(self.run_scheduled_session, session=session)
+                        scheduled = scheduler.service.every().day.at(session.start_time.strftime("%H:%M")).do(self.run_scheduled_session, session=session)
                         log.debug(f"scheduled session: {scheduled}")
                         self._scheduled_sessions.append(scheduled)
                     break
@@ -68,86 +68,117 @@ class IrrigationController(config.Controller):
 
     def run_scheduled_session(self, session: IrrigationProgramSession):
         weather = arduino_weather.service.get_current_weather()
-        precipitation_prev24 = sum([w.precipitation for w in open_weather.service.get_history(dt.timedelta(hours=24))])
+        precipitation_prev24 = sum([w.precipitation for w in open_weather.service.get_history(dt.datetime.now() - dt.timedelta(hours=24))])
         if weather and weather.rain == 1:
             log.info("rained before irrigation session, skipping scheduled run")
-            return schedule.CancelJob
+            return scheduler.CancelJob
         if precipitation_prev24 and 10 < precipitation_prev24:
             log.info(f"rained {precipitation_prev24}mm before irrigation session, skipping scheduled run")
-            return schedule.CancelJob
+            return scheduler.CancelJob
         log.info(f"started irrigation with {session}")
-        self._irrigation_status = IrrigationRunSessionSchema(zone1=session.zone1, zone2=session.zone2, zone3=session.zone3, zone_connected=session.zone_connected, active=IrrigationState.on)
+        self._irrigation_status.set(IrrigationRunSessionSchema(zone1=session.zone1, zone2=session.zone2, zone3=session.zone3, zone_connected=session.zone_connected, active=IrrigationState.on))
         session_dict = session.model_dump()
         session_dict.pop('id')
         db_service.add(RanIrrigationSessionHistory.model_validate(session_dict))
-        return schedule.CancelJob
+        return scheduler.CancelJob
+
+    @staticmethod
+    def historical_sessions_query(since: dt.datetime | None = None, until: dt.datetime | None = None):
+        query = select(RanIrrigationSessionHistory).where(RanIrrigationSessionHistory.timestamp > (since or dt.datetime.now() - dt.timedelta(days=2)))
+        return query.where(RanIrrigationSessionHistory.timestamp < until) if until is not None else query
 
-    def get_historical_sessions(self):
-        return db_service.session.exec(select(RanIrrigationSessionHistory).where(RanIrrigationSessionHistory.timestamp > dt.datetime.now() - dt.timedelta(days=2))).all()
+    async def get_historical_sessions(self, db_session: AsyncSession):
+        return (await db_session.exec(self.historical_sessions_query())).all()
 
-    def set_irrigation_status(self, session: IrrigationRunSessionSchema):
+    async def set_irrigation_status(self, db_session: AsyncSession, session: IrrigationRunSessionSchema):
         log.info(f"updating irrigation status: {session}")
-        self._irrigation_status = session
+        self._irrigation_status.set(session)
         if session.active == 'on':
-            db_service.add(RanIrrigationSessionHistory.model_validate(session.model_validate(session)))
+            await db_service.add_async(db_session, RanIrrigationSessionHistory.model_validate(session.model_validate(session)))
 
-    def get_irrigation_status(self):
-        return self._irrigation_status
+    def get_irrigation_status(self) -> IrrigationRunSessionSchema:
+        return self._irrigation_status.state
 
-    def set_irrigation_program(self, progam: IrrigationProgram):
-        log.info(f"adding program {progam} to database")
-        db_service.add(progam)
+    def get_irrigation_status_version(self) -> int:
+        return self._irrigation_status.version
+
+    async def wait_for_ack(self, session: IrrigationRunSessionSchema) -> bool:
+        """The board acknowledges a command by resetting the status to nostate"""
+        if session.active == IrrigationState.nostate:
+            return True
+        return await self._irrigation_status.wait_for(lambda status: status.active == IrrigationState.nostate, self.ack_timeout)
+
+    async def wait_for_command(self, version: int, timeout: float) -> tuple[int, IrrigationRunSessionSchema]:
+        return await self._irrigation_status.wait_newer(version, timeout)
+
+    @property
+    def automation_version(self) -> int:
+        return self._automation_version
+
+    @property
+    def programs_version(self) -> int:
+        """Incremented after every committed change of the programs or their sessions"""
+        return self._programs_version
+
+    async def _programs_changed(self):
+        """Scheduling reads the programs with the sync api, it runs in a worker thread to keep the event loop free"""
+        self._programs_version += 1
         if self.automation:
-            self.scheduling_programs()
+            await asyncio.to_thread(self.scheduling_programs)
 
-    def update_irrigation_program(self, progam: IrrigationProgram):
+    async def set_irrigation_program(self, db_session: AsyncSession, progam: IrrigationProgram):
+        log.info(f"adding program {progam} to database")
+        await db_service.add_async(db_session, progam)
+        await self._programs_changed()
+
+    async def update_irrigation_program(self, db_session: AsyncSession, progam: IrrigationProgram):
         log.info(f"updating program {progam}")
-        db_service.add(progam)
-        if self.automation:
-            self.scheduling_programs()
+        await db_service.add_async(db_session, progam)
+        await self._programs_changed()
 
-    def update_irrigation_session(self, session: IrrigationProgramSession):
+    async def update_irrigation_session(self, db_session: AsyncSession, session: IrrigationProgramSession):
         log.info(f"updating session {session}")
-        db_service.add(session)
-        if self.automation:
-            self.scheduling_programs()
+        await db_service.add_async(db_session, session)
+        await self._programs_changed()
 
-    def get_irrigation_programs(self) -> list[IrrigationProgram]:
-        programs = db_service.session.exec(select(IrrigationProgram)).all()
-        log.info(f"retreived program {programs}")
+    async def get_irrigation_programs(self, db_session: AsyncSession) -> list[IrrigationProgram]:
+        programs = (await db_session.exec(select(IrrigationProgram).options(selectinload(IrrigationProgram.sessions)))).all()
+        slog.info("retreived programs", programs=programs)
         return programs
 
-    def get_irrigation_program_by_id(self, program_id: int) -> IrrigationProgram:
-        program = db_service.session.exec(select(IrrigationProgram).where(IrrigationProgram.id == program_id)).first()
+    async def get_irrigation_program_by_id(self, db_session: AsyncSession, program_id: int) -> IrrigationProgram:
+        program = (await db_session.exec(select(IrrigationProgram).where(IrrigationProgram.id == program_id).options(selectinload(IrrigationProgram.sessions)))).first()
+        # ends the read transaction, a writer session gives the writer slot back until the caller writes
+        await db_session.commit()
         log.info(f"retreived program {program}")
         return program
 
-    def delete_irrigation_program_by_id(self, program_id: int):
-        db_service.session.exec(delete(IrrigationProgram).where(IrrigationProgram.id == program_id))
-        db_service.session.commit()
+    async def delete_irrigation_program_by_id(self, db_session: AsyncSession, program_id: int):
+        await db_session.exec(delete(IrrigationProgram).where(IrrigationProgram.id == program_id))
+        await db_session.commit()
         log.info(f"Deleted program {program_id}")
-        if self.automation:
-            self.scheduling_programs()
+        await self._programs_changed()
 
-    def delete_irrigation_session_by_id(self, session_id: int):
-        db_service.session.exec(delete(IrrigationProgramSession).where(IrrigationProgramSession.id == session_id))
-        db_service.session.commit()
+    async def delete_irrigation_session_by_id(self, db_session: AsyncSession, session_id: int):
+        await db_session.exec(delete(IrrigationProgramSession).where(IrrigationProgramSession.id == session_id))
+        await db_session.commit()
         log.info(f"Deleted session {session_id}")
-        if self.automation:
-            self.scheduling_programs()
+        await self._programs_changed()
 
-    def get_session_by_id(self, session_id: int) -> IrrigationProgramSession:
-        session = db_service.session.exec(select(IrrigationProgramSession).where(IrrigationProgramSession.id == session_id)).first()
+    async def get_session_by_id(self, db_session: AsyncSession, session_id: int) -> IrrigationProgramSession:
+        session = (await db_session.exec(select(IrrigationProgramSession).where(IrrigationProgramSession.id == session_id))).first()
+        await db_session.commit()
         log.info(f"retreived session {session}")
         return session
 
     def set_automation(self, state: bool):
         self.automation = state
+        self._automation_version += 1
         if state is False:
             log.debug(f'cancelling {len(self._scheduled_jobs)} scheduled jobs and {len(self._scheduled_sessions)} irrigation sessions')
-            [schedule.cancel_job(j) for j in self._scheduled_jobs]
+            [scheduler.service.cancel_job(j) for j in self._scheduled_jobs]
             self._scheduled_jobs = list()
-            [schedule.cancel_job(j) for j in self._scheduled_sessions]
+            [scheduler.service.cancel_job(j) for j in self._scheduled_sessions]
             self._scheduled_sessions = list()
         else:
             self.scheduling_programs()
@@ -0,0 +1,122 @@
+import datetime as dt
+import math
+import os
+import threading
+import numpy as np
+from sqlmodel import select
+
+from scarlet.core import log as log_, config, vpd
+from scarlet.core.rolling import TimeWindowMean
+from scarlet.db.db import service as db_service
+from scarlet.db.models import HistoricalWeather
+from scarlet.api.schemas import IrrigationScoreHourSchema, IrrigationScoreSchema
+
+log = log_.service.logger('irrigation_score')
+slog = log_.service.structured('irrigation_score')
+
+
+class IrrigationScoreService(config.Service):
+    """
+    Rolling irrigation score, the mean of VPD + wind_factor * wind speed over the last window_hours of weather
+
+    Notes:
+        OpenWeatherService feeds every stored HistoricalWeather hour, a revised hour replaces the one in the window,
+        the window is persisted to state_path after each update, on start only the hours stored after the saved state
+        are read from the database
+        The window is updated from the scheduler's threads and read from the request threadpool, every access holds
+        a reentrant lock (loading the window adds the caught up hours)
+    """
+    class Config(config.Service.Config):
+        window_hours: int = 48
+        wind_factor: float = 0.03
+        state_path: str | None = None
+
+    config: 'IrrigationScoreService.Config' = Config()
+    _window: TimeWindowMean | None = None
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._lock = threading.RLock()
+
+    def initialize(self):
+        with self._lock:
+            self._window = None
+            self._ensure_loaded()
+
+    def _ensure_loaded(self) -> TimeWindowMean:
+        with self._lock:
+            if self._window is None:
+                self._window = TimeWindowMean(dt.timedelta(hours=self.config.window_hours))
+                for hour in self._load_state():
+                    self._window.append(hour.timestamp, hour.score, hour)
+                self._catch_up()
+            return self._window
+
+    def _load_state(self) -> list[IrrigationScoreHourSchema]:
+        if not self.config.state_path or not os.path.exists(self.config.state_path):
+            return list()
+        try:
+            with open(self.config.state_path) as file:
+                return IrrigationScoreSchema.model_validate_json(file.read()).hours
+        except Exception as e:
+            log.error(f"cannot load irrigation score state: {e}")
+            return list()
+
+    def _save_state(self):
+        if not self.config.state_path:
+            return
+        state = IrrigationScoreSchema(score=self._window.mean() or 0, hours=self._window.items())
+        temporary_path = f"{self.config.state_path}.tmp"
+        with open(temporary_path, 'w') as file:
+            file.write(state.model_dump_json())
+        os.replace(temporary_path, self.config.state_path)
+
+    def _catch_up(self):
+        """Adds the hours stored since the state was saved, the whole window when there was no state"""
+        since = self._window.last() or dt.datetime.now() - dt.timedelta(hours=self.config.window_hours)
+        with db_service.session_scope(read_only=True) as session:
+            weather = session.exec(select(HistoricalWeather).where(HistoricalWeather.timestamp > since).order_by(HistoricalWeather.timestamp)).all()
+        log.debug(f"catching up {len(weather)} hours since {since}")
+        self.add_hours(weather)
+
+    def add_hours(self, weather: list[HistoricalWeather]):
+        if not weather:
+            self._ensure_loaded()
+            return
+        temperature, humidity, wind = (np.array([getattr(w, key) for w in weather], dtype=np.float64)
+                                       for key in ('temperature_2m', 'relative_humidity_2m', 'wind_speed_10m'))
+        vpds = vpd.table.lookup(temperature, humidity)
+        hours = list()
+        for w, value in zip(weather, vpds.tolist()):
+            value = None if math.isnan(value) else value
+            score = None if value is None else value + w.wind_speed_10m * self.config.wind_factor
+            hours.append(IrrigationScoreHourSchema(timestamp=w.timestamp, temperature_2m=w.temperature_2m, relative_humidity_2m=w.relative_humidity_2m,
+                                                   wind_speed_10m=w.wind_speed_10m, vpd=value, score=score))
+        with self._lock:
+            window = self._ensure_loaded()
+            for hour in hours:
+                window.append(hour.timestamp, hour.score, hour)
+            slog.debug("irrigation score updated", score=window.mean(), hours=weather)
+            self._save_state()
+
+    def _current_window(self) -> TimeWindowMean:
+        """Call with the lock held"""
+        window = self._ensure_loaded()
+        window.evict(dt.datetime.now() - dt.timedelta(hours=self.config.window_hours))
+        return window
+
+    def get_score(self) -> float:
+        with self._lock:
+            score = self._current_window().mean()
+        if score is None:
+            log.warning('no historic data to calculate score')
+            return 0
+        return score
+
+    def get_breakdown(self) -> IrrigationScoreSchema:
+        with self._lock:
+            window = self._current_window()
+            return IrrigationScoreSchema(score=window.mean() or 0, hours=window.items())
+
+
+service = IrrigationScoreService('IrrigationScoreService')
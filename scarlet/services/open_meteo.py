@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any
+import httpx
+
+from scarlet.core import log as log_, metrics
+
+log = log_.service.logger('open_meteo')
+request_seconds = metrics.registry.histogram('scarlet_open_meteo_request_seconds', "Open-Meteo request latency, failed requests included")
+failures = metrics.registry.counter('scarlet_open_meteo_failures', "Failed Open-Meteo requests by reason", ('reason',))
+joined = metrics.registry.counter('scarlet_open_meteo_joined', "Requests answered by an identical request already in flight")
+failure_reasons = {reason: failures.labels(reason) for reason in ('timeout', 'status', 'transport', 'other')}
+
+
+class OpenMeteoClient:
+    """
+    Open-Meteo http client with a persistent connection pool
+
+    Notes:
+        Requests run on the client's own event loop thread, async callers await them without blocking their loop
+        and sync callers (scheduled jobs) wait for the result, both share the same pool
+        Identical requests issued while one is in flight are answered by that single request
+    """
+
+    def __init__(self, url: str, timeout: float = 5, max_connections: int = 4):
+        self.url = url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._client: httpx.AsyncClient | None = None
+        self._in_flight: dict[tuple, Future] = dict()
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._client = httpx.AsyncClient(
+                    timeout=self.timeout,
+                    limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                )
+                self._thread = threading.Thread(target=self._loop.run_forever, name='open-meteo', daemon=True)
+                self._thread.start()
+            return self._loop
+
+    async def _get(self, params: dict[str, Any]) -> dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            response = await self._client.get(self.url, params=params)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            failure_reasons[self._failure_reason(e)].inc()
+            raise
+        finally:
+            request_seconds.observe(time.perf_counter() - start)
+
+    @staticmethod
+    def _failure_reason(error: Exception) -> str:
+        if isinstance(error, httpx.TimeoutException):
+            return 'timeout'
+        if isinstance(error, httpx.HTTPStatusError):
+            return 'status'
+        if isinstance(error, httpx.TransportError):
+            return 'transport'
+        return 'other'
+
+    def submit(self, params: dict[str, Any]) -> Future:
+        key = tuple(sorted(params.items()))
+        loop = self._ensure_started()
+        with self._lock:
+            if key in self._in_flight:
+                log.debug("joining in flight open meteo request")
+                joined.inc()
+                return self._in_flight[key]
+            future = asyncio.run_coroutine_threadsafe(self._get(params), loop)
+            self._in_flight[key] = future
+        # outside the lock, the callback runs right away when the request already finished
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return future
+
+    def _forget(self, key: tuple, future: Future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    async def fetch(self, params: dict[str, Any]) -> dict[str, Any]:
+        return await asyncio.wrap_future(self.submit(params))
+
+    def fetch_sync(self, params: dict[str, Any]) -> dict[str, Any]:
+        return self.submit(params).result()
+
+    @staticmethod
+    async def _shutdown(client: httpx.AsyncClient):
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await client.aclose()
+
+    def close(self):
+        with self._lock:
+            loop, client = self._loop, self._client
+            self._loop = self._client = None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(client), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
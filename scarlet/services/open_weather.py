@@ -1,31 +1,74 @@
+import asyncio
 import datetime as dt
-import requests
-import schedule
+import time
+from concurrent.futures import Future
 import polars as pl
 from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from scarlet.core import log as log_, config
+from scarlet.core import log as log_, config, scheduler
 from scarlet.db.db import service as db_service
+from scarlet.db import archive
 from scarlet.db.models import Weather, ForecastedWeather, HistoricalWeather
+from scarlet.services import irrigation_score
+from scarlet.services.open_meteo import OpenMeteoClient
 
 log = log_.service.logger('open_weather')
+slog = log_.service.structured('open_weather')
+
+
+hourly_variables = "temperature_2m,relative_humidity_2m,cloud_cover,precipitation,precipitation_probability,wind_speed_10m,wind_gusts_10m"
 
 
 class OpenWeatherService(config.Service):
-    url: str = "https://api.open-meteo.com/v1/forecast"
+    """
+    Open-Meteo weather, cached into the database for the irrigation and blinds logic
+
+    Notes:
+        Past hours, forecast, sun times and current weather are fetched in a single request,
+        past hours newer than the last stored one are added to the history, the forecast from midnight is replaced
+        Current weather is served from memory, once it is older than current_ttl the cached value is still returned
+        while one background request revalidates it, values older than current_max_staleness are dropped
+    """
+    class Config(config.Service.Config):
+        url: str = "https://api.open-meteo.com/v1/forecast"
+        latitude: float = 47.71318
+        longitude: float = 17.6505
+        timezone: str = "Europe/Berlin"
+        timeout: float = 5
+        max_connections: int = 4
+        past_days: int = 5
+        forecast_days: int = 2
+        current_ttl: float = 300
+        current_max_staleness: float = 3600
+
+    config: 'OpenWeatherService.Config' = Config()
+    _client: OpenMeteoClient | None = None
+    _current: tuple[Weather, float] | None = None
+    _revalidation: Future | None = None
     _sunset_time = dt.datetime
     _sunrise_time = dt.datetime
 
     def schedule_jobs(self):
         log.debug("scheduling open weather related jobs")
-        schedule.every().day.at("00:30").do(self._cache_historic_data)
-        schedule.every().day.at("00:35").do(self._cache_sun_data)
-        schedule.every(2).hours.do(self._cache_forecasted_weather_data)
+        scheduler.service.every().day.at("00:30").do(self.refresh)
+        scheduler.service.every(2).hours.do(self.refresh)
 
     def initialize(self):
-        self._cache_sun_data()
-        self._cache_historic_data()
-        self._cache_forecasted_weather_data()
+        self.close()
+        self.refresh()
+
+    @property
+    def client(self) -> OpenMeteoClient:
+        if self._client is None:
+            self._client = OpenMeteoClient(self.config.url, timeout=self.config.timeout, max_connections=self.config.max_connections)
+        return self._client
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        self._current = self._revalidation = None
 
     @property
     def sunrise_time(self):
@@ -35,90 +78,153 @@ class OpenWeatherService(config.Service):
     def sunset_time(self):
         return self._sunset_time
 
-    def _cache_historic_data(self):
-        params = {
-            "latitude": 47.71318,
-            "longitude": 17.6505,
-            "hourly": "temperature_2m,relative_humidity_2m,cloud_cover,precipitation,precipitation_probability,wind_speed_10m,wind_gusts_10m",
-            "timezone": "Europe/Berlin",
-            "past_days": 5,
-            "forecast_days": 1
+    def _params(self, **params) -> dict:
+        return {
+            "latitude": self.config.latitude,
+            "longitude": self.config.longitude,
+            "timezone": self.config.timezone,
+            **params,
         }
 
+    def _refresh_params(self) -> dict:
+        return self._params(
+            hourly=hourly_variables,
+            current=hourly_variables,
+            daily="sunset,sunrise",
+            past_days=self.config.past_days,
+            forecast_days=self.config.forecast_days,
+        )
+
+    def refresh(self):
+        """Scheduled job, updates history, forecast and sun times with one request"""
         try:
-            raw_data = requests.get(self.url, params=params, timeout=5)
-            df = pl.DataFrame(raw_data.json()['hourly'], schema_overrides={'time': pl.Datetime})
-            df = df.rename({'time': 'timestamp'})
-            last_historic_datapoint: HistoricalWeather = db_service.get_last(HistoricalWeather)
-            df = df.filter(pl.col('timestamp') > last_historic_datapoint.timestamp, pl.col('timestamp') <= dt.datetime.now()) if last_historic_datapoint else df
-            datapoints = [HistoricalWeather.model_validate(dict_) for dict_ in df.to_dicts()]
-            log.info(f'caching historical data: {datapoints}')
-            db_service.add_all(datapoints)
+            self._store(self.client.fetch_sync(self._refresh_params()))
         except Exception as e:
             log.error(e)
 
-
-    def _cache_forecasted_weather_data(self):
-        params = {
-            "latitude": 47.71318,
-            "longitude": 17.6505,
-            "hourly": "temperature_2m,relative_humidity_2m,cloud_cover,precipitation,precipitation_probability,wind_speed_10m,wind_gusts_10m",
-            "timezone": "Europe/Berlin",
-            "past_days": 0,
-            "forecast_days": 2
-        }
+    async def refresh_async(self):
         try:
-            raw_data = requests.get(self.url, params=params, timeout=5)
-            df = pl.DataFrame(raw_data.json()['hourly'], schema_overrides={'time': pl.Datetime})
-            df = df.rename({'time': 'timestamp'})
-            db_service.clear_data_after(ForecastedWeather, df.sort('timestamp')['timestamp'][0])
-            datapoints = [ForecastedWeather.model_validate(dict_) for dict_ in df.to_dicts()]
-            log.info(f'caching forecast data: {datapoints}')
-            db_service.add_all(datapoints)
+            data = await self.client.fetch(self._refresh_params())
+            await asyncio.to_thread(self._store, data)
         except Exception as e:
             log.error(e)
 
-    def _cache_sun_data(self):
-        params = {
-            "latitude": 47.71318,
-            "longitude": 17.6505,
-            "daily": "sunset,sunrise",
-            "timezone": "Europe/Berlin",
-            "past_days": 0,
-            "forecast_days": 1,
-        }
+    def _store(self, data: dict):
+        if 'current' in data:
+            self._cache_current(data)
+        if 'hourly' in data:
+            df = pl.DataFrame(data['hourly'], schema_overrides={'time': pl.Datetime}).rename({'time': 'timestamp'})
+            self._store_historic(df)
+            self._store_forecast(df)
+        if 'daily' in data:
+            self._store_sun(data['daily'])
+
+    def _store_historic(self, df: pl.DataFrame):
+        last_historic_datapoint: HistoricalWeather = db_service.get_last(HistoricalWeather)
+        df = df.filter(pl.col('timestamp') <= dt.datetime.now())
+        df = df.filter(pl.col('timestamp') > last_historic_datapoint.timestamp) if last_historic_datapoint else df
+        datapoints = [HistoricalWeather.model_validate(dict_) for dict_ in df.to_dicts()]
+        slog.info("caching historical data", datapoints=datapoints)
+        db_service.add_all(datapoints)
+        irrigation_score.service.add_hours(datapoints)
+
+    def _store_forecast(self, df: pl.DataFrame):
+        df = df.filter(pl.col('timestamp') >= dt.datetime.combine(dt.date.today(), dt.time())).sort('timestamp')
+        if df.is_empty():
+            log.warning("no forecast in the response")
+            return
+        db_service.clear_data_after(ForecastedWeather, df['timestamp'][0])
+        datapoints = [ForecastedWeather.model_validate(dict_) for dict_ in df.to_dicts()]
+        slog.info("caching forecast data", datapoints=datapoints)
+        db_service.add_all(datapoints)
+
+    def _store_sun(self, daily: dict):
+        today = dt.date.today().isoformat()
+        if today not in daily.get('time', list()):
+            log.warning(f"no sun data for {today} in the response")
+            return
+        index = daily['time'].index(today)
+        self._sunset_time = dt.datetime.fromisoformat(daily['sunset'][index])
+        self._sunrise_time = dt.datetime.fromisoformat(daily['sunrise'][index])
+
+    def _current_params(self) -> dict:
+        return self._params(current=hourly_variables, past_days=0, forecast_days=0)
+
+    @staticmethod
+    def _parse_current(data: dict) -> Weather:
+        df = pl.DataFrame(data['current'], schema_overrides={'time': pl.Datetime})
+        weather = Weather.model_validate(df.rename({'time': 'timestamp'}).to_dicts()[0])
+        slog.info("retreived current weather", timestamp=weather.timestamp, temperature=weather.temperature_2m, cloud_cover=weather.cloud_cover)
+        return weather
+
+    def _cache_current(self, data: dict):
+        self._current = (self._parse_current(data), time.monotonic())
+
+    def _revalidated(self, future: Future):
         try:
-            raw_data = requests.get(self.url, params=params, timeout=5)
-
-            self._sunset_time = dt.datetime.fromisoformat(raw_data.json()['daily']['sunset'][0])
-            self._sunrise_time = dt.datetime.fromisoformat(raw_data.json()['daily']['sunrise'][0])       
+            self._cache_current(future.result())
         except Exception as e:
-            log.error(e)
+            log.error(f"revalidating current weather failed: {e}")
+        finally:
+            self._revalidation = None
+
+    def _revalidate(self):
+        if self._revalidation is not None:
+            return
+        log.debug("revalidating current weather")
+        self._revalidation = self.client.submit(self._current_params())
+        self._revalidation.add_done_callback(self._revalidated)
+
+    def _cached_current(self) -> Weather | None:
+        """Never waits for the api, starts a revalidation when the cached value is missing or expired"""
+        if self._current is None:
+            self._revalidate()
+            return None
+        weather, fetched_at = self._current
+        age = time.monotonic() - fetched_at
+        if age > min(self.config.current_ttl, self.config.current_max_staleness):
+            self._revalidate()
+        if age > self.config.current_max_staleness:
+            log.warning(f"current weather is {age:.0f}s old, dropping it")
+            self._current = None
+            return None
+        return weather
 
     def get_current_data(self) -> Weather:
-        params = {
-            "latitude": 47.71318,
-            "longitude": 17.6505,
-            "current": "temperature_2m,relative_humidity_2m,cloud_cover,precipitation,precipitation_probability,wind_speed_10m,wind_gusts_10m",
-            "timezone": "Europe/Berlin",
-            "past_days": 0,
-            "forecast_days": 0
-        }
-        try:
-            raw_data = requests.get(self.url, params=params, timeout=5)
-            df = pl.DataFrame(raw_data.json()['current'], schema_overrides={'time': pl.Datetime})
-            df = df.rename({'time': 'timestamp'})
-            log.info(f'retreived current weather: {df}')
-            return Weather.model_validate(df.to_dicts()[0])
-        except Exception as e:
-            log.error(f"{e} \n getting current weather from history")
+        weather = self._cached_current()
+        if weather is None:
+            log.info("no current weather cached, getting current weather from history")
             return db_service.get_last(HistoricalWeather)
+        return weather
+
+    async def get_current_data_async(self) -> Weather:
+        weather = self._cached_current()
+        if weather is None:
+            log.info("no current weather cached, getting current weather from history")
+            return await asyncio.to_thread(db_service.get_last, HistoricalWeather)
+        return weather
+
+    @staticmethod
+    def _closest_history_query(time: dt.datetime):
+        return select(HistoricalWeather).where(HistoricalWeather.timestamp < time).order_by(HistoricalWeather.timestamp.desc())
+
+    @staticmethod
+    def history_query(time: dt.datetime, until: dt.datetime | None = None):
+        query = select(HistoricalWeather).where(HistoricalWeather.timestamp > time)
+        return query.where(HistoricalWeather.timestamp < until) if until is not None else query
 
     def get_closest_history(self, time: dt.datetime) -> HistoricalWeather:
-        return db_service.session.exec(select(HistoricalWeather).where(HistoricalWeather.timestamp < time).order_by(HistoricalWeather.timestamp.desc())).first()
+        with db_service.session_scope(read_only=True) as session:
+            return session.exec(self._closest_history_query(time)).first()
 
     def get_history(self, time: dt.datetime) -> list[HistoricalWeather]:
-        return db_service.session.exec(select(HistoricalWeather).where(HistoricalWeather.timestamp > time)).all()
+        """Weather after time, archived months overlapping the range are read before the database rows"""
+        with db_service.session_scope(read_only=True) as session:
+            rows = session.exec(self.history_query(time)).all()
+        return archive.service.union(HistoricalWeather, rows, time)
+
+    async def get_closest_history_async(self, session: AsyncSession, time: dt.datetime) -> HistoricalWeather:
+        return (await session.exec(self._closest_history_query(time))).first()
 
 
 service = OpenWeatherService('OpenWeatherService')
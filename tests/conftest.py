@@ -7,6 +7,20 @@ import shutil
 # add the directory containing your project to the sys.path list
 sys.path.append(f"/{os.path.join(*__file__.split('/')[:-2])}")
 
+import scarlet.core.log as log_
+
+# records of the whole run go to a temporary file, so rotation never writes into the repository
+log_directory = tempfile.mkdtemp()
+log_.service.configure(log_.LogConfig(filename=os.path.join(log_directory, 'logs.log')))
+
+
+@pytest.fixture(autouse=True, scope='session')
+def temporary_log_file():
+    yield
+    log_.service.stop()
+    shutil.rmtree(log_directory, ignore_errors=True)
+
+
 @pytest.fixture
 def test_resource_dir():
     dir_path = tempfile.mkdtemp()
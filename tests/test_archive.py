@@ -0,0 +1,113 @@
+import asyncio
+import datetime as dt
+import io
+import os
+import polars as pl
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+from sqlmodel import select
+
+from scarlet.api import routes
+from scarlet.db.archive import Archive
+from scarlet.db.db import Database
+from scarlet.db.models import ArduinoWeatherData, HistoricalWeather
+from scarlet.services.arduino_weather import ArduinoWeather
+from scarlet.services.open_weather import OpenWeatherService
+
+now = dt.datetime.now()
+
+
+def make_weather(timestamp: dt.datetime, device: str = 'default') -> ArduinoWeatherData:
+    return ArduinoWeatherData(timestamp=timestamp, device=device, wind=1.0, light_1=100, light_2=200, rain=0)
+
+
+@pytest.fixture
+def archive(test_resource_dir):
+    db = Database('test_archive_database')
+    db.init_config({'database': os.path.join(test_resource_dir, 'test.db')})
+    db.initialize()
+    # three months of daily samples from two boards
+    db.add_all([make_weather(now - dt.timedelta(days=day), device) for day in range(90) for device in ('north', 'south')])
+    db.add_all([HistoricalWeather(timestamp=now - dt.timedelta(days=day), temperature_2m=day, relative_humidity_2m=50, cloud_cover=0,
+                                  precipitation=0, precipitation_probability=0, wind_speed_10m=1, wind_gusts_10m=2) for day in range(90)])
+    archive = Archive('test_archive')
+    archive.init_config({'directory': os.path.join(test_resource_dir, 'archive'), 'models': {
+        'ArduinoWeatherData': {'keep_days': 30, 'chunk_size': 7},
+        'HistoricalWeather': {'keep_days': 30},
+    }})
+    with patch('scarlet.db.archive.db_service', db), patch('scarlet.db.archive.service', archive), \
+            patch('scarlet.services.arduino_weather.db_service', db), patch('scarlet.services.open_weather.db_service', db):
+        yield archive, db
+    asyncio.run(db.dispose())
+
+
+def test_archive_rejects_unknown_model():
+    with pytest.raises(ValidationError):
+        Archive('test_archive').init_config({'models': {'IrrigationProgram': {'keep_days': 1}}})
+
+
+def test_archive_moves_old_rows_into_month_files(archive):
+    archive, db = archive
+    assert archive.archive() == {'ArduinoWeatherData': 120, 'HistoricalWeather': 60}
+    with db.session_scope() as session:
+        assert len(session.exec(select(ArduinoWeatherData)).all()) == 60
+        assert min(row.timestamp for row in session.exec(select(ArduinoWeatherData))) > now - dt.timedelta(days=30)
+
+    paths = archive.partitions(ArduinoWeatherData, now - dt.timedelta(days=365))
+    assert [os.path.basename(path) for path in paths] == sorted({f"{(now - dt.timedelta(days=day)):%Y-%m}.parquet" for day in range(30, 90)})
+    assert pl.read_parquet(paths).height == 120
+    assert archive.archive() == {'ArduinoWeatherData': 0, 'HistoricalWeather': 0}
+
+
+def test_rows_left_by_an_interrupted_run_are_merged_once(archive):
+    archive, db = archive
+    before = now - dt.timedelta(days=30)
+    with db.session_scope() as session:
+        rows = session.exec(select(ArduinoWeatherData).where(ArduinoWeatherData.timestamp < before)).all()
+    leftover = [ArduinoWeatherData.model_validate(row.model_dump()) for row in rows]
+    assert archive.archive_model(ArduinoWeatherData, before) == len(leftover)
+    db.add_all(leftover)
+
+    assert archive.archive_model(ArduinoWeatherData, before) == len(leftover)
+    assert pl.read_parquet(archive.partitions(ArduinoWeatherData, now - dt.timedelta(days=365))).height == len(leftover)
+
+
+def test_history_unions_archive_and_database(archive):
+    archive, db = archive
+    since = now - dt.timedelta(days=45, hours=1)
+    expected = ArduinoWeather('test_arduino_weather').get_history(since, device='north')
+    expected_open_weather = OpenWeatherService('test_open_weather').get_history(since)
+    archive.archive()
+
+    history = ArduinoWeather('test_arduino_weather').get_history(since, device='north')
+    assert sorted(row.timestamp for row in history) == sorted(row.timestamp for row in expected)
+    assert len(history) == 46 and {row.device for row in history} == {'north'}
+    assert len(OpenWeatherService('test_open_weather').get_history(since)) == len(expected_open_weather) == 46
+    # months entirely before since are pruned
+    assert len(archive.partitions(ArduinoWeatherData, since)) < len(archive.partitions(ArduinoWeatherData, now - dt.timedelta(days=365)))
+    assert archive.partitions(ArduinoWeatherData, now - dt.timedelta(days=1)) == list()
+
+
+def test_history_routes_read_archived_ranges(archive):
+    archive, db = archive
+    archive.archive()
+    since = (now - dt.timedelta(days=45, hours=1)).isoformat()
+    with patch('scarlet.api.routes.archive_service', archive), patch('scarlet.api.streaming.db_service', db), \
+            patch('scarlet.api.streaming.chunk_size', 7):
+        client = TestClient(routes.app)
+        timestamps, cursor = list(), None
+        while True:
+            response = client.get('/weather/history', params={'since': since, 'device': 'north', 'limit': 10, **({'cursor': cursor} if cursor else {})})
+            timestamps += [row['timestamp'] for row in response.json()]
+            cursor = response.headers.get('x-next-cursor')
+            if cursor is None:
+                break
+        assert len(timestamps) == 46 and timestamps == sorted(timestamps)
+        assert timestamps[0] < (now - dt.timedelta(days=30)).isoformat() < timestamps[-1]
+
+        lines = client.get('/weather/history', params={'since': since, 'format': 'ndjson'}).text.splitlines()
+        assert len(lines) == 92
+        frame = pl.read_ipc_stream(io.BytesIO(client.get('/open_weather/history', params={'since': since, 'format': 'arrow'}).content))
+        assert frame.height == 46 and frame['timestamp'].is_sorted()
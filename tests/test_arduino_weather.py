@@ -0,0 +1,273 @@
+import asyncio
+import datetime as dt
+import os
+import numpy as np
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import select
+
+from scarlet.api import routes
+from scarlet.api.schemas import WeatherResolution, ArduinoWeatherSampleSchema
+from scarlet.core.calibration import CalibrationConfig
+from scarlet.db.db import Database
+from scarlet.db.models import ArduinoWeatherData, ArduinoWeatherMinute, ArduinoWeatherHour, ArduinoWeatherDay
+from scarlet.services.arduino_weather import ArduinoWeather
+
+
+@pytest.fixture
+def database(test_resource_dir):
+    db = Database('test_arduino_database')
+    db.init_config({'database': os.path.join(test_resource_dir, 'test.db')})
+    db.initialize()
+    with patch("scarlet.services.arduino_weather.db_service", db):
+        yield db
+    asyncio.run(db.dispose())
+
+
+@pytest.fixture
+def service():
+    return ArduinoWeather('ArduinoWeatherService')
+
+
+def make_sample(timestamp: dt.datetime, wind: float, light: float, rain: int = 0) -> ArduinoWeatherData:
+    return ArduinoWeatherData(timestamp=timestamp, wind=wind, light_1=light, light_2=light * 2, rain=rain)
+
+
+def test_store_sample_updates_every_resolution(database, service):
+    start = dt.datetime(2025, 6, 1, 10, 0)
+    winds = [3.0, 1.0, 8.0, 2.0]
+    for minute, wind in enumerate(winds):
+        service.store_sample(make_sample(start + dt.timedelta(minutes=minute, seconds=5), wind=wind, light=100 * (minute + 1), rain=minute % 2))
+    service.store_sample(make_sample(start + dt.timedelta(hours=1), wind=10.0, light=50))
+
+    with database.session_scope() as session:
+        minutes = session.exec(select(ArduinoWeatherMinute).order_by(ArduinoWeatherMinute.timestamp)).all()
+        hours = session.exec(select(ArduinoWeatherHour).order_by(ArduinoWeatherHour.timestamp)).all()
+        days = session.exec(select(ArduinoWeatherDay)).all()
+
+    assert [m.timestamp for m in minutes[:4]] == [start + dt.timedelta(minutes=m) for m in range(4)]
+    assert [h.samples for h in hours] == [4, 1]
+    hour = hours[0]
+    assert (hour.wind_min, hour.wind_max, hour.wind_mean) == (1.0, 8.0, 3.5)
+    assert (hour.light_2_min, hour.light_2_max) == (200, 800)
+    assert hour.rain_fraction == 0.5
+    assert days[0].samples == 5
+    # running estimates until the buckets are rebuilt from the raw samples
+    assert 1.0 <= hour.wind_median <= 8.0 and 200 <= hour.light_2_median <= 800
+    assert minutes[0].wind_median == 3.0
+
+    service.rebuild_rollups()
+    with database.session_scope() as session:
+        hour = session.exec(select(ArduinoWeatherHour).order_by(ArduinoWeatherHour.timestamp)).first()
+        day = session.exec(select(ArduinoWeatherDay)).one()
+    assert (hour.wind_median, hour.light_2_median, day.wind_median) == (2.5, 500, 3.0)
+
+
+def test_store_sample_does_not_read_the_bucket_samples(database, service):
+    start = dt.datetime(2025, 6, 1, 10, 0)
+    service.store_sample(make_sample(start, wind=1.0, light=100))
+    statements = []
+
+    def listener(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(database.engine, 'before_cursor_execute', listener)
+    try:
+        service.store_sample(make_sample(start + dt.timedelta(minutes=1), wind=3.0, light=300))
+    finally:
+        event.remove(database.engine, 'before_cursor_execute', listener)
+    assert statements
+    assert not [statement for statement in statements if f'FROM {ArduinoWeatherData.__tablename__} ' in statement.replace('\n', ' ') + ' ']
+
+
+def test_get_history_reads_matching_rollup(database, service):
+    start = dt.datetime(2025, 6, 1, 10, 0)
+    for minute in range(0, 180, 10):
+        service.store_sample(make_sample(start + dt.timedelta(minutes=minute), wind=1.0, light=100))
+
+    async def history(resolution: WeatherResolution):
+        async with database.async_read_session_factory() as session:
+            return (await session.exec(service.history_query(start + dt.timedelta(minutes=30), resolution))).all()
+
+    assert len(asyncio.run(history(WeatherResolution.raw))) == 14
+    assert len(asyncio.run(history(WeatherResolution.minute))) == 15
+    assert [h.timestamp.hour for h in asyncio.run(history(WeatherResolution.hour))] == [10, 11, 12]
+    assert len(asyncio.run(history(WeatherResolution.day))) == 1
+
+
+@pytest.fixture
+def configured_service(service):
+    service.init_config({
+        'anemometer_milli_volt_out_min': 400,
+        'anemometer_milli_volt_out_max': 2000,
+        'anemometer_max_meter_per_sec': 32.4,
+        'arduino_max_milli_input_voltage': 5000,
+        'arduino_input_resolution': 1023,
+        'save_frequency': 1,
+        'local_cache_size': 3,
+    })
+    service.initialize()
+    return service
+
+
+def test_current_weather_is_median_of_cache(configured_service):
+    assert configured_service.get_current_weather() is None
+    for light, rain in [(100, 0), (500, 0), (300, 1), (900, 0)]:
+        configured_service.append_weather_data(ArduinoWeatherData(wind=0, light_1=light, light_2=light / 10, rain=rain))
+    current = configured_service.get_current_weather()
+    assert (current.light_1, current.light_2, current.wind, current.rain) == (500, 50, 0, 0)
+
+
+def test_save_weather_data_stores_current_medians(configured_service):
+    configured_service.append_weather_data(ArduinoWeatherData(wind=0, light_1=100, light_2=10, rain=1))
+    with patch.object(configured_service, "store_sample") as mock_store:
+        configured_service.save_weather_data()
+        assert mock_store.call_args.args[0].light_1 == 100
+
+
+def legacy_wind_speed(value: float) -> float:
+    value_voltage = value * 1023 / 5000
+    if value_voltage < 400:
+        return 0.0
+    return round((value_voltage - 400) / ((2000 - 400) / 32.4) * 3.6, 1)
+
+
+def test_wind_calibration_matches_legacy_conversion(configured_service):
+    values = np.arange(0, 1024, dtype=np.float64)
+    vectorized = configured_service.calibrate('wind', values).tolist()
+    assert vectorized == [configured_service._calibrations['wind'].scalar(value) for value in values]
+    assert vectorized == pytest.approx([legacy_wind_speed(value) for value in values], abs=0.1 + 1e-9)
+
+
+def test_append_weather_batch_orders_by_device_time(configured_service):
+    start = dt.datetime(2025, 6, 1, 10, 0)
+    samples = [
+        ArduinoWeatherSampleSchema(timestamp=start + dt.timedelta(seconds=s), wind=0, light_1=light, light_2=light, rain=rain)
+        for s, light, rain in [(3, 700, 0), (0, 100, 1), (2, 300, 1), (1, 200, 1), (4, 800, 1)]
+    ]
+    configured_service.append_weather_batch(samples)
+    current = configured_service.get_current_weather()
+    assert configured_service._devices['default'].medians['light_1'].window.values() == [300, 700, 800]
+    assert (current.light_1, current.rain) == (700, 1)
+
+
+def test_append_weather_batch_after_single_samples(configured_service):
+    configured_service.append_weather_data(ArduinoWeatherData(wind=500, light_1=1, light_2=1, rain=0))
+    configured_service.append_weather_batch([ArduinoWeatherSampleSchema(wind=500, light_1=v, light_2=v, rain=0) for v in (5, 3)])
+    assert configured_service._devices['default'].medians['light_1'].median() == 3
+    assert configured_service.get_current_weather().wind == configured_service._calibrations['wind'].scalar(500)
+
+
+def test_channel_calibration_from_config(service):
+    service.init_config({
+        'anemometer_milli_volt_out_min': 400,
+        'anemometer_milli_volt_out_max': 2000,
+        'anemometer_max_meter_per_sec': 32.4,
+        'arduino_max_milli_input_voltage': 5000,
+        'arduino_input_resolution': 1023,
+        'save_frequency': 1,
+        'local_cache_size': 3,
+        'calibration': {
+            'light_1': {'kind': 'linear', 'scale': 2, 'offset': 1},
+            'rain': {'kind': 'piecewise', 'points': [(0, 0), (500, 0), (501, 1)]},
+        },
+    })
+    service.initialize()
+    service.append_weather_data(ArduinoWeatherData(wind=0, light_1=10, light_2=10, rain=800))
+    current = service.get_current_weather()
+    assert (current.light_1, current.light_2, current.rain) == (21, 10, 1)
+
+
+def test_recalibrate_stored_samples(database, configured_service):
+    start = dt.datetime(2025, 6, 1, 10, 0)
+    for minute, raw_wind in enumerate([100, 700, 900, 1023]):
+        configured_service.store_sample(make_sample(start + dt.timedelta(minutes=minute), wind=configured_service._calibrations['wind'].scalar(raw_wind), light=100 + minute))
+
+    previous = {'light_1': CalibrationConfig()}
+    configured_service.config.calibration = {'light_1': CalibrationConfig(kind='linear', scale=10)}
+    configured_service.initialize()
+    assert configured_service.recalibrate(previous, chunk_size=3) == 4
+
+    with database.session_scope() as session:
+        samples = session.exec(select(ArduinoWeatherData).order_by(ArduinoWeatherData.timestamp)).all()
+        hour = session.exec(select(ArduinoWeatherHour)).one()
+    assert [s.light_1 for s in samples] == [1000, 1010, 1020, 1030]
+    assert [s.wind for s in samples] == [configured_service._calibrations['wind'].scalar(v) for v in (100, 700, 900, 1023)]
+    assert (hour.samples, hour.light_1_min, hour.light_1_median) == (4, 1000, 1015)
+
+
+
+def test_recalibrate_keeps_rollups_of_deleted_samples(database, configured_service):
+    start = dt.datetime(2025, 6, 1, 10, 0)
+    for minute in range(0, 120, 10):
+        configured_service.store_sample(make_sample(start + dt.timedelta(minutes=minute), wind=1.0, light=100))
+    # retention removed the first hour of raw samples, its rollups are all that is left of it
+    database.clear_old_data(ArduinoWeatherData, start + dt.timedelta(hours=1))
+
+    configured_service.config.calibration = {'light_1': CalibrationConfig(kind='linear', scale=10)}
+    configured_service.initialize()
+    assert configured_service.recalibrate({'light_1': CalibrationConfig()}) == 6
+
+    with database.session_scope() as session:
+        hours = session.exec(select(ArduinoWeatherHour).order_by(ArduinoWeatherHour.timestamp)).all()
+        day = session.exec(select(ArduinoWeatherDay)).one()
+    assert [(h.timestamp.hour, h.samples, h.light_1_max) for h in hours] == [(10, 6, 100), (11, 6, 1000)]
+    assert (day.samples, day.light_1_max) == (12, 100)
+
+def test_devices_have_separate_buffers(configured_service):
+    configured_service.append_weather_data(ArduinoWeatherData(device='greenhouse', wind=0, light_1=10, light_2=10, rain=1))
+    for light in (100, 200, 300, 400, 500):
+        configured_service.append_weather_data(ArduinoWeatherData(wind=0, light_1=light, light_2=light, rain=0))
+    configured_service.append_weather_batch([ArduinoWeatherSampleSchema(wind=0, light_1=v, light_2=v, rain=1) for v in (20, 30)], device='terrace')
+
+    assert configured_service.devices == ['default', 'greenhouse', 'terrace']
+    assert configured_service.get_current_weather().light_1 == 400
+    assert (configured_service.get_current_weather('greenhouse').light_1, configured_service.get_current_weather('greenhouse').rain) == (10, 1)
+    assert configured_service.get_current_weather('terrace').device == 'terrace'
+    assert configured_service.get_current_weather('unknown') is None
+
+
+def test_devices_beyond_the_limit_are_rejected(configured_service):
+    configured_service.config.max_devices = 2
+    configured_service.append_weather_data(ArduinoWeatherData(device='greenhouse', wind=0, light_1=10, light_2=10, rain=1))
+    configured_service.append_weather_data(ArduinoWeatherData(device='terrace', wind=0, light_1=10, light_2=10, rain=1))
+    assert configured_service.accepts('greenhouse') and configured_service.accepts('default')
+    assert not configured_service.accepts('garage')
+    with pytest.raises(ValueError):
+        configured_service.append_weather_batch([ArduinoWeatherSampleSchema(wind=0, light_1=1, light_2=1, rain=0)], device='garage')
+
+    client = TestClient(routes.app)
+    with patch('scarlet.api.routes.arduino_service', configured_service):
+        assert client.post('/weather', json={'device': 'garage', 'wind': 0, 'light_1': 1, 'light_2': 1, 'rain': 0}).status_code == 403
+        assert client.post('/weather/batch', params={'device': 'garage'}, json=[]).status_code == 403
+        assert client.post('/weather/batch', params={'device': 'terrace'}, json=[]).json() == {'accepted': 0}
+    assert configured_service.devices == ['greenhouse', 'terrace']
+
+
+def test_only_listed_devices_are_accepted(configured_service):
+    configured_service.config.devices = ['greenhouse']
+    assert configured_service.accepts('greenhouse') and configured_service.accepts('default')
+    assert not configured_service.accepts('terrace')
+
+
+def test_rollups_and_history_by_device(database, configured_service):
+    start = dt.datetime(2025, 6, 1, 10, 0)
+    for minute in range(3):
+        configured_service.store_sample(make_sample(start + dt.timedelta(minutes=minute), wind=1.0, light=100))
+        greenhouse = make_sample(start + dt.timedelta(minutes=minute), wind=5.0, light=300)
+        greenhouse.device = 'greenhouse'
+        configured_service.store_sample(greenhouse)
+
+    async def history(resolution: WeatherResolution, device: str | None):
+        async with database.async_read_session_factory() as session:
+            return (await session.exec(configured_service.history_query(start - dt.timedelta(minutes=1), resolution, device))).all()
+
+    hours = asyncio.run(history(WeatherResolution.hour, None))
+    assert sorted((h.device, h.samples, h.wind_mean) for h in hours) == [('default', 3, 1.0), ('greenhouse', 3, 5.0)]
+    assert [s.wind for s in asyncio.run(history(WeatherResolution.raw, 'greenhouse'))] == [5.0, 5.0, 5.0]
+    assert len(configured_service.get_history(start - dt.timedelta(minutes=1), device='default')) == 3
+
+    configured_service.rebuild_rollups()
+    assert sorted((h.device, h.samples, h.wind_mean) for h in asyncio.run(history(WeatherResolution.hour, None))) == [('default', 3, 1.0), ('greenhouse', 3, 5.0)]
@@ -0,0 +1,49 @@
+import json
+import os
+from unittest.mock import patch
+
+from benchmarks.run import compare, main, time_case
+from benchmarks.cases import Case
+from benchmarks.load import LoadReport
+
+
+def test_compare_flags_slowdowns_beyond_threshold():
+    baseline = {'fast': {'median': 1.0}, 'slow': {'median': 1.0}, 'removed': {'median': 1.0}}
+    results = {'fast': {'median': 1.2}, 'slow': {'median': 1.3}, 'new': {'median': 5.0}}
+    assert compare(results, baseline, threshold=0.25) == ['slow']
+
+
+def test_main_fails_without_a_baseline_unless_asked_not_to_compare(test_resource_dir):
+    baseline = os.path.join(test_resource_dir, 'baseline.json')
+    report = {'meta': {'seed': 0}, 'results': {'case': {'median': 1.0}}}
+    with patch('benchmarks.run.run', return_value=report):
+        assert main(['--baseline', baseline]) == 1
+        assert main(['--baseline', baseline, '--no-baseline']) == 0
+        assert main(['--baseline', baseline, '--save-baseline']) == 0
+        assert main(['--baseline', baseline]) == 0
+        with open(baseline, 'w') as file:
+            json.dump({**report, 'results': {'case': {'median': 0.5}}}, file)
+        assert main(['--baseline', baseline]) == 1
+
+
+def test_time_case_runs_setup_before_every_repeat():
+    calls = {'setup': 0, 'run': 0}
+    case = Case('count', lambda: calls.__setitem__('run', calls['run'] + 1), number=3,
+                setup=lambda: calls.__setitem__('setup', calls['setup'] + 1))
+    result = time_case(case, repeats=2)
+    assert calls == {'setup': 3, 'run': 7}
+    assert result['number'] == 3 and result['min'] <= result['median']
+
+
+def test_load_report_percentiles_by_route():
+    report = LoadReport()
+    for index in range(100):
+        report.record('GET /blinds', (index + 1) / 1000, 304 if index % 2 else 200)
+    report.record('POST /weather', 0.5, None)
+
+    summary = report.summary(duration=10)
+    assert summary['GET /blinds']['requests'] == 100 and summary['GET /blinds']['rps'] == 10
+    assert summary['GET /blinds']['not_modified'] == 50 and summary['GET /blinds']['errors'] == 0
+    assert summary['GET /blinds']['p50_ms'] == 50.5 and summary['GET /blinds']['max_ms'] == 100
+    assert summary['POST /weather']['errors'] == 1
+    assert 'GET /blinds' in LoadReport.format(summary)
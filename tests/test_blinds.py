@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+
+import scarlet.api.schemas as schemas
+from scarlet.services.blinds import BlindsController
+
+
+@pytest.fixture
+def controller():
+    return BlindsController(temperature_limit=25, light_limit=1000, cloud_cover_limit=50, automation=False, ack_timeout=0.2)
+
+
+def test_ack_when_the_moved_blind_is_reset(controller):
+    command = schemas.BlindsPydanticSchema(left_blind="up", right_blind="nostate")
+
+    async def run():
+        controller.blind_status = command
+        asyncio.get_running_loop().call_later(0.05, setattr, controller, 'blind_status',
+                                              schemas.BlindsPydanticSchema(left_blind="nostate", right_blind="nostate"))
+        return await controller.wait_for_ack(command)
+
+    assert asyncio.run(run())
+    assert controller.blind_status_version == 2
+
+
+def test_no_ack_after_timeout(controller):
+    command = schemas.BlindsPydanticSchema(left_blind="up", right_blind="down")
+
+    async def run():
+        controller.blind_status = command
+        return await controller.wait_for_ack(command)
+
+    assert not asyncio.run(run())
+
+
+def test_controllers_do_not_share_status():
+    first, second = (BlindsController(temperature_limit=25, light_limit=1000, cloud_cover_limit=50, automation=False) for _ in range(2))
+    first.blind_status = schemas.BlindsPydanticSchema(left_blind="up", right_blind="up")
+    assert second.blind_status.left_blind == schemas.BlindState.nostate
+
+
+def test_reloaded_controller_wakes_the_boards_waiting_on_the_replaced_one(controller):
+    reloaded = BlindsController(temperature_limit=30, light_limit=1000, cloud_cover_limit=50, automation=False)
+    command = schemas.BlindsPydanticSchema(left_blind="up", right_blind="nostate")
+
+    async def run():
+        waiting = asyncio.create_task(controller.wait_for_command(0, 5))
+        await asyncio.sleep(0.05)
+        reloaded.take_over(controller)
+        reloaded.blind_status = command
+        return await asyncio.wait_for(waiting, 1)
+
+    assert asyncio.run(run()) == (1, command)
@@ -0,0 +1,67 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from scarlet.api.caching import VersionedCache, cache
+from scarlet.core import config
+
+
+def make_client():
+    app = FastAPI()
+    cache = VersionedCache()
+    state = {'version': 0, 'renders': 0}
+
+    def render() -> bytes:
+        state['renders'] += 1
+        return b'{"value":%d}' % state['version']
+
+    @app.get("/state")
+    async def get_state(request: Request):
+        return await cache.respond(request, 'state', state['version'], render)
+
+    return TestClient(app), state
+
+
+def test_not_modified_until_version_changes():
+    client, state = make_client()
+    first = client.get('/state')
+    assert first.json() == {'value': 0}
+    etag = first.headers['etag']
+
+    assert client.get('/state', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/state', headers={'If-None-Match': f'"other", W/{etag}'}).status_code == 304
+    assert client.get('/state').json() == {'value': 0}
+    assert state['renders'] == 1
+
+    state['version'] += 1
+    changed = client.get('/state', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.json() == {'value': 1}
+    assert changed.headers['etag'] != etag
+
+
+def test_etags_differ_between_processes():
+    assert VersionedCache().etag('state', 0) != VersionedCache().etag('state', 0)
+
+
+def test_reset_after_a_config_reload_changes_the_etags():
+    assert cache.reset in config.store.after_reconfigure
+
+    app = FastAPI()
+    state = {'value': False}
+
+    @app.get("/state")
+    async def get_state(request: Request):
+        return await cache.respond(request, 'reset_state', 0, lambda: b'{"value":%d}' % state['value'], owner='BlindsController')
+
+    @app.get("/other")
+    async def get_other(request: Request):
+        return await cache.respond(request, 'reset_other', 0, lambda: b'{}', owner='IrrigationController')
+
+    client = TestClient(app)
+    etag, other_etag = client.get('/state').headers['etag'], client.get('/other').headers['etag']
+    # a reloaded controller starts again from version 0 with a different state
+    state['value'] = True
+    cache.reset(['BlindsController'])
+    response = client.get('/state', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.json() == {'value': 1}
+    assert client.get('/other', headers={'If-None-Match': other_etag}).status_code == 304
@@ -0,0 +1,49 @@
+import os
+import numpy as np
+import pytest
+from pydantic import ValidationError
+
+from scarlet.core.calibration import CalibrationConfig, compile_calibration
+
+
+@pytest.mark.parametrize("config, raw, expected", [
+    ({}, [1.5, -2.0], [1.5, -2.0]),
+    ({'kind': 'linear', 'scale': 2, 'offset': -1, 'minimum': 0}, [0, 1, 3], [0, 1, 5]),
+    ({'kind': 'linear', 'scale': 0.333, 'decimals': 1}, [1, 10], [0.3, 3.3]),
+    ({'kind': 'piecewise', 'points': [(10, 100), (0, 0), (20, 120)]}, [-5, 5, 15, 30], [0, 50, 110, 120]),
+])
+def test_compiled_curves(config, raw, expected):
+    calibration = compile_calibration(CalibrationConfig(**config))
+    assert calibration(np.array(raw, dtype=float)).tolist() == pytest.approx(expected)
+    assert [calibration.scalar(value) for value in raw] == pytest.approx(expected)
+
+
+def test_lookup_table(test_resource_dir):
+    path = os.path.join(test_resource_dir, 'light.csv')
+    with open(path, 'w') as file:
+        file.write("raw,lux\n0,0\n512,1000\n1023,60000\n")
+    calibration = compile_calibration(CalibrationConfig(kind='lookup', table=path))
+    assert calibration(np.array([256.0, 1023.0])).tolist() == [500, 60000]
+    assert calibration.inverse(np.array([500.0])).tolist() == [256]
+
+
+@pytest.mark.parametrize("config", [
+    {'kind': 'linear', 'scale': 4, 'offset': 3},
+    {'kind': 'piecewise', 'points': [(0, 10), (100, 0)]},
+])
+def test_inverse_round_trips(config):
+    calibration = compile_calibration(CalibrationConfig(**config))
+    raw = np.linspace(0, 100, 11)
+    assert calibration.inverse(calibration(raw)) == pytest.approx(raw)
+
+
+def test_inverse_rejects_non_monotonic_curve():
+    calibration = compile_calibration(CalibrationConfig(kind='piecewise', points=[(0, 0), (1, 10), (2, 5)]))
+    with pytest.raises(ValueError):
+        calibration.inverse(np.array([1.0]))
+
+
+@pytest.mark.parametrize("config", [{'kind': 'piecewise', 'points': [(0, 0)]}, {'kind': 'lookup'}])
+def test_incomplete_curves_are_rejected(config):
+    with pytest.raises(ValidationError):
+        CalibrationConfig(**config)
@@ -1,9 +1,11 @@
 from typing import Callable, Any
+from unittest.mock import patch
+import copy
 import os
+import time
 import pytest
-import pytest_assume
 import yaml
-from scarlet.core import config
+from scarlet.core import config, scheduler
 
 
 class DummyController(config.Controller):
@@ -118,4 +120,95 @@ def test_process_integration(test_resource_dir, cfg: str):
         yaml.dump(cfg, file)
 
     config.Process.run_process(path)
-    
\ No newline at end of file
+    
+
+class ScheduledDummyController(config.Controller):
+    variable1: int
+
+    def schedule_jobs(self):
+        scheduler.service.every(10).minutes.do(self.tick)
+
+    def tick(self):
+        pass
+
+
+def write_config(path: str, cfg: dict):
+    """Replaces the file like an editor does, so the watcher sees a new inode even within the mtime resolution"""
+    with open(f"{path}.new", 'w') as file:
+        yaml.dump(cfg, file)
+    os.replace(f"{path}.new", path)
+
+
+@pytest.fixture
+def store(test_resource_dir):
+    path = os.path.join(test_resource_dir, 'test_config.yaml')
+    write_config(path, {
+        'services': {'dummy_service': {'variable1': 1, 'variable2': 'hello'}},
+        'controllers': {'DummyController': {'variable1': 1, 'variable2': 'hello'}, 'ScheduledDummyController': {'variable1': 1}},
+    })
+    store = config.ConfigStore('test_config_store')
+    store.before_reconfigure.append(scheduler.service.cancel_jobs_of)
+    config.Process.configure_all(path, store.load(path))
+    yield store
+    store.stop()
+    scheduler.service.clear()
+
+
+def test_edits_are_written_atomically_and_coalesced(store):
+    store.init_config({'write_delay': 0.05, 'watch_interval': 60})
+    store.start()
+    with patch.object(store, '_write', wraps=store._write) as write:
+        for value in range(5):
+            store.edit('controllers', 'DummyController', 'variable1', value)
+        time.sleep(0.3)
+    assert write.call_count == 1
+    assert config.Process.load_yaml(store.path)['controllers']['DummyController']['variable1'] == 4
+    assert os.listdir(os.path.dirname(store.path)) == ['test_config.yaml']
+    assert store.reload_if_changed() == []
+
+
+def test_reload_reconfigures_only_changed_sections(store):
+    old_controller = config.Controller.controllers_by_class_name['ScheduledDummyController']
+    (old_job,) = [job for job in scheduler.service.jobs if job.func.__self__ is old_controller]
+    cfg = copy.deepcopy(store.data)
+    cfg['controllers']['ScheduledDummyController']['variable1'] = 2
+    write_config(store.path, cfg)
+
+    reloaded = list()
+    store.after_reconfigure.append(reloaded.append)
+    with patch.object(config.Service.services_by_name['dummy_service'], 'initialize') as initialize, \
+            patch.object(ScheduledDummyController, 'take_over', autospec=True) as take_over:
+        assert store.reload_if_changed() == ['ScheduledDummyController']
+        initialize.assert_not_called()
+    take_over.assert_called_once_with(config.Controller.controllers_by_class_name['ScheduledDummyController'], old_controller)
+    assert reloaded == [['ScheduledDummyController']]
+    controller = config.Controller.controllers_by_class_name['ScheduledDummyController']
+    assert controller.variable1 == 2 and old_job.cancelled
+    assert [job.func.__self__ for job in scheduler.service.jobs if job.func.__name__ == 'tick'] == [controller]
+
+
+def test_invalid_change_keeps_the_running_config(store):
+    cfg = copy.deepcopy(store.data)
+    cfg['services']['dummy_service']['variable1'] = 'not a number'
+    write_config(store.path, cfg)
+    assert store.reload_if_changed() == []
+    assert config.Service.services_by_name['dummy_service'].config.variable1 == 1
+
+    with open(store.path, 'w') as file:
+        file.write("services: [")
+    assert store.reload_if_changed() == []
+
+
+def test_pending_edits_survive_an_external_change(store):
+    store.init_config({'write_delay': 60, 'watch_interval': 60})
+    store.start()
+    store.edit('controllers', 'DummyController', 'variable2', 'edited')
+    cfg = copy.deepcopy(config.Process.load_yaml(store.path))
+    cfg['services']['dummy_service']['variable1'] = 3
+    write_config(store.path, cfg)
+    store.stop()
+
+    written = config.Process.load_yaml(store.path)
+    assert written['services']['dummy_service']['variable1'] == 3
+    assert written['controllers']['DummyController']['variable2'] == 'edited'
+    assert config.Service.services_by_name['dummy_service'].config.variable1 == 3
@@ -0,0 +1,224 @@
+import asyncio
+import datetime as dt
+import os
+import time
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from pydantic import ValidationError
+from sqlmodel import select
+
+from scarlet.db.db import Database, statement_seconds
+from scarlet.db.models import ArduinoWeatherData, BlindAction
+
+
+@pytest.fixture
+def database(test_resource_dir):
+    db = Database('test_database')
+    db.init_config({'database': os.path.join(test_resource_dir, 'test.db')})
+    db.initialize()
+    yield db
+    asyncio.run(db.dispose())
+
+
+def make_weather(timestamp: dt.datetime) -> ArduinoWeatherData:
+    return ArduinoWeatherData(timestamp=timestamp, wind=1.0, light_1=100, light_2=200, rain=0)
+
+
+def test_sync_api_uses_separate_sessions(database):
+    database.add(make_weather(dt.datetime(2025, 1, 1)))
+    database.add_all([make_weather(dt.datetime(2025, 1, 2)), make_weather(dt.datetime(2025, 1, 3))])
+    assert database.get_last(ArduinoWeatherData).timestamp == dt.datetime(2025, 1, 3)
+
+    database.clear_data_after(ArduinoWeatherData, dt.datetime(2025, 1, 2, 12))
+    database.clear_old_data(ArduinoWeatherData, dt.datetime(2025, 1, 1, 12))
+    assert database.get_last(ArduinoWeatherData).timestamp == dt.datetime(2025, 1, 2)
+
+
+def test_get_last_returns_none_without_data(database):
+    assert database.get_last(BlindAction) is None
+
+
+def test_async_api_matches_sync_api(database):
+    async def run():
+        async with database.async_session_factory() as session:
+            await database.add_async(session, make_weather(dt.datetime(2025, 1, 1)))
+            await database.add_all_async(session, [make_weather(dt.datetime(2025, 1, 2)), make_weather(dt.datetime(2025, 1, 3))])
+            await database.clear_data_after_async(session, ArduinoWeatherData, dt.datetime(2025, 1, 2, 12))
+            await database.clear_old_data_async(session, ArduinoWeatherData, dt.datetime(2025, 1, 1, 12))
+            return await database.get_last_async(session, ArduinoWeatherData)
+
+    assert asyncio.run(run()).timestamp == dt.datetime(2025, 1, 2)
+    assert database.get_last(ArduinoWeatherData).timestamp == dt.datetime(2025, 1, 2)
+
+
+def test_get_session_yields_a_new_session_per_request(database):
+    async def open_two():
+        first, second = database.get_session(), database.get_session()
+        sessions = await first.__anext__(), await second.__anext__()
+        await first.aclose()
+        await second.aclose()
+        return sessions
+
+    first, second = asyncio.run(open_two())
+    assert first is not second
+
+
+@pytest.fixture
+def wal_database(test_resource_dir):
+    db = Database('test_wal_database')
+    db.init_config({'database': os.path.join(test_resource_dir, 'test.db'), 'storage_mode': 'wal', 'reader_pool_size': 2})
+    db.initialize()
+    yield db
+    asyncio.run(db.dispose())
+
+
+def test_wal_mode_sets_pragmas(wal_database):
+    with wal_database.session_scope() as session:
+        assert session.exec(text('PRAGMA journal_mode')).scalar() == 'wal'
+        assert session.exec(text('PRAGMA synchronous')).scalar() == 1
+    with wal_database.session_scope(read_only=True) as session:
+        assert session.exec(text('PRAGMA query_only')).scalar() == 1
+
+
+def test_wal_readers_reject_writes(wal_database):
+    with wal_database.session_scope(read_only=True) as session:
+        session.add(make_weather(dt.datetime(2025, 1, 1)))
+        with pytest.raises(OperationalError):
+            session.commit()
+
+
+def test_wal_reads_are_not_blocked_by_open_write(wal_database):
+    wal_database.add(make_weather(dt.datetime(2025, 1, 1)))
+    with wal_database.session_scope() as writer:
+        writer.add(make_weather(dt.datetime(2025, 1, 2)))
+        writer.flush()
+        assert wal_database.get_last(ArduinoWeatherData).timestamp == dt.datetime(2025, 1, 1)
+        writer.commit()
+    assert wal_database.get_last(ArduinoWeatherData).timestamp == dt.datetime(2025, 1, 2)
+
+    async def read_async():
+        async with wal_database.async_read_session_factory() as session:
+            return await wal_database.get_last_async(session, ArduinoWeatherData)
+
+    assert asyncio.run(read_async()).timestamp == dt.datetime(2025, 1, 2)
+
+
+def test_wal_writers_wait_for_the_writer_slot_instead_of_failing_busy(test_resource_dir):
+    db = Database('test_wal_database')
+    # without waiting for the lock sqlite would fail the second writer right away
+    db.init_config({'database': os.path.join(test_resource_dir, 'test.db'), 'storage_mode': 'wal', 'busy_timeout': 0})
+    db.initialize()
+
+    async def write_async():
+        async with db.async_session_factory() as session:
+            await db.add_async(session, make_weather(dt.datetime(2025, 1, 2)))
+
+    async def run():
+        with db.session_scope() as writer:
+            writer.add(make_weather(dt.datetime(2025, 1, 1)))
+            writer.flush()
+            task = asyncio.create_task(write_async())
+            await asyncio.sleep(0.2)
+            assert not task.done()
+            writer.commit()
+        await task
+
+    asyncio.run(run())
+    with db.session_scope(read_only=True) as session:
+        assert sorted(row.timestamp for row in session.exec(select(ArduinoWeatherData))) == [dt.datetime(2025, 1, 1), dt.datetime(2025, 1, 2)]
+    asyncio.run(db.dispose())
+
+
+def test_wal_writer_slot_is_not_given_back_by_a_timed_out_checkout(test_resource_dir):
+    db = Database('test_wal_database')
+    db.init_config({'database': os.path.join(test_resource_dir, 'test.db'), 'storage_mode': 'wal', 'writer_timeout': 0.2})
+    db.initialize()
+
+    async def run():
+        async with db.async_engine.connect():
+            # the failed checkout is checked in, that must not free the slot the async connection holds
+            for _ in range(2):
+                with pytest.raises(TimeoutError):
+                    db.engine.connect()
+        with db.engine.connect() as connection:
+            assert connection.exec_driver_sql('SELECT 1').scalar() == 1
+            # a second sync writer waits in the pool, bounded by writer_timeout as well
+            started = time.monotonic()
+            with pytest.raises(PoolTimeoutError):
+                db.engine.connect()
+            assert time.monotonic() - started < 5
+
+    asyncio.run(run())
+    asyncio.run(db.dispose())
+
+
+def test_clear_returns_deleted_row_count(database):
+    database.add_all([make_weather(dt.datetime(2025, 1, day)) for day in range(1, 11)])
+    assert database.clear_old_data(ArduinoWeatherData, dt.datetime(2025, 1, 3, 12)) == 3
+    assert database.clear_data_after(ArduinoWeatherData, dt.datetime(2025, 1, 8, 12)) == 2
+    assert database.clear_old_data(ArduinoWeatherData, dt.datetime(2025, 1, 3, 12)) == 0
+
+
+def test_clear_old_data_in_chunks(database):
+    database.add_all([make_weather(dt.datetime(2025, 1, 1) + dt.timedelta(minutes=m)) for m in range(25)])
+    assert database.clear_old_data_in_chunks(ArduinoWeatherData, dt.datetime(2025, 1, 1, 0, 20), chunk_size=6) == 20
+    with database.session_scope() as session:
+        assert len(session.exec(select(ArduinoWeatherData)).all()) == 5
+
+
+def test_retention_rejects_unknown_model(test_resource_dir):
+    db = Database('test_retention_database')
+    with pytest.raises(ValidationError):
+        db.init_config({'database': os.path.join(test_resource_dir, 'test.db'), 'retention': {'IrrigationProgram': {'keep_days': 1}}})
+
+
+def test_apply_retention_deletes_and_vacuums(test_resource_dir):
+    path = os.path.join(test_resource_dir, 'test.db')
+    db = Database('test_retention_database')
+    db.init_config({'database': path})
+    db.initialize()
+    now = dt.datetime.now()
+    db.add_all([make_weather(now - dt.timedelta(days=30, minutes=m)) for m in range(5000)] + [make_weather(now)])
+    db.add(BlindAction(timestamp=now - dt.timedelta(days=3), is_user=True, is_left_up=True, is_right_up=True))
+    asyncio.run(db.dispose())
+
+    db.init_config({'database': path, 'retention': {
+        'ArduinoWeatherData': {'keep_days': 7, 'chunk_size': 1000},
+        'BlindAction': {'keep_days': 7},
+    }})
+    db.initialize()
+    size_before = os.path.getsize(path)
+    assert db.apply_retention() == {'ArduinoWeatherData': 5000, 'BlindAction': 0}
+    with db.session_scope() as session:
+        assert session.exec(text('PRAGMA auto_vacuum')).scalar() == 2
+        assert session.exec(text('PRAGMA freelist_count')).scalar() == 0
+    assert os.path.getsize(path) < size_before
+    assert db.get_last(ArduinoWeatherData) is not None
+    asyncio.run(db.dispose())
+
+
+def test_statements_are_timed(database):
+    before = statement_seconds.labels('writer', 'INSERT').count
+    database.add(make_weather(dt.datetime(2025, 1, 1)))
+    assert statement_seconds.labels('writer', 'INSERT').count == before + 1
+
+
+def test_initialize_again_disposes_the_replaced_engines(test_resource_dir):
+    db = Database('test_reload_database')
+    db.init_config({'database': os.path.join(test_resource_dir, 'test.db'), 'storage_mode': 'wal'})
+    db.initialize()
+    db.add(make_weather(dt.datetime(2025, 1, 1)))
+
+    async def read():
+        async with db.async_read_session_factory() as session:
+            return (await session.exec(select(ArduinoWeatherData))).all()
+
+    asyncio.run(read())
+    old_engine, old_async_engine = db.engine, db.async_read_engine
+    assert old_engine.pool.checkedin() == 1 and old_async_engine.sync_engine.pool.checkedin() == 1
+
+    db.initialize()
+    assert old_engine.pool.checkedin() == 0 and old_async_engine.sync_engine.pool.checkedin() == 0
+    assert db.engine is not old_engine and len(asyncio.run(read())) == 1
+    asyncio.run(db.dispose())
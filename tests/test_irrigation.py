@@ -1,15 +1,14 @@
+import asyncio
 import datetime as dt
-import os
-import builtins
 import types
 import pytest
-import polars as pl
-import schedule
 
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import scarlet.db.models as models
 import scarlet.api.schemas as schemas
+import scarlet.core.scheduler as scheduler
+from scarlet.services import irrigation_score
 from scarlet.services.irrigation import IrrigationController
 
 
@@ -45,35 +44,32 @@ def make_session(start_time=None):
 #     with patch.object(controller, "schedule_jobs") as mock_sched:
 #         controller.schedule_jobs()
 #         mock_sched.assert_called_once()
-#         assert any(job.job_func == controller.schedule_jobs for job in schedule.jobs)
+#         assert any(job.func == controller.schedule_jobs for job in scheduler.service.jobs)
 
 
 def test_calculate_score_returns_zero_if_no_weather():
-    with patch("os.path.dirname", return_value=f"/{os.path.join(*__file__.split('/')[:-2])}/scarlet/services"), \
-         patch("scarlet.services.open_weather.service.get_history", return_value=[]):
+    with patch("scarlet.services.irrigation_score.service._window", None), \
+         patch("scarlet.services.irrigation_score.service._catch_up"):
         score = IrrigationController.calculate_score()
         assert score == 0
 
 
-def test_calculate_score_computes_mean(tmp_path):
-    weather_data = [
-        types.SimpleNamespace(model_dump=lambda: {
-            "timestamp": "2025-01-01T00:00:00",
-            "temperature_2m": 20,
-            "relative_humidity_2m": 50,
-            "wind_speed_10m": 10
-        })
-    ]
-    with patch("os.path.dirname", return_value=f"/{os.path.join(*__file__.split('/')[:-2])}/scarlet/services"), \
-         patch("scarlet.services.open_weather.service.get_history", return_value=weather_data):
+def test_calculate_score_computes_mean():
+    weather_data = [models.HistoricalWeather(
+        timestamp=dt.datetime.now() - dt.timedelta(hours=1), temperature_2m=20, relative_humidity_2m=50, cloud_cover=0,
+        precipitation=0, precipitation_probability=0, wind_speed_10m=10, wind_gusts_10m=10)]
+    with patch("scarlet.services.irrigation_score.service._window", None), \
+         patch("scarlet.services.irrigation_score.service._catch_up"):
+        irrigation_score.service.add_hours(weather_data)
         score = IrrigationController.calculate_score()
         assert isinstance(score, float)
-        assert score > 0
-        
+        assert score == pytest.approx(1.17 + 0.3)
+
 
 def test_run_scheduled_session_skips_if_rain(controller):
     session = make_session()
     with patch("scarlet.services.arduino_weather.service.get_current_weather", return_value=types.SimpleNamespace(rain=1)), \
+         patch("scarlet.services.open_weather.service.get_history", return_value=[]), \
          patch("scarlet.db.db.service.add") as mock_add:
         controller.run_scheduled_session(session)
         mock_add.assert_not_called()
@@ -82,22 +78,56 @@ def test_run_scheduled_session_skips_if_rain(controller):
 def test_run_scheduled_session_adds_if_no_rain(controller):
     session = make_session()
     with patch("scarlet.services.arduino_weather.service.get_current_weather", return_value=types.SimpleNamespace(rain=0)), \
+         patch("scarlet.services.open_weather.service.get_history", return_value=[]), \
          patch("scarlet.db.db.service.add") as mock_add:
         controller.run_scheduled_session(session)
         mock_add.assert_called_once()
 
 def test_set_irrigation_status_does_not_add_when_off(controller):
-    session_schema = schemas.IrrigationRunSessionSchema(is_active="off")
-    with patch("scarlet.db.db.service.add") as mock_add:
-        controller.set_irrigation_status(session_schema)
+    session_schema = schemas.IrrigationRunSessionSchema(active="off")
+    with patch("scarlet.db.db.service.add_async") as mock_add:
+        asyncio.run(controller.set_irrigation_status(MagicMock(), session_schema))
         mock_add.assert_not_called()
 
 
 def test_set_automation_false_cancels_jobs(controller):
-    controller._scheduled_jobs = [schedule.every().day.do(lambda: None)]
-    controller._scheduled_sessions = [schedule.every().day.do(lambda: None)]
+    jobs = [scheduler.service.every().day.do(lambda: None), scheduler.service.every().day.do(lambda: None)]
+    controller._scheduled_jobs, controller._scheduled_sessions = jobs[:1], jobs[1:]
     with patch.object(controller, "_self_edit_config") as mock_edit:
         controller.set_automation(False)
         assert controller._scheduled_jobs == []
         assert controller._scheduled_sessions == []
+        assert all(job.cancelled for job in jobs)
         mock_edit.assert_called_once_with(attribute="automation", new_value=False)
+
+
+def test_post_waits_only_until_the_board_acknowledges(controller):
+    controller.ack_timeout = 5
+    command = schemas.IrrigationRunSessionSchema(active="on", zone1=1)
+
+    async def run():
+        with patch("scarlet.db.db.service.add_async"):
+            await controller.set_irrigation_status(MagicMock(), command)
+        asyncio.get_running_loop().call_later(0.1, controller._irrigation_status.set, schemas.IrrigationRunSessionSchema(active="nostate"))
+        return await controller.wait_for_ack(command)
+
+    started = dt.datetime.now()
+    assert asyncio.run(run())
+    assert dt.datetime.now() - started < dt.timedelta(seconds=1)
+    assert controller.get_irrigation_status_version() == 2
+
+
+def test_program_changes_increment_version(controller):
+    with patch("scarlet.db.db.service.add_async"):
+        asyncio.run(controller.set_irrigation_program(MagicMock(), make_program()))
+        asyncio.run(controller.update_irrigation_program(MagicMock(), make_program(name="renamed")))
+    assert controller.programs_version == 2
+
+
+def test_lookups_end_their_transaction_before_the_caller_writes(controller):
+    db_session = AsyncMock()
+    db_session.exec.return_value = MagicMock()
+    program = asyncio.run(controller.get_irrigation_program_by_id(db_session, 1))
+    session = asyncio.run(controller.get_session_by_id(db_session, 1))
+    assert program is db_session.exec.return_value.first() and session is program
+    assert db_session.commit.await_count == 2
@@ -0,0 +1,95 @@
+import asyncio
+import datetime as dt
+import os
+import threading
+import time
+import pytest
+from unittest.mock import patch
+
+from scarlet.db.db import Database
+from scarlet.db.models import HistoricalWeather
+from scarlet.services.irrigation_score import IrrigationScoreService
+
+
+@pytest.fixture
+def database(test_resource_dir):
+    db = Database('test_irrigation_score_database')
+    db.init_config({'database': os.path.join(test_resource_dir, 'test.db')})
+    db.initialize()
+    with patch("scarlet.services.irrigation_score.db_service", db):
+        yield db
+    asyncio.run(db.dispose())
+
+
+@pytest.fixture
+def service(database, test_resource_dir):
+    service = IrrigationScoreService('IrrigationScoreService')
+    service.init_config({'state_path': os.path.join(test_resource_dir, 'score.json')})
+    return service
+
+
+def make_hour(timestamp: dt.datetime, temperature: float = 20, humidity: float = 50, wind: float = 10) -> HistoricalWeather:
+    return HistoricalWeather(timestamp=timestamp, temperature_2m=temperature, relative_humidity_2m=humidity, cloud_cover=0,
+                             precipitation=0, precipitation_probability=0, wind_speed_10m=wind, wind_gusts_10m=0)
+
+
+def hours_ago(hours: int) -> dt.datetime:
+    return dt.datetime.now().replace(minute=0, second=0, microsecond=0) - dt.timedelta(hours=hours)
+
+
+def test_window_adds_and_evicts_hours(service):
+    service.initialize()
+    service.add_hours([make_hour(hours_ago(50), wind=100), make_hour(hours_ago(2), wind=0), make_hour(hours_ago(1), wind=10)])
+    assert service.get_score() == pytest.approx(1.17 + 0.15)
+    assert [hour.timestamp for hour in service.get_breakdown().hours] == [hours_ago(2), hours_ago(1)]
+
+
+def test_hours_outside_the_table_are_shown_but_not_scored(service):
+    service.initialize()
+    service.add_hours([make_hour(hours_ago(2), humidity=105), make_hour(hours_ago(1))])
+    breakdown = service.get_breakdown()
+    assert breakdown.hours[0].score is None
+    assert breakdown.score == pytest.approx(1.17 + 0.3)
+
+
+def test_restart_loads_state_and_reads_only_newer_hours(service, database):
+    database.add_all([make_hour(hours_ago(3)), make_hour(hours_ago(2))])
+    service.initialize()
+    assert len(service.get_breakdown().hours) == 2
+
+    database.clear_old_data(HistoricalWeather, hours_ago(2))
+    database.add_all([make_hour(hours_ago(1), wind=0)])
+    restarted = IrrigationScoreService('IrrigationScoreService')
+    restarted.init_config({'state_path': service.config.state_path})
+    restarted.initialize()
+    assert [hour.timestamp for hour in restarted.get_breakdown().hours] == [hours_ago(3), hours_ago(2), hours_ago(1)]
+    assert restarted.get_score() == pytest.approx(1.17 + 0.2)
+
+
+def test_revised_hours_replace_the_stored_ones(service):
+    service.initialize()
+    service.add_hours([make_hour(hours_ago(2)), make_hour(hours_ago(1))])
+    service.add_hours([make_hour(hours_ago(2), wind=0)])
+    assert [hour.wind_speed_10m for hour in service.get_breakdown().hours] == [0, 10]
+    assert service.get_score() == pytest.approx(1.17 + 0.15)
+
+    restarted = IrrigationScoreService('IrrigationScoreService')
+    restarted.init_config({'state_path': service.config.state_path})
+    restarted.initialize()
+    assert restarted.get_score() == pytest.approx(1.17 + 0.15)
+
+
+def test_window_is_not_read_while_it_is_updated(service):
+    service.initialize()
+    results = list()
+    readers = [threading.Thread(target=lambda: results.append(service.get_breakdown())),
+               threading.Thread(target=lambda: results.append(service.get_score()))]
+    with service._lock:
+        # an update in progress on the scheduler thread
+        for reader in readers:
+            reader.start()
+        time.sleep(0.1)
+        assert results == []
+    for reader in readers:
+        reader.join(timeout=5)
+    assert len(results) == 2
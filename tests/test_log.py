@@ -0,0 +1,121 @@
+import gzip
+import logging
+import os
+import threading
+
+from scarlet.core.log import Log, LogConfig, LogLevels
+
+
+def make_log(test_resource_dir, **config) -> Log:
+    return Log(LogConfig(filename=os.path.join(test_resource_dir, 'test.log'), **config))
+
+
+def test_records_are_written_by_the_listener(test_resource_dir):
+    log = make_log(test_resource_dir)
+    logger = log.logger('test_log_listener')
+    logger.info("hello")
+    log.stop()
+    with open(log.filename) as file:
+        assert "hello" in file.read()
+    assert logger.handlers == [log.queue_handler]
+
+
+def test_only_own_loggers_default_to_info(test_resource_dir):
+    log = make_log(test_resource_dir)
+    assert log.logger('test_log_own').level == logging.INFO
+    logging.getLogger('test_log_configured').setLevel(logging.DEBUG)
+    assert log.logger('test_log_configured').level == logging.DEBUG
+    logging.getLogger('test_log_third_party')
+    log.change_logger('test_log_third_party', LogLevels.warning)
+    assert logging.getLogger('test_log_third_party').handlers == [log.queue_handler]
+    log.stop()
+
+
+def test_size_rotation_compresses_archives(test_resource_dir):
+    log = make_log(test_resource_dir, max_bytes=2000, backup_count=2)
+    logger = log.logger('test_log_rotation')
+    for i in range(200):
+        logger.info(f"line {i:04d} " + "x" * 40)
+    log.stop()
+    archives = sorted(name for name in os.listdir(test_resource_dir) if name.endswith('.gz'))
+    assert archives == ['test.log.1.gz', 'test.log.2.gz']
+    with gzip.open(os.path.join(test_resource_dir, 'test.log.1.gz'), 'rt') as file:
+        assert "line" in file.read()
+
+
+def test_time_rotation(test_resource_dir):
+    log = make_log(test_resource_dir, rotate_hours=1)
+    logger = log.logger('test_log_time_rotation')
+    logger.info("before")
+    log.stop()
+    log.configure(log.config)
+    log.file_output_handler.rollover_at = 0
+    logger.info("after")
+    log.stop()
+    assert os.path.exists(os.path.join(test_resource_dir, 'test.log.1.gz'))
+    with open(log.filename) as file:
+        assert file.read().count('\n') == 1
+
+
+def test_full_queue_drops_instead_of_blocking(test_resource_dir):
+    log = make_log(test_resource_dir, queue_size=10)
+    log.stop()
+    logger = log.logger('test_log_dropping')
+    logger.setLevel(logging.DEBUG)
+    done = threading.Event()
+
+    def burst():
+        for i in range(100):
+            logger.debug(f"debug {i}")
+            logger.info(f"info {i}")
+        done.set()
+
+    threading.Thread(target=burst).start()
+    assert done.wait(timeout=2)
+    assert log.dropped == 190
+    assert log.queue.qsize() == 10
+
+
+class Exploding:
+    def __str__(self):
+        raise AssertionError("formatted a record that is not emitted")
+
+
+def read_log(log: Log) -> list[str]:
+    log.stop()
+    with open(log.filename) as file:
+        return file.read().splitlines()
+
+
+def test_disabled_and_suppressed_records_are_not_formatted(test_resource_dir):
+    log = make_log(test_resource_dir)
+    slog = log.structured('test_log_lazy', every=3600)
+    slog.debug("below level", value=Exploding())
+    slog.info("first", value=1)
+    slog.info("limited", value=Exploding())
+    assert read_log(log)[0].endswith("first value=1")
+
+
+def test_sampling_reports_suppressed_calls(test_resource_dir):
+    log = make_log(test_resource_dir)
+    slog = log.structured('test_log_sampled', sample=3)
+    for i in range(7):
+        slog.info("sample", i=i)
+    lines = read_log(log)
+    assert [line.split(maxsplit=9)[-1] for line in lines] == [
+        "sample i=0", "sample i=3 (+2 suppressed)", "sample i=6 (+2 suppressed)"]
+    assert 'test_log.py' in lines[0]
+
+
+def test_collections_are_summarized():
+    import datetime as dt
+    import numpy as np
+    from types import SimpleNamespace
+    from scarlet.core.log import summarize
+
+    points = [SimpleNamespace(timestamp=dt.datetime(2025, 1, day)) for day in (3, 1, 2)]
+    assert summarize(points) == "3 SimpleNamespace 2025-01-01 00:00:00..2025-01-03 00:00:00"
+    assert summarize([3, 1.5, 2]) == "3 values 1.5..3"
+    assert summarize(np.array([1.0, 4.0])) == "array (2,) 1.0..4.0"
+    assert summarize([]) == "0 items"
+    assert summarize(0.123456) == "0.1235"
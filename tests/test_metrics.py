@@ -0,0 +1,56 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from scarlet.core.metrics import Registry
+from scarlet.api.instrumentation import RequestMetricsMiddleware, request_seconds
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    requests = registry.counter('requests', "Handled requests", ('route',))
+    requests.labels('/a').inc()
+    requests.labels('/a').inc(2)
+    fill = registry.gauge('fill', "Cache fill")
+    fill.set_function(lambda: 0.5)
+    latency = registry.histogram('latency_seconds', "Latency", buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value)
+
+    assert registry.render().splitlines() == [
+        '# HELP requests Handled requests',
+        '# TYPE requests counter',
+        'requests_total{route="/a"} 3',
+        '# HELP fill Cache fill',
+        '# TYPE fill gauge',
+        'fill 0.5',
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        'latency_seconds_sum 3.65',
+        'latency_seconds_count 4',
+    ]
+
+
+def test_register_returns_existing_metric():
+    registry = Registry()
+    assert registry.counter('requests', "Handled requests") is registry.counter('requests', "Handled requests")
+
+
+def test_requests_are_timed_by_route_template():
+    app = FastAPI()
+    app.add_middleware(RequestMetricsMiddleware)
+
+    @app.get("/program/{program_id}")
+    async def get_program(program_id: int):
+        return {'id': program_id}
+
+    client = TestClient(app)
+    before = request_seconds.labels('GET', '/program/{program_id}', '200').count
+    client.get('/program/1')
+    client.get('/program/2')
+    client.get('/missing')
+
+    assert request_seconds.labels('GET', '/program/{program_id}', '200').count == before + 2
+    assert request_seconds.labels('GET', 'unmatched', '404').count >= 1
@@ -1,120 +1,190 @@
+import asyncio
 import datetime as dt
+import threading
+import time
 import pytest
 from unittest.mock import MagicMock, patch
-import polars as pl
 
+from benchmarks.stub import StubOpenMeteo
 from scarlet.db.db import service as db_service
-from scarlet.db.models import Weather, ForecastedWeather, HistoricalWeather
+from scarlet.db.models import ForecastedWeather, HistoricalWeather
+from scarlet.services import irrigation_score
 from scarlet.services.open_weather import OpenWeatherService
 
 
 @pytest.fixture
-def service():
-    return OpenWeatherService("OpenWeatherService")
-
-
-def make_mock_response(json_data):
-    mock_resp = MagicMock()
-    mock_resp.json.return_value = json_data
-    return mock_resp
-
-
-def test_cache_historic_data_no_last_point(service):
-    fake_hourly = {
-        "time": [dt.datetime(2025, 1, 1, 0, 0)],
-        "temperature_2m": [10],
-        "relative_humidity_2m": [50],
-        "cloud_cover": [20],
-        "precipitation": [0],
-        "precipitation_probability": [0],
-        "wind_speed_10m": [5],
-        "wind_gusts_10m": [7],
-    }
-    with patch("requests.get", return_value=make_mock_response({"hourly": fake_hourly})), \
-         patch.object(db_service, "get_last", return_value=None), \
-         patch.object(db_service, "add_all") as mock_add:
-        service._cache_historic_data()
-        assert mock_add.called
-        # Ensure HistoricalWeather objects were created
-        args, _ = mock_add.call_args
-        assert all(isinstance(x, HistoricalWeather) for x in args[0])
-
-
-def test_cache_historic_data_with_last_point_filters(service):
-    fake_hourly = {
-        "time": [dt.datetime(2025, 1, 1, 0, 0), dt.datetime(2025, 1, 2, 0, 0)],
-        "temperature_2m": [10, 12],
-        "relative_humidity_2m": [50, 55],
-        "cloud_cover": [20, 30],
-        "precipitation": [0, 1],
-        "precipitation_probability": [0, 10],
-        "wind_speed_10m": [5, 6],
-        "wind_gusts_10m": [7, 8],
-    }
-    last_point = HistoricalWeather(timestamp=dt.datetime(2025, 1, 1, 12, 0))
-    with patch("requests.get", return_value=make_mock_response({"hourly": fake_hourly})), \
-         patch.object(db_service, "get_last", return_value=last_point), \
-         patch.object(db_service, "add_all") as mock_add:
-        service._cache_historic_data()
-        args, _ = mock_add.call_args
-        # Only later timestamps should remain
-        assert all(dp.timestamp > last_point.timestamp for dp in args[0])
-
-
-def test_cache_forecasted_weather_data(service):
-    fake_hourly = {
-        "time": [dt.datetime(2025, 1, 1, 0, 0)],
-        "temperature_2m": [10],
-        "relative_humidity_2m": [50],
-        "cloud_cover": [20],
-        "precipitation": [0],
-        "precipitation_probability": [0],
-        "wind_speed_10m": [5],
-        "wind_gusts_10m": [7],
-    }
-    with patch("requests.get", return_value=make_mock_response({"hourly": fake_hourly})), \
-         patch.object(db_service, "clear_data_after") as mock_clear, \
-         patch.object(db_service, "add_all") as mock_add:
-        service._cache_forecasted_weather_data()
-        assert mock_clear.called
-        assert mock_add.called
-        args, _ = mock_add.call_args
-        assert all(isinstance(x, ForecastedWeather) for x in args[0])
-
-
-def test_cache_sun_data(service):
-    sunset_str = "2025-01-01T17:00:00"
-    sunrise_str = "2025-01-02T06:00:00"
-    with patch("requests.get", return_value=make_mock_response({
-        "daily": {"sunset": [sunset_str], "sunrise": [sunrise_str]}
-    })):
-        service._cache_sun_data()
-        assert service.sunset_time == dt.datetime.fromisoformat(sunset_str)
-        assert service.sunrise_time == dt.datetime.fromisoformat(sunrise_str)
-
-
-def test_get_current_data_success(service):
-    fake_current = {
-        "time": [dt.datetime(2025, 1, 1, 0, 0)],
-        "temperature_2m": [10],
-        "relative_humidity_2m": [50],
-        "cloud_cover": [20],
-        "precipitation": [0],
-        "precipitation_probability": [0],
-        "wind_speed_10m": [5],
-        "wind_gusts_10m": [7],
+def stub():
+    with StubOpenMeteo() as server:
+        yield server.handler, server.url
+
+
+@pytest.fixture
+def service(stub):
+    service = OpenWeatherService("OpenWeatherService")
+    service.init_config({'url': stub[1]})
+    yield service
+    service.close()
+
+
+def hourly(*times: dt.datetime) -> dict:
+    return {
+        "time": [t.isoformat(timespec='minutes') for t in times],
+        "temperature_2m": [10] * len(times),
+        "relative_humidity_2m": [50] * len(times),
+        "cloud_cover": [20] * len(times),
+        "precipitation": [0] * len(times),
+        "precipitation_probability": [0] * len(times),
+        "wind_speed_10m": [5] * len(times),
+        "wind_gusts_10m": [7] * len(times),
     }
-    with patch("requests.get", return_value=make_mock_response({"current": fake_current})):
-        result = service.get_current_data()
-        assert isinstance(result, Weather)
 
 
-def test_get_current_data_fallback(service):
+def current() -> dict:
+    return {key: value[0] for key, value in hourly(dt.datetime(2025, 1, 1)).items()}
+
+
+def revalidated(service: OpenWeatherService, timeout: float = 5):
+    """Waits until the revalidation finished, its done callback stores the result before clearing it"""
+    deadline = time.monotonic() + timeout
+    while service._revalidation is not None:
+        assert time.monotonic() < deadline, "revalidation did not finish"
+        time.sleep(0.01)
+
+
+def test_refresh_uses_one_combined_request(service, stub):
+    handler, _ = stub
+    today = dt.date.today()
+    midnight = dt.datetime.combine(today, dt.time())
+    handler.response = {
+        "hourly": hourly(midnight - dt.timedelta(days=1), midnight + dt.timedelta(days=1)),
+        "current": current(),
+        "daily": {"time": [(today - dt.timedelta(days=1)).isoformat(), today.isoformat()],
+                  "sunrise": ["2025-01-01T07:00", f"{today}T06:00"],
+                  "sunset": ["2025-01-01T16:00", f"{today}T17:00"]},
+    }
+    with patch.object(db_service, "get_last", return_value=None), \
+         patch.object(db_service, "clear_data_after") as mock_clear, \
+         patch.object(db_service, "add_all") as mock_add, \
+         patch.object(irrigation_score.service, "add_hours") as mock_score:
+        service.refresh()
+
+    assert len(handler.requests) == 1
+    assert {'hourly', 'daily', 'current'} <= handler.requests[0].keys()
+    historic, forecast = (call.args[0] for call in mock_add.call_args_list)
+    assert [dp.timestamp for dp in historic] == [midnight - dt.timedelta(days=1)]
+    assert all(isinstance(x, HistoricalWeather) for x in historic)
+    mock_score.assert_called_once_with(historic)
+    assert [dp.timestamp for dp in forecast] == [midnight + dt.timedelta(days=1)]
+    assert all(isinstance(x, ForecastedWeather) for x in forecast)
+    assert mock_clear.call_args.args[1] == midnight + dt.timedelta(days=1)
+    assert service.sunrise_time == dt.datetime.combine(today, dt.time(6))
+    assert service.sunset_time == dt.datetime.combine(today, dt.time(17))
+
+
+def test_refresh_filters_stored_history(service, stub):
+    handler, _ = stub
+    handler.response = {"hourly": hourly(dt.datetime(2025, 1, 1), dt.datetime(2025, 1, 2))}
+    last_point = HistoricalWeather(timestamp=dt.datetime(2025, 1, 1, 12, 0))
+    with patch.object(db_service, "get_last", return_value=last_point), \
+         patch.object(db_service, "add_all") as mock_add, \
+         patch.object(irrigation_score.service, "add_hours"):
+        service.refresh()
+    assert [dp.timestamp for dp in mock_add.call_args_list[0].args[0]] == [dt.datetime(2025, 1, 2)]
+
+
+def test_connection_is_reused(service, stub):
+    handler, _ = stub
+    handler.response = {"current": current()}
+    for _ in range(3):
+        service.refresh()
+    assert len(handler.requests) == 3
+    assert len(handler.connections) == 1
+
+
+def test_concurrent_requests_are_merged(service, stub):
+    handler, _ = stub
+    handler.response = {"current": current()}
+    handler.delay = 0.2
+
+    async def run():
+        return await asyncio.gather(*(service.client.fetch({'current': 'temperature_2m'}) for _ in range(5)))
+
+    assert asyncio.run(run()) == [handler.response] * 5
+    assert len(handler.requests) == 1
+
+
+def test_concurrent_sync_requests_are_merged(service, stub):
+    handler, _ = stub
+    handler.response = {"current": current()}
+    handler.delay = 0.2
+    barrier = threading.Barrier(8)
+    results = []
+
+    def run():
+        barrier.wait()
+        results.append(service.client.fetch_sync({'current': 'temperature_2m'}))
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [handler.response] * 8
+    assert len(handler.requests) == 1
+
+
+def test_current_data_is_served_from_cache(service, stub):
+    handler, _ = stub
+    handler.response = {"current": current()}
+    service.refresh()
+    for _ in range(3):
+        assert service.get_current_data().timestamp == dt.datetime(2025, 1, 1)
+    assert len(handler.requests) == 1
+
+
+def test_stale_current_data_is_returned_while_revalidating(service, stub):
+    handler, _ = stub
+    handler.response = {"current": current()}
+    service.refresh()
+    service.config.current_ttl = 0
+    handler.response = {"current": {**current(), "time": "2025-01-02T00:00"}}
+    handler.delay = 0.2
+
+    assert [service.get_current_data().timestamp for _ in range(3)] == [dt.datetime(2025, 1, 1)] * 3
+    revalidated(service)
+    service.config.current_ttl = 300
+    assert service.get_current_data().timestamp == dt.datetime(2025, 1, 2)
+    assert len(handler.requests) == 2
+
+
+def test_empty_cache_falls_back_to_history(service, stub):
+    handler, _ = stub
+    handler.response = {"current": current()}
+    hist = HistoricalWeather(timestamp=dt.datetime(2024, 12, 31, 23, 0))
+    with patch.object(db_service, "get_last", return_value=hist):
+        assert service.get_current_data() == hist
+    revalidated(service)
+    assert service.get_current_data().timestamp == dt.datetime(2025, 1, 1)
+
+
+def test_too_stale_current_data_is_dropped(service, stub):
+    handler, _ = stub
+    handler.response = {"current": current()}
+    service.refresh()
+    service.config.current_max_staleness = 0
+    hist = HistoricalWeather(timestamp=dt.datetime(2024, 12, 31, 23, 0))
+    with patch.object(db_service, "get_last", return_value=hist):
+        assert asyncio.run(service.get_current_data_async()) == hist
+
+
+def test_failed_api_falls_back_to_history(service):
+    service.close()
+    service.config.url = 'http://127.0.0.1:9/v1/forecast'
     hist = HistoricalWeather(timestamp=dt.datetime(2025, 1, 1, 0, 0))
-    with patch("requests.get", side_effect=Exception("fail")), \
-         patch.object(db_service, "get_last", return_value=hist):
-        result = service.get_current_data()
-        assert result == hist
+    with patch.object(db_service, "get_last", return_value=hist):
+        assert service.get_current_data() == hist
+        revalidated(service)
+        assert service.get_current_data() == hist
 
 
 def test_get_closest_history_and_get_history(service):
@@ -123,7 +193,9 @@ def test_get_closest_history_and_get_history(service):
     fake_exec.all.return_value = ["h1", "h2"]
     fake_session = MagicMock()
     fake_session.exec.return_value = fake_exec
+    fake_scope = MagicMock()
+    fake_scope.return_value.__enter__.return_value = fake_session
 
-    with patch.object(db_service, "session", fake_session):
+    with patch.object(db_service, "session_scope", fake_scope):
         assert service.get_closest_history(dt.datetime.now()) == "closest"
         assert service.get_history(dt.datetime.now()) == ["h1", "h2"]
@@ -0,0 +1,80 @@
+import time
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from scarlet.api import routes
+from scarlet.core.profiler import SamplingProfiler
+from scarlet.api.profiling import ProfilingMiddleware, service
+
+
+def busy_loop(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(100))
+
+
+def wait_for_profiles(count: int) -> list[str]:
+    deadline = time.monotonic() + 5
+    while len(service.list_profiles()) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with service._busy:
+        return service.list_profiles()
+
+
+@pytest.fixture
+def client(test_resource_dir):
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware)
+
+    @app.get("/slow")
+    def slow():
+        busy_loop(0.1)
+        return {}
+
+    yield TestClient(app), test_resource_dir
+    service.init_config({})
+
+
+def test_sampler_collapses_stacks():
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    busy_loop(0.1)
+    profiler.stop()
+
+    assert profiler.samples > 0
+    assert any('busy_loop (test_profiling.py' in stack and stack.startswith('MainThread;') for stack in profiler.stacks)
+    stack, count = profiler.collapsed().splitlines()[0].rsplit(' ', 1)
+    assert int(count) > 0
+
+
+def test_requested_profile_needs_admin_token(client):
+    client, directory = client
+    service.init_config({'admin_token': 'secret', 'directory': directory, 'interval': 0.001})
+
+    assert 'x-profile' not in client.get('/slow', headers={'X-Profile': '1'}).headers
+    assert 'x-profile' not in client.get('/slow', headers={'X-Profile': '1', 'X-Admin-Token': 'wrong'}).headers
+    assert 'x-profile' not in client.get('/slow', headers={'X-Profile': '1', 'X-Admin-Token': 'sécret'.encode()}).headers
+    assert not service.authorized('sécret')
+    assert TestClient(routes.app).get('/admin/profiles', headers={'X-Admin-Token': 'sécret'.encode()}).status_code == 403
+    name = client.get('/slow?profile=1', headers={'X-Admin-Token': 'secret'}).headers['x-profile']
+
+    assert wait_for_profiles(1) == [name]
+    assert 'busy_loop' in service.read_profile(name)
+    assert service.read_profile('../test.collapsed') is None
+
+
+def test_sampled_profiles_are_pruned(client):
+    client, directory = client
+    service.init_config({'sample_rate': 2, 'directory': directory, 'interval': 0.001, 'max_files': 1})
+    service.initialize()
+
+    headers = [client.get('/slow').headers for _ in range(4)]
+    assert ['x-profile' in h for h in headers] == [False, True, False, True]
+    assert wait_for_profiles(1) == [headers[-1]['x-profile']]
+
+
+def test_disabled_by_default(client):
+    client, _ = client
+    assert not service.enabled
+    assert 'x-profile' not in client.get('/slow').headers
@@ -0,0 +1,103 @@
+import asyncio
+import datetime as dt
+import os
+import sqlite3
+import pytest
+from sqlmodel import select
+
+from scarlet.api.schemas import WeatherResolution
+from scarlet.api.streaming import keyset
+from scarlet.db.db import Database
+from scarlet.db.models import ArduinoWeatherData, HistoricalWeather, ForecastedWeather, BlindAction, RanIrrigationSessionHistory, IrrigationProgramSession, ArduinoWeatherDay
+from scarlet.services.arduino_weather import ArduinoWeather
+from scarlet.services.open_weather import OpenWeatherService
+from scarlet.services.irrigation import IrrigationController
+
+
+@pytest.fixture
+def database(test_resource_dir):
+    db = Database('test_plan_database')
+    db.init_config({'database': os.path.join(test_resource_dir, 'test.db')})
+    db.initialize()
+    yield db
+    asyncio.run(db.dispose())
+
+
+def query_plan(database: Database, query) -> list[str]:
+    compiled = query.compile(dialect=database.engine.dialect, compile_kwargs={"render_postcompile": True})
+    params = [compiled.params[name] for name in compiled.positiontup]
+    params = [p.isoformat(sep=' ') if isinstance(p, dt.datetime) else p for p in params]
+    with database.engine.connect() as connection:
+        return [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", tuple(params))]
+
+
+def is_full_scan(detail: str) -> bool:
+    return detail.startswith('SCAN') and 'USING' not in detail
+
+
+@pytest.mark.parametrize("query", [
+    pytest.param(Database._last_query(ArduinoWeatherData).limit(1), id="get_last ArduinoWeatherData"),
+    pytest.param(Database._last_query(HistoricalWeather).limit(1), id="get_last HistoricalWeather"),
+    pytest.param(Database._last_query(ForecastedWeather).limit(1), id="get_last ForecastedWeather"),
+    pytest.param(Database._last_query(BlindAction).limit(1), id="get_last BlindAction"),
+    pytest.param(Database._last_query(RanIrrigationSessionHistory).limit(1), id="get_last RanIrrigationSessionHistory"),
+    pytest.param(ArduinoWeather.history_query(dt.datetime(2025, 1, 1)), id="ArduinoWeather.get_history"),
+    pytest.param(ArduinoWeather.history_query(dt.datetime(2025, 1, 1), WeatherResolution.hour), id="ArduinoWeather.get_history hour rollup"),
+    pytest.param(ArduinoWeather.history_query(dt.datetime(2025, 1, 1), device='greenhouse'), id="ArduinoWeather.get_history device"),
+    pytest.param(ArduinoWeather.history_query(dt.datetime(2025, 1, 1), WeatherResolution.minute, 'greenhouse'), id="ArduinoWeather.get_history device rollup"),
+    pytest.param(select(ArduinoWeatherDay).where(ArduinoWeatherDay.timestamp == dt.datetime(2025, 1, 1)), id="rollup bucket lookup"),
+    pytest.param(OpenWeatherService.history_query(dt.datetime(2025, 1, 1)), id="OpenWeatherService.get_history"),
+    pytest.param(OpenWeatherService._closest_history_query(dt.datetime(2025, 1, 1)).limit(1), id="OpenWeatherService.get_closest_history"),
+    pytest.param(IrrigationController.historical_sessions_query(), id="IrrigationController.get_historical_sessions"),
+    pytest.param(keyset(ArduinoWeather.history_query(dt.datetime(2025, 1, 1), device='greenhouse'), ArduinoWeatherData,
+                        (dt.datetime(2025, 1, 2), 10)).limit(100), id="history keyset page"),
+    pytest.param(select(IrrigationProgramSession).where(IrrigationProgramSession.program_id.in_([1, 2])), id="program sessions"),
+])
+def test_hot_queries_use_an_index(database, query):
+    plan = query_plan(database, query)
+    assert not [detail for detail in plan if is_full_scan(detail)], plan
+
+
+def test_missing_indexes_are_created_for_existing_database(test_resource_dir):
+    path = os.path.join(test_resource_dir, 'old.db')
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE arduinoweatherdata (id INTEGER PRIMARY KEY, timestamp DATETIME NOT NULL, wind FLOAT NOT NULL, "
+                       "light_1 FLOAT NOT NULL, light_2 FLOAT NOT NULL, rain INTEGER NOT NULL)")
+    connection.close()
+
+    db = Database('test_plan_database')
+    db.init_config({'database': path})
+    db.initialize()
+    asyncio.run(db.dispose())
+
+    connection = sqlite3.connect(path)
+    indexes = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    connection.close()
+    assert 'ix_arduinoweatherdata_timestamp' in indexes
+
+
+def test_device_columns_and_indexes_are_migrated(test_resource_dir):
+    path = os.path.join(test_resource_dir, 'old.db')
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE arduinoweatherdata (id INTEGER PRIMARY KEY, timestamp DATETIME NOT NULL, wind FLOAT NOT NULL, "
+                       "light_1 FLOAT NOT NULL, light_2 FLOAT NOT NULL, rain INTEGER NOT NULL)")
+    connection.execute("INSERT INTO arduinoweatherdata (timestamp, wind, light_1, light_2, rain) VALUES ('2025-01-01 00:00:00', 1, 2, 3, 0)")
+    connection.execute("CREATE TABLE arduinoweatherday (id INTEGER PRIMARY KEY, timestamp DATETIME NOT NULL, samples INTEGER NOT NULL, "
+                       + ", ".join(f"{channel}_{stat} FLOAT NOT NULL" for channel in ('wind', 'light_1', 'light_2') for stat in ('min', 'max', 'mean', 'median'))
+                       + ", rain_fraction FLOAT NOT NULL)")
+    connection.execute("CREATE UNIQUE INDEX ix_arduinoweatherday_timestamp ON arduinoweatherday (timestamp)")
+    connection.commit()
+    connection.close()
+
+    db = Database('test_plan_database')
+    db.init_config({'database': path})
+    db.initialize()
+    with db.session_scope() as session:
+        assert session.exec(select(ArduinoWeatherData)).one().device == 'default'
+    asyncio.run(db.dispose())
+
+    connection = sqlite3.connect(path)
+    indexes = {row[1]: row[2] for row in connection.execute("PRAGMA index_list(arduinoweatherday)")}
+    connection.close()
+    assert indexes['ix_arduinoweatherday_timestamp'] == 0
+    assert indexes['ix_arduinoweatherday_device_timestamp'] == 1
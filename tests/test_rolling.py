@@ -0,0 +1,57 @@
+import datetime as dt
+import random
+import statistics
+import pytest
+
+from scarlet.core.rolling import RingBuffer, RollingMedian, TimeWindowMean
+
+
+def test_ring_buffer_keeps_last_values():
+    buffer = RingBuffer(3)
+    assert [buffer.append(v) for v in (1.0, 2.0, 3.0, 4.0, 5.0)] == [None, None, None, 1.0, 2.0]
+    assert buffer.values() == [3.0, 4.0, 5.0]
+    assert buffer.last() == 5.0
+    assert len(buffer) == 3
+
+
+def test_ring_buffer_rejects_empty_capacity():
+    with pytest.raises(ValueError):
+        RingBuffer(0)
+
+
+@pytest.mark.parametrize("capacity", [1, 2, 5, 50])
+def test_rolling_median_matches_statistics_median(capacity):
+    rng = random.Random(capacity)
+    median = RollingMedian(capacity)
+    window = list()
+    assert median.median() is None
+    for _ in range(2000):
+        value = float(rng.choice([rng.randint(0, 10), rng.uniform(-100, 100)]))
+        median.append(value)
+        window = (window + [value])[-capacity:]
+        assert median.median() == statistics.median(window)
+
+
+def test_rolling_median_heaps_stay_bounded():
+    median = RollingMedian(10)
+    for value in range(10000):
+        median.append(float(value % 7 if value % 2 else -value))
+    assert len(median._low) + len(median._high) <= 4 * 10
+    assert median.median() == statistics.median(median.window.values())
+
+
+def test_time_window_mean_evicts_expired_values():
+    start = dt.datetime(2025, 1, 1)
+    window = TimeWindowMean(dt.timedelta(hours=2))
+    assert window.mean() is None
+    for hour, value in enumerate([1.0, None, 3.0, 5.0]):
+        window.append(start + dt.timedelta(hours=hour), value, hour)
+    assert window.items() == [2, 3]
+    assert window.mean() == 4.0
+    assert not window.append(start, 100.0)
+    assert window.append(start + dt.timedelta(hours=2), 1.0, 'revised')
+    assert window.items() == ['revised', 3] and window.mean() == 3.0
+    assert window.append(start + dt.timedelta(hours=2, minutes=30), 6.0, 'late')
+    assert window.items() == ['revised', 'late', 3] and window.mean() == 4.0
+    window.evict(start + dt.timedelta(hours=3))
+    assert window.mean() is None and len(window) == 0
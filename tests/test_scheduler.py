@@ -0,0 +1,120 @@
+import asyncio
+import datetime as dt
+import threading
+import time
+import pytest
+
+from scarlet.core.scheduler import Scheduler, CancelJob
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler('test_scheduler')
+    scheduler.init_config({'max_workers': 2, 'default_timeout': 5})
+    return scheduler
+
+
+def run_for(scheduler: Scheduler, seconds: float):
+    async def run():
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(seconds)
+        task.cancel()
+        await scheduler.stop()
+
+    asyncio.run(run())
+
+
+def test_registration_computes_next_run(scheduler):
+    now = dt.datetime.now()
+    daily = scheduler.every().day.at("03:30").do(lambda: None)
+    assert daily.next_run.time() == dt.time(3, 30) and now < daily.next_run <= now + dt.timedelta(days=1)
+    weekly = scheduler.every().monday.at("02:00").do(lambda: None)
+    assert weekly.next_run.weekday() == 0 and now < weekly.next_run <= now + dt.timedelta(weeks=1)
+    hourly = scheduler.every().hour.at(":15").do(lambda: None)
+    assert hourly.next_run.minute == 15 and now < hourly.next_run <= now + dt.timedelta(hours=1)
+    interval = scheduler.every(10).minutes.do(lambda: None)
+    assert (interval.next_run - now).total_seconds() == pytest.approx(600, abs=1)
+    assert sorted(scheduler.jobs, key=id) == sorted([daily, weekly, hourly, interval], key=id)
+    assert [job.next_run for job in scheduler.jobs] == sorted(job.next_run for job in scheduler.jobs)
+    with pytest.raises(ValueError):
+        scheduler.every(2).day
+    with pytest.raises(ValueError):
+        scheduler.every(5).seconds.at("03:00")
+
+
+def test_jobs_run_off_the_event_loop(scheduler):
+    loop_thread = threading.get_ident()
+    calls = list()
+    scheduler.every(1).seconds.do(lambda: calls.append(threading.get_ident()))
+    run_for(scheduler, 2.3)
+    assert len(calls) == 2
+    assert loop_thread not in calls
+
+
+def test_running_job_is_not_started_again(scheduler):
+    running, started = list(), list()
+
+    def slow():
+        running.append(1)
+        started.append(len(running))
+        time.sleep(1.5)
+        running.pop()
+
+    scheduler.every(1).seconds.timeout(0.5).do(slow)
+    run_for(scheduler, 3.4)
+    assert max(started) == 1
+    assert len(started) == 2
+
+
+def test_timed_out_coroutine_job_is_cancelled(scheduler):
+    outcomes = list()
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+            outcomes.append('finished')
+        except asyncio.CancelledError:
+            outcomes.append('cancelled')
+            raise
+
+    async def run():
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(1.6)
+        # checked before the loop shuts down, which would cancel any task still left
+        assert outcomes == ['cancelled'] and not job.running
+        task.cancel()
+        await scheduler.stop()
+
+    job = scheduler.every(1).seconds.timeout(0.3).do(slow)
+    asyncio.run(run())
+
+
+def test_cancel_job_and_coroutine_jobs(scheduler):
+    calls = list()
+
+    async def once():
+        calls.append('async')
+        return CancelJob
+
+    scheduler.every(1).seconds.do(once)
+    cancelled = scheduler.every(1).seconds.do(lambda: calls.append('sync'))
+    scheduler.cancel_job(cancelled)
+    run_for(scheduler, 2.3)
+    assert calls == ['async']
+    assert scheduler.jobs == []
+
+
+def test_job_added_while_running_is_picked_up(scheduler):
+    calls = list()
+
+    async def run():
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.1)
+        threading.Thread(target=lambda: scheduler.every(1).seconds.do(lambda: calls.append(1))).start()
+        await asyncio.sleep(1.3)
+        task.cancel()
+        await scheduler.stop()
+
+    scheduler.config.max_sleep = 60
+    asyncio.run(run())
+    assert calls == [1]
@@ -0,0 +1,43 @@
+import asyncio
+import threading
+import time
+
+from scarlet.core.state import StateChannel
+
+
+def test_wait_for_returns_when_set_from_another_thread():
+    channel = StateChannel('on')
+
+    async def run():
+        threading.Timer(0.1, channel.set, args=('nostate',)).start()
+        started = time.monotonic()
+        acknowledged = await channel.wait_for(lambda state: state == 'nostate', timeout=5)
+        return acknowledged, time.monotonic() - started
+
+    acknowledged, elapsed = asyncio.run(run())
+    assert acknowledged
+    assert elapsed < 1
+
+
+def test_wait_for_times_out():
+    channel = StateChannel('on')
+
+    async def run():
+        channel.set('still on')
+        return await channel.wait_for(lambda state: state == 'nostate', timeout=0.1)
+
+    assert not asyncio.run(run())
+
+
+def test_wait_newer_long_polls():
+    channel = StateChannel('nostate')
+
+    async def run():
+        assert await channel.wait_newer(-1, timeout=5) == (0, 'nostate')
+        assert await channel.wait_newer(0, timeout=0.05) == (0, 'nostate')
+        waiting = asyncio.create_task(channel.wait_newer(0, timeout=5))
+        await asyncio.sleep(0.05)
+        channel.set('up')
+        return await waiting
+
+    assert asyncio.run(run()) == (1, 'up')
@@ -0,0 +1,70 @@
+import asyncio
+import datetime as dt
+import io
+import json
+import os
+import polars as pl
+import pytest
+from pyarrow import ipc
+from unittest.mock import patch
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from scarlet.api.schemas import HistoryFormat
+from scarlet.api.streaming import history_response
+from scarlet.db.db import Database
+from scarlet.db.models import ArduinoWeatherData
+from scarlet.services.arduino_weather import ArduinoWeather
+
+start = dt.datetime(2025, 6, 1)
+
+
+@pytest.fixture
+def client(test_resource_dir):
+    db = Database('test_streaming_database')
+    db.init_config({'database': os.path.join(test_resource_dir, 'test.db')})
+    db.initialize()
+    # two samples per timestamp, so pages and chunks end between rows of the same time
+    db.add_all([ArduinoWeatherData(timestamp=start + dt.timedelta(minutes=index // 2), device=f"board {index % 2}",
+                                   wind=index, light_1=1, light_2=2, rain=0) for index in range(10)])
+    app = FastAPI()
+
+    @app.get("/history")
+    async def get_history(until: dt.datetime | None = None, cursor: str | None = None, limit: int | None = None,
+                          format: HistoryFormat = HistoryFormat.json):
+        return await history_response(ArduinoWeather.history_query(start - dt.timedelta(seconds=1), until=until), ArduinoWeatherData,
+                                      format, cursor, limit)
+
+    with patch("scarlet.api.streaming.db_service", db), patch("scarlet.api.streaming.chunk_size", 3):
+        yield TestClient(app)
+    asyncio.run(db.dispose())
+
+
+def test_json_pages_follow_the_cursor(client):
+    winds, cursor = list(), None
+    while True:
+        response = client.get('/history', params={'limit': 4, **({'cursor': cursor} if cursor else {})})
+        winds += [row['wind'] for row in response.json()]
+        cursor = response.headers.get('x-next-cursor')
+        if cursor is None:
+            break
+    assert winds == list(range(10))
+    assert client.get('/history', params={'cursor': 'yesterday'}).status_code == 400
+
+
+def test_ndjson_streams_the_range(client):
+    response = client.get('/history', params={'format': 'ndjson', 'until': (start + dt.timedelta(minutes=3)).isoformat()})
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert [json.loads(line)['wind'] for line in response.text.splitlines()] == list(range(6))
+
+
+def test_arrow_chunks_form_one_stream(client):
+    response = client.get('/history', params={'format': 'arrow', 'cursor': f"{start.isoformat()},1"})
+    frame = pl.read_ipc_stream(io.BytesIO(response.content))
+    assert frame['wind'].to_list() == list(range(1, 10))
+    assert [batch.num_rows for batch in ipc.open_stream(response.content)] == [3, 3, 3]
+    assert frame['device'].to_list()[:2] == ['board 1', 'board 0']
+    assert frame.schema['timestamp'] == pl.Datetime('us')
+
+    empty = client.get('/history', params={'format': 'arrow', 'until': start.isoformat()})
+    assert pl.read_ipc_stream(io.BytesIO(empty.content)).columns == list(ArduinoWeatherData.model_fields)